@@ -30,37 +30,94 @@
 # $ python invalidationgame.py -w 50 -w 50 -s 50 -s 50 --log-level DEBUG
 
 import argparse
+import array
+import bisect
 import random
 import pprint
 import statistics
 import datetime
+import json
 import logging
+import math
+import operator
 import os
 from stat import *
 import configparser
+import csv
+import struct
+import sys
+import time
+import hashlib
+import heapq
+import platform
+import re
 
 __author__ = "Marcelo Martins (stakey.club)"
 __license__ = "GNU GPL 3"
 __version__ = "0.1.2"
 
-simulations = {}
-adversaries = {}
-block_diff_2 = list()
-block_diff_6 = list()
-sim_duration_times = list()
-batch_start_time = datetime.datetime.now()
-batch_end_time = datetime.datetime.now()
+probability_cache = {}
+# Set by config_logging(): hot paths check these flags before building any log message
+log_info_enabled = False
+log_debug_enabled = False
+# Simulator of a worker process (see init_worker())
+worker_simulator = None
 
+# Default values of the configuration file
 block_hash_space = 10000             # 10000 (instead of 100) allows for two floating point hashpower number
 pos_avg_ticket_pool_size = 40960
 # Number of blocks with 3 votes: 5617; 4 votes: 22561; 5 votes: 401716; Total blocks: 429894 (100%)
 pos_blocks_with_5votes = 391045      # Numbers from Decred blockchain
 pos_blocks_with_4votes = 21881       # Extracted from dcrdata PostgreSQL database
 pos_blocks_with_3votes = 5526        # from 08.02.16 to 08.02.20
-pos_blocks_with_votes = pos_blocks_with_5votes + pos_blocks_with_4votes + pos_blocks_with_3votes
-pos_prop_blocks_5votes = pos_blocks_with_5votes / pos_blocks_with_votes
-pos_prop_blocks_4votes = pos_blocks_with_4votes / pos_blocks_with_votes
-pos_prop_blocks_3votes = pos_blocks_with_3votes / pos_blocks_with_votes
+
+numpy_chunk_size = 16384             # Simulations run in lockstep by --engine numpy
+numpy_max_adversaries = 10           # --engine numpy keeps 2^A block hash counts per simulation
+event_seen, event_found = 0, 1       # --engine event: blocks seen are handled before blocks found at the same time
+min_simulations_for_precision = 30   # Simulations run before --target-precision is checked
+random_buffer_min_size = 64          # Draws of the first chunk of a RandomBuffer; chunks double up to
+random_buffer_size = 4096            # this many draws
+# Second byte (from the top) of a double from 1 to 2: exponent bits set, 4 random bits of mantissa
+random_mantissa_bits = bytes(0xf0 | (b & 0x0f) for b in range(256))
+
+# Scenarios run by --benchmark; the NumPy engine runs numpy_benchmark_factor times more simulations
+benchmark_scenarios = [
+    {"name": "pow_50_50", "pow": [50, 50], "pos": [], "simulations": 200},
+    {"name": "pow_90_10", "pow": [90, 10], "pos": [], "simulations": 300},
+    {"name": "pos_50_50", "pow": [50, 50], "pos": [50, 50], "simulations": 50},
+    {"name": "rewind_2", "pow": [50, 50], "pos": [], "rewind_blocks": 2, "rewind_adv": 1, "simulations": 200},
+    {"name": "rewind_6", "pow": [50, 50], "pos": [], "rewind_blocks": 6, "rewind_adv": 1, "simulations": 300},
+    {"name": "many_adversaries", "pow": [10] * 10, "pos": [10] * 10, "simulations": 20},
+    {"name": "large_pools", "pow": [50, 50], "pos": [50, 50], "simulations": 4,
+     "config": {"block_hash_space": 1000000, "pos_avg_ticket_pool_size": 409600}},
+]
+numpy_benchmark_factor = 100
+
+# Phases timed by --metrics-file, events counted and upper bounds (seconds) of the histograms of durations
+metrics_phases = ["simulation", "pow_draw", "pos_vote", "calc_distance", "output", "numpy_chunk"]
+metrics_counters = ["simulations", "cycles", "empty_draws", "pos_invalidations"]
+metrics_buckets = [1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0]
+
+# Options a job of --serve can set (sent by --submit from its command line); the server runs the job
+# with its own workers, without output files, cache nor checkpoints
+server_job_options = ["seed", "engine", "drawmode", "votesampling", "confidence", "targetprecision",
+                      "probabilitymodel", "importancetilt", "importancevotetilt", "importanceadv", "propagationdelay"]
+server_progress_simulations = 100    # Simulations per progress event of a --serve job (scalar engine)
+
+# --trace-file: fixed-size records (simulation, cycle, event, online tickets, owned tickets, distance,
+# block hash, bitmask of adversaries) kept in a ring buffer
+trace_magic = b"IGTRACE1"
+trace_header = struct.Struct("<8sIIQ")
+trace_record = struct.Struct("<IIBBBBqQ")
+trace_pow_draw, trace_pos_vote, trace_distance, trace_rewind = 1, 2, 3, 4
+trace_event_names = {trace_pow_draw: "pow_draw", trace_pos_vote: "pos_vote", trace_distance: "distance",
+                     trace_rewind: "rewind"}
+
+# --results-store: a header and one file of fixed-width values per column, appended in blocks of rows
+results_store_format = 1
+results_store_block = 65536
+where_operators = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge, "=": operator.eq,
+                   "==": operator.eq, "!=": operator.ne}
 
 
 def restricted_float(x):
@@ -85,12 +142,94 @@ def restricted_int(x):
     return x
 
 
+def restricted_confidence(x):
+    x = restricted_float(x)
+    if not 0.0 < x < 100.0:
+        raise argparse.ArgumentTypeError("%r not in range (0.0, 100.0)" % (x,))
+    return x
+
+
+def restricted_positive_float(x):
+    try:
+        x = float(x)
+    except ValueError:
+        raise argparse.ArgumentTypeError("%r not a floating-point literal" % (x,))
+
+    if not x > 0:
+        raise argparse.ArgumentTypeError("%r not greater then 0" % (x,))
+    return x
+
+
+def restricted_tilt(x):
+    if x == 'auto':
+        return x
+    try:
+        x = float(x)
+    except ValueError:
+        raise argparse.ArgumentTypeError("%r not a floating-point literal nor auto" % (x,))
+
+    if not x > 0:
+        raise argparse.ArgumentTypeError("%r not greater then 0" % (x,))
+    return x
+
+
+def restricted_range(x):
+    # START:STOP[:STEP] (STOP included, STEP defaults to 1) or a comma-separated list of values
+    try:
+        if ':' in x:
+            bounds = [float(v) for v in x.split(':')]
+            start, stop, step = bounds if len(bounds) == 3 else bounds + [1.0]
+            if step <= 0 or stop < start:
+                raise ValueError
+            values = [round(start + i * step, 2) for i in range(int(round((stop - start) / step, 6)) + 1)]
+        else:
+            values = [float(v) for v in x.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("%r not a START:STOP[:STEP] range or a list of values" % (x,))
+
+    if not all(0.0 <= v <= 100.0 for v in values):
+        raise argparse.ArgumentTypeError("%r not in range [0.0, 100.0]" % (x,))
+    return values
+
+
+def restricted_rewind_range(x):
+    # START:STOP[:STEP] or a list of numbers of rewind blocks, from 0 to the 6-block difference that ends a simulation
+    try:
+        if ':' in x:
+            bounds = [int(v) for v in x.split(':')]
+            start, stop, step = bounds if len(bounds) == 3 else bounds + [1]
+            if step <= 0 or stop < start:
+                raise ValueError
+            values = list(range(start, stop + 1, step))
+        else:
+            values = [int(v) for v in x.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("%r not a START:STOP[:STEP] range or a list of int literals" % (x,))
+
+    if not all(0 <= v <= 6 for v in values):
+        raise argparse.ArgumentTypeError("%r not in range [0, 6]" % (x,))
+    return values
+
+
 def restricted_mode(x):
     if x != 'w' and x != 'a':
         raise argparse.ArgumentTypeError("%r not equal 'w' or 'a'" % (x,))
     return x
 
 
+def restricted_condition(x):
+    # COLUMN OP VALUE condition of --where, kept with its text; adversaries (A0, A1, ...) stand for their index
+    match = re.fullmatch(r"\s*([\w.-]+?)\s*(<=|>=|==|!=|<|>|=)\s*(A?)(-?[\d.]+)\s*", x)
+    if not match:
+        raise argparse.ArgumentTypeError("%r not a condition like 2-block-diff<10 or winner=A1" % (x,))
+    column, op, adv, value = match.groups()
+    try:
+        value = int(value) if adv else float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("%r not a numeric literal" % (adv + value,))
+    return column, op, value, column + op + adv + match.group(4)
+
+
 def restricted_regular_file(file):
     if os.path.isfile(file):
         # Avoid sockets, fifos, symbolic links, etc
@@ -104,41 +243,179 @@ def restricted_regular_file(file):
     return file
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-v", "--version", dest='version', action='store_true', help="Prints version")
-parser.add_argument("-o", "--output", dest='outputfile', help="Saves simulations to output file",
-                    default='invalidationgame.json5', type=restricted_regular_file)
-parser.add_argument("-w", "--pow", dest='pow', help="Informs adversaries' PoW hashpower",
-                    action='append', type=restricted_float)
-parser.add_argument("-s", "--pos", dest='pos', help="Informs adversaries' PoS stake size",
-                    action='append', type=restricted_float)
-parser.add_argument("-i", "--simulations", dest='simulations', help="Number of simulations to be run",
-                    default=1, type=restricted_int)
-parser.add_argument("-c", "--config", dest='configfile', help="Configuration file", default='invalidationgame.conf',
-                    type=restricted_regular_file)
-parser.add_argument("--verbose", dest='verbose', action='store_true', help="Prints the simulation at the end")
-parser.add_argument("--log-level", dest='loglevel', default='ERROR', help="Logs this level and above to the screen")
-parser.add_argument("--log-file", dest='logfile', default='invalidationgame.log',
-                    help="Logs to the selected file. Default: invalidationgame.log", type=restricted_regular_file)
-parser.add_argument("--log-mode", dest='logmode', default='w',
-                    help="Overwrite (w) or append (a) to log file. Default: w", type=restricted_mode)
-parser.add_argument("--output-mode", dest='outputmode', default='w',
-                    help="Overwrite (w) or append (a) to output file. Default: w", type=restricted_mode)
-parser.add_argument("--rewind-blocks", dest='rewind_blocks', default=0,
-                    help="Number of blocks to pre-mine for an adversary. Default: 0", type=restricted_int)
-parser.add_argument("--rewind-adv", dest='rewind_adv', default=0,
-                    help="Which adversary will be ahead in number of blocks (advantage). Default: 0",
-                    type=restricted_int)
-parser.add_argument("--no-output-json", dest='nooutputjson', action='store_true',
-                    help="Doesn't output the simulations to a JSON file at the end")
-parser.add_argument("--no-erase-prob", dest='noeraseprob', action='store_true',
-                    help="Doesn't erase prob_block_hashes from adversary array object")
-parser.add_argument("--no-erase-drawn", dest='noerasedrawn', action='store_true',
-                    help="Doesn't erase drawn_blocks from adversary array object")
-parser.add_argument("--no-create-config", dest='nocreateconfig', action='store_true',
-                    help="Doesn't create the configuration file from default values")
-parser.add_argument("--runtest", dest='runtest', action='store_true', help="Tests basic functionality and exits")
-args = parser.parse_args()
+def build_parser():
+    # Options of the command line; a Scenario takes any of them by its destination
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--version", dest='version', action='store_true', help="Prints version")
+    parser.add_argument("-o", "--output", dest='outputfile', help="Saves simulations to output file",
+                        default='invalidationgame.json5', type=restricted_regular_file)
+    parser.add_argument("-w", "--pow", dest='pow', help="Informs adversaries' PoW hashpower",
+                        action='append', type=restricted_float)
+    parser.add_argument("-s", "--pos", dest='pos', help="Informs adversaries' PoS stake size",
+                        action='append', type=restricted_float)
+    parser.add_argument("-i", "--simulations", dest='simulations', help="Number of simulations to be run",
+                        default=1, type=restricted_int)
+    parser.add_argument("-c", "--config", dest='configfile', help="Configuration file", default='invalidationgame.conf',
+                        type=restricted_regular_file)
+    parser.add_argument("--verbose", dest='verbose', action='store_true', help="Prints the simulation at the end")
+    parser.add_argument("--log-level", dest='loglevel', default='ERROR', help="Logs this level and above to the screen")
+    parser.add_argument("--log-file", dest='logfile', default='invalidationgame.log',
+                        help="Logs to the selected file. Default: invalidationgame.log", type=restricted_regular_file)
+    parser.add_argument("--log-mode", dest='logmode', default='w',
+                        help="Overwrite (w) or append (a) to log file. Default: w", type=restricted_mode)
+    parser.add_argument("--output-mode", dest='outputmode', default='w',
+                        help="Overwrite (w) or append (a) to output file. Default: w", type=restricted_mode)
+    parser.add_argument("--rewind-blocks", dest='rewind_blocks', default=0,
+                        help="Number of blocks to pre-mine for an adversary. Default: 0", type=restricted_int)
+    parser.add_argument("--rewind-adv", dest='rewind_adv', default=0,
+                        help="Which adversary will be ahead in number of blocks (advantage). Default: 0",
+                        type=restricted_int)
+    parser.add_argument("--no-output-json", dest='nooutputjson', action='store_true',
+                        help="Doesn't output the simulations to a JSON file at the end")
+    parser.add_argument("--no-erase-prob", dest='noeraseprob', action='store_true',
+                        help="Doesn't erase prob_block_hashes from adversary array object")
+    parser.add_argument("--no-erase-drawn", dest='noerasedrawn', action='store_true',
+                        help="Doesn't erase drawn_blocks from adversary array object")
+    parser.add_argument("--no-create-config", dest='nocreateconfig', action='store_true',
+                        help="Doesn't create the configuration file from default values")
+    parser.add_argument("--draw-mode", dest='drawmode', default='scan', choices=['scan', 'direct'],
+                        help="PoW draw mode: scan draws block hashes until one has an owner, direct samples the "
+                             "winners in a single step and reports the skipped draws. Default: scan")
+    parser.add_argument("--engine", dest='engine', default='scalar', choices=['scalar', 'numpy', 'event'],
+                        help="Simulation engine: scalar runs one simulation at a time, numpy runs thousands of "
+                             "simulations in lockstep (requires NumPy), event draws the time each adversary finds its "
+                             "next block, in continuous time, whatever the block hash space. Default: scalar")
+    parser.add_argument("--propagation-delay", dest='propagationdelay', default=None, action='append',
+                        type=restricted_float,
+                        help="--engine event: time (in average block intervals) before a block is seen by the other "
+                             "adversaries and built on by the miners of its own; blocks found meanwhile are stale. One "
+                             "value for every adversary, or one per adversary. Default: 0")
+    parser.add_argument("--workers", dest='workers', default=1, type=restricted_int,
+                        help="Number of processes running simulations in parallel. Default: 1")
+    parser.add_argument("--seed", dest='seed', default=None, type=int,
+                        help="Seeds the random number generators, making the batch of simulations reproducible")
+    parser.add_argument("--replay-sim", dest='replaysim', default=None, type=int,
+                        help="Runs only this simulation (counting from 0) of the batch seeded by --seed, drawing the "
+                             "same numbers as in the whole batch, to debug it on its own")
+    parser.add_argument("--output-format", dest='outputformat', default='pprint', choices=['pprint', 'json', 'ndjson'],
+                        help="Output file format: pprint (Python object), json, or ndjson (one JSON line per "
+                             "simulation, written as soon as it finishes, and a summary line at the end). Default: "
+                             "pprint")
+    parser.add_argument("--confidence", dest='confidence', default=95.0, type=restricted_confidence,
+                        help="Confidence level (%%) of the intervals reported in the summary. Default: 95")
+    parser.add_argument("--target-precision", dest='targetprecision', default=None, type=restricted_positive_float,
+                        help="Stops the batch as soon as the confidence intervals of the simulations won (in "
+                             "percentage points) and of the 2 and 6-block difference averages are no wider than +/- "
+                             "this value. -i is the maximum number of simulations")
+    parser.add_argument("--trace-file", dest='tracefile', default=None, type=restricted_regular_file,
+                        help="Records cycle events (drawn block hash, winners, votes, distance) to this binary file")
+    parser.add_argument("--trace-size", dest='tracesize', default=1000000, type=restricted_int,
+                        help="Number of events kept by --trace-file; older events are overwritten. Default: 1000000")
+    parser.add_argument("--decode-trace", dest='decodetrace', default=None,
+                        help="Prints the events recorded in a --trace-file and exits")
+    parser.add_argument("--vote-sampling", dest='votesampling', default='tickets',
+                        choices=['tickets', 'hypergeometric'],
+                        help="PoS vote sampling: tickets draws ticket numbers from the ticket pool, hypergeometric "
+                             "draws the number of votes owned by each adversary, whatever the ticket pool size. "
+                             "Default: tickets")
+    parser.add_argument("--sweep-pow", dest='sweeppow', default=None, type=restricted_range,
+                        help="Runs a batch of simulations for each attacker hashpower in this range (START:STOP[:STEP] "
+                             "or a list of values); the attacker is the --rewind-adv adversary and the other one has "
+                             "the remaining hashpower")
+    parser.add_argument("--sweep-pos", dest='sweeppos', default=None, type=restricted_range,
+                        help="Runs a batch of simulations for each attacker stake size in this range")
+    parser.add_argument("--sweep-rewind", dest='sweeprewind', default=None, type=restricted_rewind_range,
+                        help="Runs a batch of simulations for each number of rewind blocks in this range")
+    parser.add_argument("--sweep-file", dest='sweepfile', default='invalidationgame_sweep.csv',
+                        type=restricted_regular_file,
+                        help="Saves one row per sweep point to this CSV file. Default: invalidationgame_sweep.csv")
+    parser.add_argument("--probability-model", dest='probabilitymodel', default='poisson', choices=['poisson', 'exact'],
+                        help="Attacker success probability: poisson is the approximation of the Bitcoin whitepaper, "
+                             "exact is the negative binomial formula by Rosenfeld. Default: poisson")
+    parser.add_argument("--analytic", dest='analytic', action='store_true',
+                        help="Solves the race between 2 adversaries exactly (win probabilities and expected 2 and "
+                             "6-block differences) instead of running simulations")
+    parser.add_argument("--cache-dir", dest='cachedir', default=None,
+                        help="Keeps the results of seeded simulations in this directory, so that later batches of the "
+                             "same scenario and seed only run the simulations not found there (requires --seed)")
+    parser.add_argument("--cache-size", dest='cachesize', default=1024, type=restricted_int,
+                        help="Size limit (MB) of --cache-dir; least recently used results are evicted. Default: 1024")
+    parser.add_argument("--checkpoint", dest='checkpoint', default=None, type=restricted_regular_file,
+                        help="Saves the state of the batch to this file periodically and when interrupted, "
+                             "so that it can be resumed with --resume")
+    parser.add_argument("--checkpoint-every", dest='checkpointevery', default=60, type=restricted_int,
+                        help="Seconds between checkpoints. Default: 60")
+    parser.add_argument("--resume", dest='resume', action='store_true',
+                        help="Resumes the batch from the last --checkpoint, giving the same results as an "
+                             "uninterrupted batch")
+    parser.add_argument("--importance-tilt", dest='importancetilt', default=None, type=restricted_tilt,
+                        help="Importance sampling: draws the block hashes owned only by the attacker "
+                             "(--importance-adv) this many times more often, and those the attacker doesn't own this "
+                             "many times less often, weighting each simulation by its likelihood ratio to estimate "
+                             "rare attacker wins with a lower variance. auto swaps the chances of the attacker and of "
+                             "the others")
+    parser.add_argument("--importance-vote-tilt", dest='importancevotetilt', default=None, type=restricted_float,
+                        help="Importance sampling: tilts the number of votes owned by the attacker, when it won PoW, "
+                             "by this factor per vote")
+    parser.add_argument("--importance-adv", dest='importanceadv', default=None, type=int,
+                        help="Attacker favoured by importance sampling. Default: the adversary with the least "
+                             "hashpower")
+    parser.add_argument("--paired", dest='paired', action='store_true',
+                        help="Runs every simulation under PoW only and under PoW + PoS (-s and every --paired-pos "
+                             "stake split) with common random numbers, the same PoW draws in every variant, and "
+                             "reports the changes of the winner, the 6-block difference and the blocks lost, "
+                             "simulation by simulation")
+    parser.add_argument("--paired-pos", dest='pairedpos', default=None, action='append', type=restricted_range,
+                        help="Adds this stake split (a comma-separated stake size per adversary, like 40,60) to the "
+                             "paired comparison. Can be repeated")
+    parser.add_argument("--serve", dest='serve', action='store_true',
+                        help="Runs a local job server: clients (--submit) send scenarios, run by a pool of --workers "
+                             "processes, and receive their progress and summary. Identical jobs submitted while one of "
+                             "them runs are run once")
+    parser.add_argument("--serve-address", dest='serveaddress', default='127.0.0.1:8765',
+                        help="Address of the job server: HOST:PORT, or unix:PATH for a Unix socket. "
+                             "Default: 127.0.0.1:8765")
+    parser.add_argument("--submit", dest='submit', action='store_true',
+                        help="Runs the batch on the job server at --serve-address instead of in this process, printing "
+                             "its progress")
+    parser.add_argument("--metrics-file", dest='metricsfile', default=None, type=restricted_regular_file,
+                        help="Counts and times the phases of the simulations (PoW draws, empty draws, PoS votes and "
+                             "invalidations, calc_distance, output) and saves the totals and histograms to this file "
+                             "at the end of the batch")
+    parser.add_argument("--metrics-format", dest='metricsformat', default='json', choices=['json', 'prometheus'],
+                        help="Format of --metrics-file: json, or prometheus (text exposition format). Default: json")
+    parser.add_argument("--metrics-every", dest='metricsevery', default=None, type=restricted_int,
+                        help="Also saves --metrics-file every this many simulations")
+    parser.add_argument("--summary-only", dest='summaryonly', action='store_true',
+                        help="Drops every simulation as soon as it finishes, keeping only its outcome (winner, 2 and "
+                             "6-block differences, blocks of each adversary) in a fixed-size record for the output "
+                             "file")
+    parser.add_argument("--summary-memory", dest='summarymemory', default=64, type=restricted_int,
+                        help="Memory ceiling (MB) of the records kept by --summary-only; the records of the "
+                             "simulations beyond it are dropped, the summary still covers them. Default: 64")
+    parser.add_argument("--results-store", dest='resultsstore', default=None,
+                        help="Appends the outcome of every simulation (winner, 2 and 6-block differences, blocks of "
+                             "each adversary) to the columnar results store in this directory, created if needed")
+    parser.add_argument("--query-store", dest='querystore', default=None,
+                        help="Prints the aggregates of the simulations kept in a --results-store directory that match "
+                             "every --where condition, and exits")
+    parser.add_argument("--where", dest='where', default=None, action='append', type=restricted_condition,
+                        help="Condition of --query-store on a column: COLUMN OP VALUE, where OP is <, <=, >, >=, = or "
+                             "!=, like 2-block-diff<10, winner=A1 or sum_blocks.A0>=3. Can be repeated")
+    parser.add_argument("--benchmark", dest='benchmark', action='store_true',
+                        help="Runs the benchmark scenarios with the selected engine and workers, reporting simulations "
+                             "and cycles per second, peak memory and time per phase, and exits")
+    parser.add_argument("--benchmark-file", dest='benchmarkfile', default='invalidationgame_benchmark.json',
+                        type=restricted_regular_file,
+                        help="Saves the benchmark results to this JSON file. Default: invalidationgame_benchmark.json")
+    parser.add_argument("--benchmark-baseline", dest='benchmarkbaseline', default=None,
+                        help="Compares the benchmark with the results saved in this file (a previous "
+                             "--benchmark-file); the run fails if a scenario got slower than --benchmark-threshold")
+    parser.add_argument("--benchmark-threshold", dest='benchmarkthreshold', default=20.0, type=restricted_float,
+                        help="Slowdown (%%) of the simulations per second of a scenario that fails the comparison with "
+                             "--benchmark-baseline. Default: 20")
+    parser.add_argument("--runtest", dest='runtest', action='store_true', help="Tests basic functionality and exits")
+    return parser
 
 
 def print_version():
@@ -146,644 +423,3702 @@ def print_version():
     exit(0)
 
 
-def sanity_check(adv_hashpower, adv_stake, rewind_adv):
-    if type(adv_hashpower) == list:
-        if len(adv_hashpower) < 2:
-            print("Error: When simulating PoW attacks, a minimum of 2 adversaries are required. Use --help for help.")
-            exit(1)
-    else:
-        print("Error: When simulating PoW attacks, a minimum of 2 adversaries are required. Use --help for help.")
-        exit(1)
+class ScenarioError(ValueError):
+    # Settings that can't be simulated: the command line prints the message and exits with exit_code
 
-    total_pow_hashpower = sum(round(float(x), 2) for x in adv_hashpower)
-    if total_pow_hashpower != 100:
-        print("Error: Total hashpower must sum 100, but summed", str(total_pow_hashpower))
-        exit(2)
+    def __init__(self, message, exit_code=1):
+        super().__init__(message)
+        self.exit_code = exit_code
 
-    if adv_stake:
-        total_pos_stake = sum(round(float(x), 2) for x in adv_stake)
-        if total_pos_stake != 100:
-            print("Error: Total staked must sum 100, but summed", str(total_pos_stake))
-            exit(3)
+    def __reduce__(self):
+        # Raised in worker processes too: keeps the exit code when pickled back to the main process
+        return ScenarioError, (str(self), self.exit_code)
 
-        if len(adv_hashpower) != len(adv_stake):
-            print("Error: The number of PoW and PoS adversaries don't match")
-            exit(1)
 
-    if rewind_adv + 1 > len(adv_hashpower):     # rewind_adv starts in 0
-        print("Error: Adversary in advantage and hashpower settings don't match")
-        exit(4)
+def default_config_values():
+    # Values of the configuration file used when it doesn't set them
+    return {'block_hash_space': block_hash_space, 'pos_avg_ticket_pool_size': pos_avg_ticket_pool_size,
+            'pos_blocks_with_5votes': pos_blocks_with_5votes, 'pos_blocks_with_4votes': pos_blocks_with_4votes,
+            'pos_blocks_with_3votes': pos_blocks_with_3votes}
 
 
 def create_config(config_file):
-    if not args.nocreateconfig:
-        global pos_avg_ticket_pool_size, pos_blocks_with_5votes, pos_blocks_with_4votes, pos_blocks_with_3votes, \
-            block_hash_space
-        # Will keep variables with default values from the beginning
-        config = configparser.ConfigParser()
-        config.optionxform = lambda option: option
-        config['TICKET_POOL'] = {'AverageTicketPoolSize': str(pos_avg_ticket_pool_size),
-                                 'BlocksWith5Votes': str(pos_blocks_with_5votes),
-                                 'BlocksWith4Votes': str(pos_blocks_with_4votes),
-                                 'BlocksWith3Votes': str(pos_blocks_with_3votes)}
-        config['HASH_SPACE'] = {'BlockHashSpace': str(block_hash_space)}
-        # Creates a default config file
-        try:
-            with open(config_file, 'w') as cfh:
-                config.write(cfh)
-        except PermissionError:
-            logging.error("Missing write permission while saving configuration to", config_file)
-            pass
-        else:
-            logging.info("Saved configuration to " + config_file)
+    # Will keep variables with default values from the beginning
+    config = configparser.ConfigParser()
+    config.optionxform = lambda option: option
+    config['TICKET_POOL'] = {'AverageTicketPoolSize': str(pos_avg_ticket_pool_size),
+                             'BlocksWith5Votes': str(pos_blocks_with_5votes),
+                             'BlocksWith4Votes': str(pos_blocks_with_4votes),
+                             'BlocksWith3Votes': str(pos_blocks_with_3votes)}
+    config['HASH_SPACE'] = {'BlockHashSpace': str(block_hash_space)}
+    # Creates a default config file
+    try:
+        with open(config_file, 'w') as cfh:
+            config.write(cfh)
+    except PermissionError:
+        logging.error("Missing write permission while saving configuration to", config_file)
+        pass
+    else:
+        logging.info("Saved configuration to " + config_file)
 
 
-def read_config(config_file):
-    global pos_avg_ticket_pool_size, pos_blocks_with_5votes, pos_blocks_with_4votes, pos_blocks_with_3votes, \
-        block_hash_space, pos_blocks_with_votes, pos_prop_blocks_5votes, pos_prop_blocks_4votes, pos_prop_blocks_3votes
-    # Reads the config file
+def read_config(config_file, create=True):
+    # Reads the config file: returns its values, or no values (the defaults) if it has none
     config = configparser.ConfigParser()
     config.read(config_file)
     if not config.sections():
-        create_config(config_file)
-    else:
-        pos_avg_ticket_pool_size = restricted_int(int(config['TICKET_POOL']['AverageTicketPoolSize']))
-        pos_blocks_with_5votes = restricted_int(int(config['TICKET_POOL']['BlocksWith5Votes']))
-        pos_blocks_with_4votes = restricted_int(int(config['TICKET_POOL']['BlocksWith4Votes']))
-        pos_blocks_with_3votes = restricted_int(int(config['TICKET_POOL']['BlocksWith3Votes']))
-        block_hash_space = restricted_int(int(config['HASH_SPACE']['BlockHashSpace']))
-        # Recalculate ticket proportions with read values
-        pos_blocks_with_votes = pos_blocks_with_5votes + pos_blocks_with_4votes + pos_blocks_with_3votes
-        pos_prop_blocks_5votes = pos_blocks_with_5votes / pos_blocks_with_votes
-        pos_prop_blocks_4votes = pos_blocks_with_4votes / pos_blocks_with_votes
-        pos_prop_blocks_3votes = pos_blocks_with_3votes / pos_blocks_with_votes
-
-
-def calc_hashpower(adv_hashpower, adv_stake):
-    global adversaries
-    adversaries = {}
-    for idx, a in enumerate(adv_hashpower):
-        adv_id = "A" + str(idx)
-        adversaries[adv_id] = {}
-        adversaries[adv_id]["hashpower"] = a
-        adversaries[adv_id]["drawn_block_hashes"] = list()
-        adversaries[adv_id]["chain"] = {}
-        adversaries[adv_id]["sum_blocks"] = 0
-
-        # Won't remove the block hashes already selected; one block hash can be owned by two adversaries
-        # This only means that they can mine a block roughly at the same time t;
-        adversaries[adv_id]["prob_block_hashes"] = \
-            random.sample(range(block_hash_space), k=round(round(float(a), 2) * 100))
-
-    if args.pos:
-        ticket_pool = range(pos_avg_ticket_pool_size)
-        for idx, s in enumerate(adv_stake):
+        create and create_config(config_file)
+        return {}
+    return {'pos_avg_ticket_pool_size': restricted_int(int(config['TICKET_POOL']['AverageTicketPoolSize'])),
+            'pos_blocks_with_5votes': restricted_int(int(config['TICKET_POOL']['BlocksWith5Votes'])),
+            'pos_blocks_with_4votes': restricted_int(int(config['TICKET_POOL']['BlocksWith4Votes'])),
+            'pos_blocks_with_3votes': restricted_int(int(config['TICKET_POOL']['BlocksWith3Votes'])),
+            'block_hash_space': restricted_int(int(config['HASH_SPACE']['BlockHashSpace']))}
+
+
+def check_config_values(config_values):
+    # Values of the configuration file overridden by a Simulator, a Scenario or a job of --serve
+    for name, value in config_values.items():
+        if name not in default_config_values():
+            raise ScenarioError("Unknown configuration value: " + name)
+        if type(value) != int or value <= 0:
+            raise ScenarioError("Configuration value " + name + " must be an int greater than 0")
+
+
+def remove_tickets(ticket_pool, tickets):
+    # The ticket pool is kept sorted: instead of testing every ticket of the pool, the tickets are found by
+    # bisection and the pool is rebuilt from the slices between them
+    remaining_pool = list()
+    start = 0
+    for position in sorted(bisect.bisect_left(ticket_pool, t) for t in tickets):
+        remaining_pool += ticket_pool[start:position]
+        start = position + 1
+    remaining_pool += ticket_pool[start:]
+    return remaining_pool
+
+
+class RevealedOwners:
+    # Owners of the block hashes (shared: owned by any number of adversaries) or of the tickets (owned by one
+    # adversary at most) of a simulation, drawn the first time each one comes up instead of sampling the whole
+    # block hash space or ticket pool before the simulation. Each adversary owns counts[idx] of the size items,
+    # uniformly at random: an item not revealed yet belongs to it with probability (its items not revealed yet) /
+    # (items not revealed yet), so the revealed owners follow the same distribution as sampling every set up front
+
+    def __init__(self, counts, size, draws, shared):
+        self.unrevealed_counts = list(counts)
+        self.unrevealed = size
+        self.size = size
+        self.draws = draws
+        self.shared = shared
+        self.owners = {}
+
+    def __getitem__(self, item):
+        # Block hashes: tuple of the owners; tickets: the owner, or None
+        owners = self.owners.get(item, self)
+        if owners is self:
+            owners = self.owners[item] = self.reveal()
+        return owners
+
+    def reveal(self):
+        counts = self.unrevealed_counts
+        if self.shared:
+            owners = list()
+            for idx, c in enumerate(counts):
+                if self.draws.random() * self.unrevealed < c:
+                    owners.append("A" + str(idx))
+                    counts[idx] -= 1
+            self.unrevealed -= 1
+            return tuple(owners)
+        r = self.draws.below(self.unrevealed)
+        self.unrevealed -= 1
+        for idx, c in enumerate(counts):
+            if r < c:
+                counts[idx] -= 1
+                return "A" + str(idx)
+            r -= c
+        return None
+
+    def owned_items(self):
+        # Every item of each adversary: the revealed ones, and the others drawn now from the items not revealed
+        unrevealed_items = [item for item in range(self.size) if item not in self.owners]
+        owned = list()
+        for idx, c in enumerate(self.unrevealed_counts):
             adv_id = "A" + str(idx)
-            # Validated and invalidated blocks are set here to avoid KeyError exceptions
-            adversaries[adv_id]["validated_blocks"] = 0
-            adversaries[adv_id]["invalidated_blocks"] = 0
-            adversaries[adv_id]["stakesize"] = s
-            adversaries[adv_id]["prob_tickets"] = \
-                random.sample(ticket_pool, k=round(round(float(s), 2) / 100 * pos_avg_ticket_pool_size))
-            selected_tickets = set(adversaries[adv_id]["prob_tickets"])
-            # Remove the tickets already selected; one ticket cannot be owned by multiple adversaries
-            ticket_pool = [e for e in ticket_pool if e not in selected_tickets]
-
-    # Generate info for calc_averages()
-    for a in adversaries:
-        adversaries[a]["pow_hashpower"] = "{:.2f}".format(len(adversaries[a]["prob_block_hashes"]) / 100) + "%"
-        if adv_stake:
-            adversaries[a]["pos_stakesize"] = \
-                "{:.2f}".format(len(adversaries[a]["prob_tickets"]) * 100 / pos_avg_ticket_pool_size) + "%"
-            logging.info(a + " hashpower: " + "{:.2f}".format(len(adversaries[a]["prob_block_hashes"]) / 100) + "% " +
-                         "and stake size: " +
-                         "{:.4f}".format(len(adversaries[a]["prob_tickets"]) * 100 / pos_avg_ticket_pool_size) + "%")
-        else:
-            logging.info(a + " hashpower:" + "{:.2f}".format(len(adversaries[a]["prob_block_hashes"]) / 100) + "%")
-
-
-def setup_block_rewind(s, rewind_blocks, rewind_adv):
-    # Generates a number of blocks for the selected adversary before simulation starts
-    a = "A" + str(rewind_adv)
-    for b in range(int(rewind_blocks)):
-        simulations["sims"][str(s)]["cycles"][str(b)] = {}
-        block_hash = "RWB" + str(b)
-        simulations["sims"][str(s)]["cycles"][str(b)]["drawn_block_hash"] = block_hash
-        simulations["sims"][str(s)]["cycles"][str(b)]["pow_winners"] = [a]
-        adversaries[a]["drawn_block_hashes"].append(block_hash)
-
-        # Add fake blocks to the "chain" node
-        this_height = str(len(adversaries[a]["chain"])).zfill(3)
-        adversaries[a]["chain"][this_height] = {}
-        if not args.pos:
-            # Pure PoW: Append fake block to the "chain"
-            adversaries[a]["chain"][this_height].update({"block_hash": block_hash})
+            items = [item for item, owners in self.owners.items() if adv_id in owners] if self.shared else \
+                [item for item, owner in self.owners.items() if owner == adv_id]
+            drawn_items = self.draws.generator.sample(unrevealed_items, k=c)
+            if not self.shared:
+                unrevealed_items = remove_tickets(unrevealed_items, drawn_items)
+            owned.append(items + drawn_items)
+        return owned
+
+
+class ImportanceSampler:
+    # Tilted draws of importance sampling, set up for each simulation by calc_hashpower(). Block hashes owned
+    # only by the attacker are drawn --importance-tilt times more often and those the attacker doesn't own
+    # as many times less often (an exponential tilt of the step of the race; shared block hashes keep their
+    # weight). The number of votes owned by the attacker, when it won PoW, is tilted by --importance-vote-tilt
+    # per vote. Each draw adds the log of its likelihood ratio (untilted / tilted probability) to the
+    # simulation; weighting the outcome of the simulation by the ratio gives unbiased estimates of the race
+
+    def __init__(self, simulator, attacker):
+        self.simulator = simulator
+        self.attacker = attacker
+        args = simulator.args
+        self.vote_tilt = args.importancevotetilt or 1.0
+        # Empty draws don't change the race: only the block hash with an owner is tilted
+        winning_block_hashes, block_hash_owners = simulator.winning_block_hashes, simulator.block_hash_owners
+        attacker_hashes = [h for h in winning_block_hashes if block_hash_owners[h] == (attacker,)]
+        shared_hashes = [h for h in winning_block_hashes
+                         if attacker in block_hash_owners[h] and len(block_hash_owners[h]) > 1]
+        other_hashes = [h for h in winning_block_hashes if attacker not in block_hash_owners[h]]
+        pow_tilt = args.importancetilt or 1.0
+        if pow_tilt == 'auto':
+            # The tilted race steps toward the attacker as often as the untilted one steps away from it,
+            # so that every path won by the attacker has the same likelihood ratio
+            pow_tilt = len(other_hashes) / len(attacker_hashes) if attacker_hashes and other_hashes else 1.0
+        self.pow_tilt = pow_tilt
+        # (block hashes, weight of each one) of the attacker's, the shared and the others' block hashes
+        self.hash_classes = [(hashes, weight) for hashes, weight in
+                             [(attacker_hashes, pow_tilt), (shared_hashes, 1.0), (other_hashes, 1.0 / pow_tilt)]
+                             if hashes]
+        self.total_weight = sum(len(hashes) * weight for hashes, weight in self.hash_classes)
+        self.log_ratios = [math.log(self.total_weight / (len(winning_block_hashes) * weight))
+                           for hashes, weight in self.hash_classes]
+        # Tickets of the attacker that can be drawn (ticket 0 never is)
+        self.attacker_tickets = None
+        if args.pos and args.votesampling == 'hypergeometric':
+            self.drawable = simulator.drawable_tickets[attacker]
+        elif args.pos:
+            self.attacker_tickets = [t for t in simulator.adversaries[attacker]["prob_tickets"] if t]
+            self.drawable = len(self.attacker_tickets)
+        self.vote_weights = {}
+
+    def draw_block_hash(self, sim):
+        r = self.simulator.pow_draws.random() * self.total_weight
+        for idx, (hashes, weight) in enumerate(self.hash_classes):
+            if r < len(hashes) * weight or idx == len(self.hash_classes) - 1:
+                sim.log_likelihood_ratio += self.log_ratios[idx]
+                return hashes[min(int(r / weight), len(hashes) - 1)]
+            r -= len(hashes) * weight
+
+    def tilts_votes(self, pow_winners):
+        return self.vote_tilt != 1.0 and self.attacker in pow_winners
+
+    def draw_attacker_votes(self, sim, online_tickets):
+        # Hypergeometric distribution of the attacker's votes, times vote_tilt per vote
+        if online_tickets not in self.vote_weights:
+            population = self.simulator.pos_avg_ticket_pool_size - 1
+            votes = range(max(0, online_tickets - (population - self.drawable)), min(online_tickets, self.drawable) + 1)
+            weights = [hypergeometric_pmf(population, self.drawable, online_tickets, k) * self.vote_tilt ** k
+                       for k in votes]
+            self.vote_weights[online_tickets] = (votes, weights, math.log(sum(weights)))
+        votes, weights, log_normaliser = self.vote_weights[online_tickets]
+        attacker_votes = self.simulator.pos_random.choices(votes, weights=weights)[0]
+        sim.log_likelihood_ratio += log_normaliser - attacker_votes * math.log(self.vote_tilt)
+        return attacker_votes
+
+    def draw_owned_votes(self, sim, pow_winners, online_tickets):
+        # The other PoW winners share the rest of the online tickets, drawn from the tickets of everyone else
+        attacker_votes = self.draw_attacker_votes(sim, online_tickets)
+        others = [a for a in pow_winners if a != self.attacker]
+        other_votes = self.simulator.draw_owned_votes(others, online_tickets - attacker_votes,
+                                                      self.simulator.pos_avg_ticket_pool_size - 1 - self.drawable)
+        return [attacker_votes if a == self.attacker else other_votes[others.index(a)] for a in pow_winners]
+
+    def draw_tickets(self, sim, online_tickets):
+        simulator = self.simulator
+        attacker_votes = self.draw_attacker_votes(sim, online_tickets)
+        drawn_tickets = simulator.pos_random.sample(self.attacker_tickets, attacker_votes)
+        other_tickets = list()
+        while len(other_tickets) < online_tickets - attacker_votes:
+            # Tickets not owned by the attacker, without replacement
+            t = simulator.pos_random.randrange(1, simulator.pos_avg_ticket_pool_size)
+            if simulator.ticket_owners[t] != self.attacker and t not in other_tickets:
+                other_tickets.append(t)
+        return drawn_tickets + other_tickets
+
+
+class SimulationRecord:
+    # Compact record of a scalar simulation: cycles and chain blocks are appended to typed arrays,
+    # one column per field, and only converted to the nested JSON shape on output (see to_json())
+    __slots__ = ("results", "adversaries", "rewind_blocks", "rewind_adv", "log_likelihood_ratio",
+                 "drawn_block_hashes", "pow_winners", "pos_winners", "skipped_draws",
+                 "distance_cycle", "distance", "probability",
+                 "chain_adv", "chain_block_hash", "chain_from_cycle", "chain_online_tickets",
+                 "chain_owned_count", "chain_owned_tickets", "with_pos", "keep_chains", "vote_counts")
+
+    def __init__(self, num_adv, with_pos, direct_draws=False, keep_chains=True, vote_counts=False):
+        # keep_chains: the adversary chains are kept for the JSON output; vote_counts: only the number of votes
+        # of each block is drawn (--vote-sampling hypergeometric), not their ticket numbers
+        self.with_pos = with_pos
+        self.keep_chains = keep_chains
+        self.vote_counts = vote_counts
+        self.results = {}
+        self.adversaries = {}
+        self.rewind_blocks = 0
+        self.rewind_adv = 0
+        # Sum of the logs of the likelihood ratios of importance sampling draws
+        self.log_likelihood_ratio = 0.0
+        # Mined cycles, from cycle height rewind_blocks on; winners are bitmasks (see adversary_mask())
+        # that only fit in typed arrays up to 64 adversaries
+        self.drawn_block_hashes = array.array('l')
+        self.pow_winners = array.array('Q') if num_adv <= 64 else list()
+        self.pos_winners = None
+        if with_pos:
+            self.pos_winners = array.array('Q') if num_adv <= 64 else list()
+        self.skipped_draws = array.array('Q') if direct_draws else None
+        # mine_block() replaces the entry calc_distance() creates for the cycle, so only the distance
+        # calculated after the last cycle is output
+        self.distance_cycle = -1
+        self.distance = 0
+        self.probability = "X"
+        # Chain blocks of all adversaries in the order they were appended; rewind blocks have
+        # negative block hashes (-1 for RWB0, -2 for RWB1, ...) and no cycle (-1)
+        self.chain_adv = array.array('H')
+        self.chain_block_hash = array.array('l')
+        self.chain_from_cycle = array.array('l')
+        self.chain_online_tickets = array.array('b')
+        self.chain_owned_count = array.array('B')
+        self.chain_owned_tickets = array.array('L')
+
+    def add_cycle(self, block_hash, pow_mask, pos_mask=0, skipped_draws=0):
+        self.drawn_block_hashes.append(block_hash)
+        self.pow_winners.append(pow_mask)
+        self.pos_winners is None or self.pos_winners.append(pos_mask)
+        self.skipped_draws is None or self.skipped_draws.append(skipped_draws)
+
+    def add_chain_block(self, adv_idx, block_hash, from_cycle=-1, online_tickets=-1, owned_tickets=(),
+                        owned_count=0):
+        if not self.keep_chains:
+            # Adversary chains are only used in the JSON output
+            return
+        self.chain_adv.append(adv_idx)
+        self.chain_block_hash.append(block_hash)
+        self.chain_from_cycle.append(from_cycle)
+        if self.with_pos:
+            self.chain_online_tickets.append(online_tickets)
+            self.chain_owned_count.append(owned_count)
+            self.chain_owned_tickets.extend(owned_tickets)
+
+    def cycles_json(self):
+        cycles = {}
+        for b in range(self.rewind_blocks):
+            cycles[str(b)] = {"drawn_block_hash": "RWB" + str(b), "pow_winners": ["A" + str(self.rewind_adv)]}
+        for idx, block_hash in enumerate(self.drawn_block_hashes):
+            cycle = {"drawn_block_hash": block_hash, "pow_winners": adversary_ids(self.pow_winners[idx])}
+            if self.skipped_draws is not None:
+                cycle["skipped_draws"] = self.skipped_draws[idx]
+            if self.pos_winners is not None:
+                cycle["pos_winners"] = adversary_ids(self.pos_winners[idx])
+            cycles[str(self.rewind_blocks + idx).zfill(3)] = cycle
+        if self.distance_cycle >= self.rewind_blocks + len(self.drawn_block_hashes):
+            cycles[str(self.distance_cycle).zfill(3)] = {"distance_before_this_cycle": self.distance,
+                                                         "probability_before_this_cycle": self.probability}
+        return cycles
+
+    def chains_json(self):
+        chains = {a: {} for a in self.adversaries}
+        owned_offset = 0
+        for idx, adv_idx in enumerate(self.chain_adv):
+            chain = chains["A" + str(adv_idx)]
+            block_hash = self.chain_block_hash[idx]
+            if block_hash < 0:
+                block_hash = "RWB" + str(-1 - block_hash)
+                chain[str(len(chain)).zfill(3)] = {"block_hash": block_hash}
+                if self.with_pos:
+                    chain[str(len(chain) - 1).zfill(3)].update({"online_tickets": -1, "owned_tickets": [block_hash]})
+            elif not self.with_pos:
+                chain[str(len(chain)).zfill(3)] = {"block_hash": block_hash,
+                                                   "from_cycle": str(self.chain_from_cycle[idx]).zfill(3)}
+            else:
+                block = {"block_hash": block_hash, "from_cycle": str(self.chain_from_cycle[idx]).zfill(3),
+                         "online_tickets": self.chain_online_tickets[idx]}
+                owned_count = self.chain_owned_count[idx]
+                if self.vote_counts:
+                    block["owned_tickets_count"] = owned_count
+                else:
+                    block["owned_tickets"] = self.chain_owned_tickets[owned_offset:owned_offset + owned_count].tolist()
+                    owned_offset += owned_count
+                chain[str(len(chain))] = block
+        return chains
+
+    def to_json(self):
+        # Nested dict of the simulation, as it is written to the output file
+        chains = self.chains_json() if self.keep_chains else None
+        sim_adversaries = {}
+        for a, adversary in self.adversaries.items():
+            sim_adversaries[a] = {}
+            for key, value in adversary.items():
+                if key == "sum_blocks" and chains is not None:
+                    # Where the "chain" node used to be created in calc_hashpower()
+                    sim_adversaries[a]["chain"] = chains[a]
+                sim_adversaries[a][key] = value
+        return dict(cycles=self.cycles_json(), **self.results, adversaries=sim_adversaries)
+
+
+class HeightTracker:
+    # Chain heights of the adversaries of a simulation, also grouped by height (the adversaries at each height),
+    # so that the leading and lagging heights follow every appended or undone block in O(1)
+    # instead of comparing the heights of every pair of adversaries on each cycle
+
+    def __init__(self, adv_ids):
+        self.adv_ids = adv_ids
+        self.heights = [0] * len(adv_ids)
+        self.at_height = {0: set(range(len(adv_ids)))}
+        self.leading = 0
+        self.lagging = 0
+        # Last adversary at the lagging height, asked for on every pure PoW cycle: found again only when
+        # the adversaries at the lagging height change
+        self.laggard = None
+
+    def move(self, idx, blocks):
+        # Heights change one block at a time (blocks is 1 or -1)
+        height = self.heights[idx]
+        if height == self.lagging or height + blocks <= self.lagging:
+            self.laggard = None
+        self.at_height[height].discard(idx)
+        self.heights[idx] = height + blocks
+        self.at_height.setdefault(height + blocks, set()).add(idx)
+        self.leading = max(self.leading, height + blocks)
+        self.lagging = min(self.lagging, height + blocks)
+        if not self.at_height[self.leading]:
+            self.leading -= 1
+        if not self.at_height[self.lagging]:
+            self.lagging += 1
+
+    def first_at(self, height):
+        # First adversary (in adversary order) at this height
+        return self.adv_ids[min(self.at_height[height])]
+
+    def last_at(self, height):
+        if height == self.lagging:
+            if self.laggard is None:
+                self.laggard = max(self.at_height[height])
+            return self.adv_ids[self.laggard]
+        return self.adv_ids[max(self.at_height[height])]
+
+
+def adversary_mask(adv_ids):
+    # Bitmask of adversaries: bit 0 for A0, bit 1 for A1, ...
+    mask = 0
+    for a in adv_ids:
+        mask |= 1 << int(a[1:])
+    return mask
+
+
+def adversary_ids(mask):
+    # Adversaries of a bitmask, in adversary order
+    return ["A" + str(idx) for idx in range(mask.bit_length()) if mask >> idx & 1]
+
+
+class TraceBuffer:
+    # Ring buffer of binary cycle events for --trace-file; once full, the oldest events are overwritten
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * trace_record.size)
+        self.recorded = 0
+
+    def record(self, s, cycle_height, event, block_hash, mask, votes=0, owned=0, distance=0):
+        trace_record.pack_into(self.buffer, (self.recorded % self.capacity) * trace_record.size,
+                               s, cycle_height, event, votes, owned, distance, block_hash, mask)
+        self.recorded += 1
+
+    def save(self, trace_file):
+        # Events are saved from the oldest to the newest
+        kept = min(self.recorded, self.capacity)
+        first = (self.recorded - kept) % self.capacity * trace_record.size
+        try:
+            with open(trace_file, 'wb') as tfh:
+                tfh.write(trace_header.pack(trace_magic, trace_record.size, self.capacity, self.recorded))
+                tfh.write(self.buffer[first:kept * trace_record.size])
+                if first:
+                    tfh.write(self.buffer[:first])
+        except PermissionError:
+            logging.error("Missing write permission while saving trace to " + trace_file)
         else:
-            # PoW + PoS: Append fake block to the "chain"
-            adversaries[a]["chain"][this_height].update(
-                {"block_hash": block_hash, "online_tickets": -1, "owned_tickets": [block_hash]})
-
-        logging.info("Block height: " + str(b) + ", set up rewind block hash: " + block_hash + " for " + a)
-    logging.info("Adversary " + a + " already mined " + str(len(adversaries[a]["drawn_block_hashes"])) + " blocks")
-
-
-def create_simulation(s):
-    simulations["sims"][str(s)] = {}
-    simulations["sims"][str(s)]["cycles"] = {}
-
-
-def mine_block(s, cycle_height):
-    pow_winner = False
-    while not pow_winner:
-        # PoW mining
-        # Could have random.sampled block hashes in calc_hashpower() as it was done for tickets (second for loop)
-        # That way it would not be possible for multiple adversaries to mine a block roughly at same time t
-        # because they would not be able to draw the same block hash
-        # Instead, calc_hashpower() randomizes block hashes with replacements (first for loop)
-        # This choice affects the way block hashes are drawn here
-        draw_block_hash = random.choice(range(block_hash_space))
-        # The dict is crated here to avoid KeyError when calc_distance() returns 0
-        this_cycle_height = str(cycle_height).zfill(3)
-        if cycle_height not in simulations["sims"][str(s)]["cycles"]:
-            simulations["sims"][str(s)]["cycles"][this_cycle_height] = {}
-        simulations["sims"][str(s)]["cycles"][this_cycle_height]["drawn_block_hash"] = draw_block_hash
-        simulations["sims"][str(s)]["cycles"][this_cycle_height]["pow_winners"] = list()
-        logging.info("Cycle height: " + this_cycle_height + ", drawn block hash: " + str(draw_block_hash))
-        for a in adversaries:
-            if draw_block_hash in adversaries[a]["prob_block_hashes"]:
-                pow_winner = True
-                adversaries[a]["drawn_block_hashes"].append(str(draw_block_hash))
-                simulations["sims"][str(s)]["cycles"][this_cycle_height]["pow_winners"].append(a)
-                logging.info("Cycle height: " + this_cycle_height + ", PoW winner: " + a)
-                if not args.pos:
-                    # pow_winner: Append block to the "chain"
-                    this_height = str(len(adversaries[a]["chain"])).zfill(3)
-                    adversaries[a]["chain"][this_height] = {}
-                    adversaries[a]["chain"][this_height].update({"block_hash": draw_block_hash,
-                                                                 "from_cycle": this_cycle_height})
-
-        if not pow_winner:
-            # This cycles are going to be ignored as if miners took more than average time to mine a block
-            logging.info("No PoW winner for height " + this_cycle_height + "; next draw")
-
-        else:   # If already selected at least one adversary as PoW miner; if not, will loop again
-            # PoS mining
-            if args.pos:  # If not, this simulation is a pure PoW and this code block can be skipped
-                simulations["sims"][str(s)]["cycles"][this_cycle_height]["pos_winners"] = list()
-
-                # Draws how many tickets will be drawn for this block based on historical proportions
-                # defined in the beginning of this file
-                pos_allowed_drawn_tickets = \
-                    int(random.choices(
-                        [5, 4, 3], [pos_prop_blocks_5votes, pos_prop_blocks_4votes, pos_prop_blocks_3votes],
-                        k=1)[0])
-                drawn_tickets = random.sample(range(1, pos_avg_ticket_pool_size), pos_allowed_drawn_tickets)
-                logging.debug("Online tickets: " +
-                              str(pos_allowed_drawn_tickets) + "; drawn tickets: " + str(drawn_tickets))
-
-                pos_winner = False
-                for a in adversaries:
-                    adversaries[a]["drawn_tickets"] = [t for t in drawn_tickets if t in adversaries[a]["prob_tickets"]]
-                    total_tickets = len(adversaries[a]["drawn_tickets"])
-
-                    if a in simulations["sims"][str(s)]["cycles"][this_cycle_height]["pow_winners"]:
-                        # adversary already won PoW
-                        if total_tickets > pos_allowed_drawn_tickets // 2:
-                            pos_winner = True
-                            simulations["sims"][str(s)]["cycles"][this_cycle_height]["pos_winners"].append(a)
-                            adversaries[a]["validated_blocks"] += 1
-                            logging.debug("Tickets for adversary " + a + ": " +
-                                          str(total_tickets) + "; drawn tickets: " +
-                                          str(adversaries[a]["drawn_tickets"]))
-                            logging.info("Cycle height: " + this_cycle_height + ", PoS winner: " + a)
+            logging.info("Saved " + str(kept) + " trace events to " + trace_file)
 
-                            # pow_winner and pos_winner: Append block to the "chain" after PoS validation
-                            this_height = str(len(adversaries[a]["chain"]))
-                            adversaries[a]["chain"][this_height] = {}
-                            adversaries[a]["chain"][this_height].update(
-                                {"block_hash": draw_block_hash,
-                                 "from_cycle": this_cycle_height,
-                                 "online_tickets": pos_allowed_drawn_tickets,
-                                 "owned_tickets": adversaries[a]["drawn_tickets"]})
-                        else:
-                            logging.debug("Tickets for adversary " + a + ": " +
-                                          str(total_tickets) + "; allowed drawn tickets: " +
-                                          str(pos_allowed_drawn_tickets))
-                            adversaries[a]["invalidated_blocks"] += 1
-                            # Must undo the last block accounted for the adversary
-                            # whose PoW mining has been invalidated
-                            del adversaries[a]["drawn_block_hashes"][-1]
 
-                if not pos_winner:
-                    # If the adversary didn't have the necessary drawn tickets to validate his own blocks,
-                    # we assume the block will be invalidated by the honest adversaries
-                    pow_winner = False
-                    logging.info("PoS and PoW winner don't match for block height " + this_cycle_height + "; next draw")
-
-
-def calc_distance(s, cycle_height):
-    if cycle_height < 1:
-        return 0  # distance is 0 if we haven't started
-    # elif cycle_height == 1:
-    #     return 1    # distance is 1 from and to any adversary
-
-    seq = list()
-    for a in adversaries:
-        seq.append(len(adversaries[a]["drawn_block_hashes"]))
-
-    # Calculate probabilities of catching up: first part
-    # The simulator allows for more than two adversaries...
-    leading_height = max(seq)
-    lagging_height = min(seq)
-    leading_adv, lagging_adv = "", ""
-    for a in adversaries:
-        if len(adversaries[a]["drawn_block_hashes"]) == lagging_height:
-            # Found the (last) lagging adversary to use later
-            lagging_adv = a
-        elif len(adversaries[a]["drawn_block_hashes"]) == leading_height:
-            # Found the (last) lagging adversary to use later
-            # If lagging_height == leading_height, this block won't run, leaving leading_adv == ""
-            leading_adv = a
-
-    # Calculate the maximum distance between any two adversaries
-    distances = [abs(i - j) for i in seq for j in seq if i != j]
+def decode_trace(trace_file):
+    # Prints the events saved by --trace-file, one per line
+    try:
+        with open(trace_file, 'rb') as tfh:
+            magic, record_size, capacity, recorded = trace_header.unpack(tfh.read(trace_header.size))
+            if magic != trace_magic or record_size != trace_record.size:
+                print("Error:", trace_file, "is not a trace file")
+                exit(1)
+            print("# " + str(recorded) + " events recorded, " + str(min(recorded, capacity)) + " kept")
+            for record in trace_record.iter_unpack(tfh.read()):
+                s, cycle_height, event, votes, owned, distance, block_hash, mask = record
+                winners = ",".join(adversary_ids(mask))
+                line = "sim=" + str(s) + " cycle=" + str(cycle_height) + " event=" + trace_event_names[event]
+                if event == trace_pow_draw:
+                    line += " block_hash=" + str(block_hash) + " pow_winners=" + winners
+                elif event == trace_pos_vote:
+                    line += " block_hash=" + str(block_hash) + " online_tickets=" + str(votes) + \
+                            " owned_tickets=" + str(owned) + " pos_winners=" + winners
+                elif event == trace_distance:
+                    line += " distance=" + str(distance)
+                else:
+                    line += " block_hash=RWB" + str(-1 - block_hash) + " pow_winners=" + winners
+                print(line)
+    except FileNotFoundError:
+        print("Error: trace file", trace_file, "not found")
+        exit(1)
+    exit(0)
+
+
+def array_stats(values):
+    # Count, mean and sum of squared deviations of a NumPy array, as merged by RunningStats
+    mean = float(values.mean())
+    return values.size, mean, float(((values - mean) ** 2).sum())
+
+
+class RandomBuffer:
+    # Draws of a random generator served from a bulk buffer: the hot loops take the next random() float
+    # of a chunk drawn by a single call of the generator, instead of calling it for every block hash or vote drawn.
+    # Chunks start small and double up to random_buffer_size, so that a short simulation doesn't draw
+    # a whole buffer, and reset() drops the floats left, so that every simulation draws the same numbers
+    # from its own random stream whatever the simulations before it drew
+
+    def __init__(self, generator, vote_proportions):
+        self.generator = generator
+        # Proportions of the blocks with 5, 4 and 3 votes, for online_tickets()
+        self.vote_proportions = vote_proportions
+        self.reset()
+
+    def reset(self):
+        self.chunk_size = random_buffer_min_size
+        self.next_value = iter(()).__next__
+
+    def refill(self):
+        # Random bytes made into doubles from 1 to 2 (the draws subtract 1): the sign and exponent bits of every
+        # little-endian double are set, and its 52 bits of mantissa stay random
+        n = self.chunk_size
+        chunk = bytearray(self.generator.randbytes(8 * n))
+        chunk[7::8] = b"\x3f" * n
+        chunk[6::8] = chunk[6::8].translate(random_mantissa_bits)
+        values = array.array('d', chunk)
+        sys.byteorder == 'little' or values.byteswap()
+        self.next_value = iter(values).__next__
+        self.chunk_size = min(n * 2, random_buffer_size)
+
+    def random(self):
+        try:
+            return self.next_value() - 1.0
+        except StopIteration:
+            self.refill()
+            return self.next_value() - 1.0
+
+    def below(self, n):
+        # Integer from 0 to n - 1, drawn as by random.choices()
+        try:
+            return int((self.next_value() - 1.0) * n)
+        except StopIteration:
+            self.refill()
+            return int((self.next_value() - 1.0) * n)
+
+    def sample(self, start, stop, k):
+        # k different integers from start to stop - 1, in the order drawn, as by random.sample() of a range
+        drawn = list()
+        while len(drawn) < k:
+            value = start + self.below(stop - start)
+            value in drawn or drawn.append(value)
+        return drawn
+
+    def online_tickets(self):
+        # Number of online tickets of a block (5, 4 or 3), drawn as by random.choices() with the historical
+        # proportions of the configuration
+        prop_5votes, prop_4votes, prop_3votes = self.vote_proportions
+        r = self.random() * (prop_5votes + prop_4votes + prop_3votes)
+        if r < prop_5votes:
+            return 5
+        return 4 if r < prop_5votes + prop_4votes else 3
+
+
+def simulation_seed(seed, s):
+    # Each simulation of a seeded batch gets its own random stream, independent of the process running it
+    return str(seed) + ":" + str(s)
+
+
+def init_worker(worker_args, config_values):
+    # Runs once in every worker process: the configuration is read only by the main process. The tasks of
+    # the process run on its own Simulator
+    global worker_simulator
+    worker_simulator = Simulator(config_values)
+    worker_simulator.start_worker(worker_args)
+    config_logging(worker_args.logfile, 'a', worker_args.loglevel)
+
+
+def run_worker_simulations(task):
+    return worker_simulator.run_simulation_task(task)
+
+
+def run_worker_sweep_point(point):
+    return worker_simulator.run_sweep_point(point)
+
+
+def run_worker_paired_simulations(task):
+    return worker_simulator.run_paired_simulations(task)
+
+
+class ResultCache:
+    # Content-addressed store of seeded simulations (--cache-dir): each scenario has a directory named after
+    # the hash of cache_scenario(), holding units of consecutive simulations with their aggregates and, for
+    # the scalar engine, the outcome of every simulation. Least recently used units are evicted first
+
+    def __init__(self, cache_dir, cache_size, scenario):
+        self.cache_dir = cache_dir
+        self.max_bytes = cache_size * 1024 * 1024
+        self.scenario = scenario
+        self.key = hashlib.sha256(json.dumps(scenario, sort_keys=True).encode()).hexdigest()
+        self.path = os.path.join(cache_dir, self.key)
+        self.outcomes = {}          # Simulation: outcome (scalar engine)
+        self.chunks = {}            # (first simulation, number of simulations): aggregates (NumPy engine)
+        self.unit_files = {}        # Simulation or chunk: unit file holding it
+        self.used_files = set()
+        self.fresh_outcomes = {}
+        self.fresh_chunks = {}
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, "scenario.json"), 'w') as sfh:
+                json.dump(scenario, sfh, indent=4, sort_keys=True)
+        except PermissionError:
+            logging.error("Missing write permission on cache directory " + cache_dir)
+            exit(6)
+        self.load()
+        logging.info("Cache " + self.key + ": " + str(len(self.outcomes)) + " simulations and " +
+                     str(len(self.chunks)) + " chunks")
+
+    def load(self):
+        for name in os.listdir(self.path):
+            if not (name.startswith("unit-") and name.endswith(".json")):
+                continue
+            unit_file = os.path.join(self.path, name)
+            try:
+                with open(unit_file) as ufh:
+                    unit = json.load(ufh)
+            except (OSError, ValueError):
+                # Evicted meanwhile by another process
+                logging.warning("Skipping cache unit " + unit_file)
+                continue
+            if "outcomes" in unit:
+                for idx, outcome in enumerate(unit["outcomes"]):
+                    self.outcomes[unit["first_sim"] + idx] = outcome
+                    self.unit_files[unit["first_sim"] + idx] = unit_file
+            else:
+                chunk = (unit["first_sim"], unit["num_sims"])
+                self.chunks[chunk] = unit["aggregate"]
+                self.unit_files[chunk] = unit_file
+
+    def outcome(self, s):
+        self.used_files.add(self.unit_files[s])
+        return self.outcomes[s]
+
+    def chunk(self, first_sim, num_sims):
+        self.used_files.add(self.unit_files[(first_sim, num_sims)])
+        return self.chunks[(first_sim, num_sims)]
+
+    def add_outcome(self, s, outcome):
+        self.fresh_outcomes[s] = outcome
+
+    def add_chunk(self, first_sim, num_sims, aggregator):
+        self.fresh_chunks[(first_sim, num_sims)] = aggregator.state()
+
+    def add_recorded(self, first_sim, recorder):
+        # Items of an OutcomeRecorder are consecutive simulations or chunks starting at first_sim
+        for item in recorder.items:
+            if isinstance(item, BatchAggregator):
+                self.add_chunk(first_sim, item.total(), item)
+                first_sim += item.total()
+            else:
+                self.add_outcome(first_sim, item)
+                first_sim += 1
+
+    def write_unit(self, first_sim, num_sims, state, outcomes=None):
+        unit = {"first_sim": first_sim, "num_sims": num_sims, "aggregate": state}
+        outcomes is None or unit.update(outcomes=outcomes)
+        unit_file = os.path.join(self.path, "unit-" + str(first_sim) + "-" + str(num_sims) + ".json")
+        try:
+            with open(unit_file + "." + str(os.getpid()), 'w') as ufh:
+                json.dump(unit, ufh, separators=(',', ':'))
+            # Other processes never read a unit partially written
+            os.replace(unit_file + "." + str(os.getpid()), unit_file)
+        except PermissionError:
+            logging.error("Missing write permission while saving cache unit " + unit_file)
+            exit(6)
+
+    def save(self):
+        # Fresh simulations of the scalar engine are grouped in units of consecutive simulations
+        adv_ids = ["A" + str(idx) for idx in range(len(self.scenario["pow"]))]
+        units = list()
+        for s in sorted(self.fresh_outcomes):
+            if units and units[-1][0] + len(units[-1][1]) == s:
+                units[-1][1].append(self.fresh_outcomes[s])
+            else:
+                units.append((s, [self.fresh_outcomes[s]]))
+        for first_sim, outcomes in units:
+            unit_aggregator = BatchAggregator(adv_ids)
+            for outcome in outcomes:
+                unit_aggregator.add(outcome)
+            self.write_unit(first_sim, len(outcomes), unit_aggregator.state(), outcomes)
+        for (first_sim, num_sims), state in self.fresh_chunks.items():
+            self.write_unit(first_sim, num_sims, state)
+        logging.info("Cached " + str(len(self.fresh_outcomes)) + " simulations and " + str(len(self.fresh_chunks)) +
+                     " chunks")
+        self.fresh_outcomes = {}
+        self.fresh_chunks = {}
+        for unit_file in self.used_files:
+            try:
+                os.utime(unit_file)
+            except FileNotFoundError:
+                pass
+        self.used_files = set()
+        self.evict()
+
+    def evict(self):
+        # Least recently used (or written) units go first, whatever their scenario
+        cache_bytes = 0
+        units = list()
+        for key in os.listdir(self.cache_dir):
+            key_path = os.path.join(self.cache_dir, key)
+            if not os.path.isfile(os.path.join(key_path, "scenario.json")):
+                continue
+            for name in os.listdir(key_path):
+                try:
+                    file_stat = os.stat(os.path.join(key_path, name))
+                except FileNotFoundError:
+                    continue
+                cache_bytes += file_stat.st_size
+                if name.startswith("unit-") and name.endswith(".json"):
+                    units.append((file_stat.st_mtime, file_stat.st_size, os.path.join(key_path, name)))
+        for mtime, size, unit_file in sorted(units):
+            if cache_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(unit_file)
+            except FileNotFoundError:
+                pass
+            cache_bytes -= size
+            logging.info("Evicted cache unit " + unit_file)
+
+
+def outcome_simulation(outcome, weighted=False):
+    # Simulation of which only the outcome is kept (cached simulations, --summary-only records): it's output
+    # like the simulations of the NumPy engine, with the likelihood ratio of importance sampling if weighted
+    diff_2, diff_6, winner, sum_blocks, validated_blocks, invalidated_blocks, duration, weight = outcome
+    sim = {"2-block-diff": diff_2, "6-block-diff": diff_6, "6-block-diff_winner": winner,
+           "6-block-diff_winner_score": str(max(sum_blocks)), "adversaries": {}}
+    weighted and sim.update({"likelihood_ratio": weight})
+    for idx, adv_blocks in enumerate(sum_blocks):
+        sim["adversaries"]["A" + str(idx)] = {"sum_blocks": adv_blocks}
+        if validated_blocks:
+            sim["adversaries"]["A" + str(idx)]["validated_blocks"] = validated_blocks[idx]
+            sim["adversaries"]["A" + str(idx)]["invalidated_blocks"] = invalidated_blocks[idx]
+    return sim
+
+
+class OutcomeRecords:
+    # Records of --summary-only: the outcome of every finished simulation (2 and 6-block differences, winner,
+    # and sum, validated and invalidated blocks of each adversary) packed in a typed array, with the same
+    # size for every simulation, up to max_bytes. Simulations are recorded in order, from the first simulation
+    # of the batch (first_sim)
+
+    def __init__(self, num_adv, with_pos, max_bytes, first_sim=0, weighted=False):
+        self.num_adv = num_adv
+        self.first_sim = first_sim
+        self.stride = 3 + num_adv * (3 if with_pos else 1)
+        self.values = array.array('i')
+        # Likelihood ratios of importance sampling
+        self.weights = array.array('d') if weighted else None
+        self.max_records = max_bytes // (self.stride * self.values.itemsize +
+                                         (0 if self.weights is None else self.weights.itemsize))
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.values) // self.stride
+
+    def add(self, outcome):
+        diff_2, diff_6, winner, sum_blocks, validated_blocks, invalidated_blocks, duration, weight = outcome
+        if len(self) >= self.max_records:
+            self.dropped or logging.warning("--summary-memory reached after " + str(len(self)) +
+                                            " simulations: the records of the next ones are dropped")
+            self.dropped += 1
+            return
+        self.values.extend((diff_2, diff_6, int(winner[1:])) + tuple(sum_blocks) + tuple(validated_blocks) +
+                           tuple(invalidated_blocks))
+        self.weights is None or self.weights.append(weight)
+
+    def outcome(self, idx):
+        record = self.values[idx * self.stride:(idx + 1) * self.stride]
+        n = self.num_adv
+        extra = tuple(record[3 + n:])
+        return (record[0], record[1], "A" + str(record[2]), tuple(record[3:3 + n]), extra[:n], extra[n:], 0.0,
+                1.0 if self.weights is None else self.weights[idx])
+
+    def export(self):
+        return {str(self.first_sim + idx): outcome_simulation(self.outcome(idx), self.weights is not None)
+                for idx in range(len(self))}
+
+
+def results_store_columns(num_adv, with_pos):
+    # Columns of a results store: name, array typecode and item size (checked when the store is read)
+    names = ["sim", "batch", "winner", "2-block-diff", "6-block-diff"]
+    typecodes = ['q', 'i', 'H', 'i', 'i']
+    fields = ["sum_blocks", "validated_blocks", "invalidated_blocks"] if with_pos else ["sum_blocks"]
+    for field in fields:
+        names += [field + ".A" + str(idx) for idx in range(num_adv)]
+        typecodes += ['i'] * num_adv
+    names.append("weight")      # Likelihood ratio of importance sampling, 1.0 otherwise
+    typecodes.append('d')
+    return [[name, typecode, array.array(typecode).itemsize] for name, typecode in zip(names, typecodes)]
+
+
+def read_results_store_header(store_dir):
+    # Header of the results store in store_dir, or None if there's none yet
     try:
-        calculated_distance = max(distances)
+        with open(os.path.join(store_dir, "header.json")) as hfh:
+            header = json.load(hfh)
+    except FileNotFoundError:
+        return None
     except ValueError:
-        calculated_distance = 0
-
-    this_cycle_height = str(cycle_height).zfill(3)
-    if calculated_distance == 2 and simulations["sims"][str(s)]["2-block-diff"] == -1:
-        # Adding 1 because the cycle height starts in 0 and I want to know after how many cycles
-        simulations["sims"][str(s)]["2-block-diff"] = cycle_height + 1    # first time reached 2-block distance
-
-        # Who reached 2-block diff first and how many blocks were mined
-        winner_list = {}
-        for a in adversaries:
-            winner_list.update({a: str(adversaries[a]["sum_blocks"])})
-        winner = max(winner_list, key=winner_list.get)
-
-        simulations["sims"][str(s)]["2-block-diff_winner"] = winner
-        simulations["sims"][str(s)]["2-block-diff_winner_score"] = winner_list[winner]
-
-        logging.info("2-block-diff updated with cycle height " + this_cycle_height +
-                     " (after " + str(cycle_height + 1) + " cycles)")
-
-    elif calculated_distance == 6:
-        # Adding 1 because the cycle height starts in 0 and I want to know after how many cycles
-        simulations["sims"][str(s)]["6-block-diff"] = cycle_height + 1    # reached 6-block distance
-
-        # Who reached 6-block diff and how many blocks were mined
-        winner_list = {}
-        for a in adversaries:
-            winner_list.update({a: str(adversaries[a]["sum_blocks"])})
-        winner = max(winner_list, key=winner_list.get)
-
-        simulations["sims"][str(s)]["6-block-diff_winner"] = winner
-        simulations["sims"][str(s)]["6-block-diff_winner_score"] = winner_list[winner]
-
-        logging.info("6-block-diff updated with cycle height " + this_cycle_height +
-                     " (after " + str(cycle_height + 1) + " cycles)")
-        logging.info("End of simulation reached with 6 blocks of difference")
-
-    elif calculated_distance > 6:
-        logging.critical("Error while calculating distance from adversaries (distances: " +
-                         str(distances) + " calculated_distance: " + str(calculated_distance) + ")")
-        exit(5)
-
-    # Calculate probabilities of catching up: second part
-    # Probability of success for the adversary that is lagging behind to catch up with leader
-    str_prob = "X"
-    if lagging_adv != "":
-        if not args.pos:
-            q = adversaries[lagging_adv]["hashpower"] / 100
-            # The information written to JSON refers to the distance and probability before
-            # the mining done on this cycle, that is just starting
-            str_prob = str(attacker_success_probability(q, calculated_distance))
+        raise ScenarioError(store_dir + " is not a results store")
+    if header.get("format") != results_store_format:
+        raise ScenarioError(store_dir + " is not a results store of this version of the script")
+    return header
 
-        this_cycle_height = str(cycle_height).zfill(3)
-        simulations["sims"][str(s)]["cycles"][this_cycle_height] = {}
-        simulations["sims"][str(s)]["cycles"][this_cycle_height]["distance_before_this_cycle"] = calculated_distance
-        simulations["sims"][str(s)]["cycles"][this_cycle_height]["probability_before_this_cycle"] = str_prob
-        logging.debug("Cycle height: " + this_cycle_height +
-                      ", distance before this cycle: " + str(calculated_distance))
-        if leading_adv == "":   # If the first part wasn't run, they are at the same height
-            logging.info("Probability of catching up is " + str_prob + " because their heights are the same")
+
+class ResultsStore:
+    # Columnar store of the outcomes of simulations (--results-store): a directory with one file of fixed-width
+    # values per column (see results_store_columns()) and a header (header.json) with the columns, the number
+    # of rows and the scenario of every batch appended to it. Rows are buffered in typed arrays and appended
+    # to the column files in blocks; only the rows counted by the header are committed, so a batch interrupted
+    # between commits leaves no partial rows behind
+
+    def __init__(self, store_dir, scenario, batch_start, resume_rows=None):
+        # scenario: cache_scenario() of the batch
+        self.store_dir = store_dir
+        self.columns = results_store_columns(len(scenario["pow"]), bool(scenario["pos"]))
+        try:
+            os.makedirs(store_dir, exist_ok=True)
+        except PermissionError:
+            logging.error("Missing write permission on results store " + store_dir)
+            exit(6)
+        self.header = read_results_store_header(store_dir) or {"format": results_store_format,
+                                                               "columns": self.columns, "rows": 0, "batches": []}
+        if self.header["columns"] != self.columns:
+            raise ScenarioError("The results store in " + store_dir + " keeps another number of adversaries, or "
+                                "the outcomes of PoW only or PoW + PoS: use another --results-store")
+        if resume_rows is not None and self.header["batches"] and resume_rows <= self.header["rows"]:
+            # Resumed batch: rows appended after its checkpoint are run and appended again
+            self.header["rows"] = resume_rows
         else:
-            logging.info("Probability of " + lagging_adv + " catching up to " + leading_adv + ": " + str_prob)
-
-    return calculated_distance
-
-
-def run_simulation(s):
-    sim_start_time = datetime.datetime.now()
-    logging.info("Running simulation " + str(s))
-    simulations["sims"][str(s)]["2-block-diff"] = -1
-    simulations["sims"][str(s)]["6-block-diff"] = -1
-    cycle_height = len(simulations["sims"][str(s)]["cycles"])
-
-    # Simulation runs until we reach a 6-block distance from other chains
-    while calc_distance(s, cycle_height) < 6:
-        # This is the core, the most time-consuming function
-        mine_block(s, cycle_height)
-
-        for a in adversaries:
-            sum_blocks = len(adversaries[a]["drawn_block_hashes"])
-            adversaries[a]["sum_blocks"] = sum_blocks
-            logging.info("Adversary " + a + " already mined " + str(sum_blocks) + " blocks")
-
-        cycle_height += 1
-
-    # At this point, distance == 6, this simulation is over
-    # Clean up the JSON before saving the simulation to file, if that's the case
-    for a in adversaries:
-        if not args.noeraseprob:
-            adversaries[a].pop('prob_block_hashes', None)
-            adversaries[a].pop('prob_tickets', None)
-
-        if not args.noerasedrawn:
-            adversaries[a].pop('drawn_block_hashes', None)
-            adversaries[a].pop('drawn_tickets', None)
-
-    # If we won't save JSON output, we avoid increasing memory footprint
-    # and discard adversary chains and cycles
-    if args.nooutputjson:
-        for a in adversaries:
-            adversaries[a].pop('chain', None)
-            adversaries[a].pop('cycles', None)
-
-    # Save the details before starting another simulation
-    simulations["sims"][str(s)]["adversaries"] = adversaries
-
-    # Save to calculate averages on calc_averages()
-    block_diff_2.append(simulations["sims"][str(s)]["2-block-diff"])
-    block_diff_6.append(simulations["sims"][str(s)]["6-block-diff"])
-    sim_end_time = datetime.datetime.now()
-    sim_duration_times.append(sim_end_time - sim_start_time)
-
-
-def log_debug_info():
-    logging.debug("Block Hash Space: " + str(block_hash_space))
-    logging.debug("Average ticket pool size: " + str(pos_avg_ticket_pool_size))
-    logging.debug("Number of blocks with 5 votes: " + str(pos_blocks_with_5votes))
-    logging.debug("Number of blocks with 4 votes: " + str(pos_blocks_with_4votes))
-    logging.debug("Number of blocks with 3 votes: " + str(pos_blocks_with_3votes))
-    logging.debug("Total number of blocks with votes: " + str(pos_blocks_with_votes))
-    logging.debug("Proportion of blocks with 5 votes: " + str(pos_prop_blocks_5votes))
-    logging.debug("Proportion of blocks with 4 votes: " + str(pos_prop_blocks_4votes))
-    logging.debug("Proportion of blocks with 3 votes: " + str(pos_prop_blocks_3votes))
-
-
-def run_batch_simulations(total_simulations=1, rewind_blocks=0, rewind_adv=0):
-    global batch_start_time, batch_end_time
-    log_debug_info()
-    logging.info("Starting simulation batch")
-    batch_start_time = datetime.datetime.now()
-    simulations["sims"] = {}
-    for s in range(int(total_simulations)):
-        calc_hashpower(args.pow, args.pos)
-        create_simulation(s)
-        int(rewind_blocks) > 0 and setup_block_rewind(s, rewind_blocks, rewind_adv)
-        run_simulation(s)
-
-    batch_end_time = datetime.datetime.now()
-    logging.info("End of simulation batch")
-    if args.verbose:
-        print("Simulations:")
-        pprint.pprint(simulations, indent=4)
-    calc_averages()
-    print_summary(args.simulations)
-    save_output(args.outputfile)
-
-
-def calc_averages():
-    global block_diff_2, block_diff_6, simulations
-    simulations["summary"] = {}
-
-    simulations["summary"]["batch_start"] = batch_start_time.isoformat(' ')
-    simulations["summary"]["batch_end"] = batch_end_time.isoformat(' ')
-    # statistics.mean() can't be used for datetime.timedelta()
-    sum_timedelta = datetime.timedelta()
-    for idx, t in enumerate(sim_duration_times):
-        sum_timedelta += sim_duration_times[idx]
-    avg_timedelta = sum_timedelta / len(sim_duration_times)
-    simulations["summary"]["sim_mean_time"] = avg_timedelta.total_seconds()
-
-    simulations["summary"]["total"] = len(block_diff_2)                 # Total number of simulations
-    simulations["summary"]["rewind_blocks"] = args.rewind_blocks        # Number of blocks to rewind
-    simulations["summary"]["rewind_adv"] = "A" + str(args.rewind_adv)   # Adversary trying to back in history
-    simulations["summary"]["pow"] = {}
-    simulations["summary"]["pow"]["2-block-diff-average"] = round(statistics.mean(block_diff_2), 6)
-    simulations["summary"]["pow"]["6-block-diff-average"] = round(statistics.mean(block_diff_6), 6)
-
-    simulations["summary"]["total_wins"] = {}
-    simulations["summary"]["perc_wins"] = {}
-    simulations["summary"]["sum_blocks"] = {}
-    for a in adversaries:
-        simulations["summary"]["sum_blocks"][a] = {}
-        sum_blocks_list = list()
-        win_counts = 0
-        for s in simulations["sims"]:
-            if type(int(s)) == int:
-                if simulations["sims"][str(s)]["6-block-diff_winner"] == a:
-                    win_counts += 1
-            sum_blocks_list.append(int(simulations["sims"][str(s)]["adversaries"][a]["sum_blocks"]))
-        simulations["summary"]["total_wins"][a] = win_counts
-        simulations["summary"]["perc_wins"][a] = str(round(win_counts / len(simulations["sims"]) * 100, 4)) + "%"
-        simulations["summary"]["sum_blocks"][a]["average"] = round(statistics.mean(sum_blocks_list), 6)
-
-    if args.pos:
-        simulations["summary"]["pos"] = {}
-        for a in adversaries:
-            simulations["summary"]["pos"][a] = {}
-            simulations["summary"]["pos"][a]["invalidated_blocks"] = list()
-            simulations["summary"]["pos"][a]["validated_blocks"] = list()
-
-        for s in simulations["sims"]:
-            for a in simulations["sims"][str(s)]["adversaries"]:
-                simulations["summary"]["pos"][a]["invalidated_blocks"].append(
-                    simulations["sims"][str(s)]["adversaries"][a]["invalidated_blocks"])
-                simulations["summary"]["pos"][a]["validated_blocks"].append(
-                    simulations["sims"][str(s)]["adversaries"][a]["validated_blocks"])
-
-        # This is the correct position for this code block
-        for a in adversaries:
-            simulations["summary"]["pos"][a]["invalidated_blocks-average"] = \
-                round(statistics.mean(simulations["summary"]["pos"][a]["invalidated_blocks"]), 6)
-            simulations["summary"]["pos"][a]["validated_blocks-average"] = \
-                round(statistics.mean(simulations["summary"]["pos"][a]["validated_blocks"]), 6)
-
-
-def print_summary(num_sims=1):
-    if not args.pos:
-        print("\nPure PoW simulation:")
-        print("--------------------")
-        print("Number of simulations:", simulations["summary"]["total"])
-        if simulations["summary"]["rewind_blocks"] > 0:
-            print("Simulating that adversary", simulations["summary"]["rewind_adv"], "is",
-                  simulations["summary"]["rewind_blocks"], "blocks ahead")
-
-        # Table section
-        table = {}
-        for a in adversaries:
-            table.update({a: {'hpow': adversaries[a]["pow_hashpower"],
-                              'sims_wins_n': simulations["summary"]["total_wins"][a],
-                              'sims_wins_p': simulations["summary"]["perc_wins"][a]
-                              }})
-
-        print(f'{"Adversary":9} {"Hashpower":>10} {"Simulations won":>16} {"Simulations won":>16}')
-        for adv in table.items():
-            print(f'{adv[0]:9} {adv[1]["hpow"]:>10} {adv[1]["sims_wins_n"]:>16} {adv[1]["sims_wins_p"]:>16}')
-
-        # After table
-        batch_duration = batch_end_time - batch_start_time
-        print("Total time for the batch of simulations:", batch_duration. total_seconds(), "seconds")
-        print("Average duration of simulations:", simulations["summary"]["sim_mean_time"], "seconds")
-        print(f'{"Average of " if int(num_sims) > 1 else ""}2-block advantage for', len(block_diff_2),
-              f'{"simulation" if int(num_sims) < 2 else "simulations"} reached in:',
-              simulations["summary"]["pow"]["2-block-diff-average"])
-        print(f'{"Average of " if int(num_sims) > 1 else ""}6-block advantage for', len(block_diff_6),
-              f'{"simulation" if int(num_sims) < 2 else "simulations"} reached in:',
-              simulations["summary"]["pow"]["6-block-diff-average"])
-
-        # Attacker success probability:
-        for a in adversaries:
-            q = float(adversaries[a]["hashpower"]) / 100
-            if q < 0.50:
-                print("Attacker probability of catching up for " + a + ": (z=number of blocks behind)")
-                str_zp = ""
-                for z in range(1, 7):
-                    str_zp += "z=" + str(z) + ", p=" + \
-                              str(round(attacker_success_probability(q, z), 6)) + \
-                              "; "
-                print(str_zp)
-    else:
-        print("\nPoW + PoS simulation:")
-        print("_____________________")
-        print("Number of simulations:", simulations["summary"]["total"])
-        if simulations["summary"]["rewind_blocks"] > 0:
-            print("Simulating that adversary", simulations["summary"]["rewind_adv"], "is",
-                  simulations["summary"]["rewind_blocks"],
-                  f'{"block" if int(simulations["summary"]["rewind_blocks"]) < 2 else "blocks"} ahead')
-
-        # Table section
-        table = {}
-        for a in adversaries:
-            table.update({a: {'hpow': adversaries[a]["pow_hashpower"],
-                              'ssize': adversaries[a]["pos_stakesize"],
-                              'sims_wins_n': simulations["summary"]["total_wins"][a],
-                              'sims_wins_p': simulations["summary"]["perc_wins"][a],
-                              'inv_blocks': simulations["summary"]["pos"][a]["invalidated_blocks-average"],
-                              'val_blocks': simulations["summary"]["pos"][a]["validated_blocks-average"]}})
-
-        print(f'{"Adversary":9} {"Hashpower":>10} {"Stake":>10} '
-              f'{"Simulations won":>16} {"Simulations won":>16} {"Avg Invalidated Blocks":>23} '
-              f'{"Avg Validated Blocks":>21}')
-        for adv in table.items():
-            print(f'{adv[0]:9} {adv[1]["hpow"]:>10} {adv[1]["ssize"]:>10} {adv[1]["sims_wins_n"]:>16} '
-                  f'{adv[1]["sims_wins_p"]:>16} {adv[1]["inv_blocks"]:>23} {adv[1]["val_blocks"]:>21}')
-
-        # After table
-        print("Total time for the batch of simulations:", batch_end_time - batch_start_time)
-        print("Average duration of simulations:", simulations["summary"]["sim_mean_time"], "seconds")
-        print(f'{"Average of " if int(num_sims) > 1 else ""}2-block advantage for', len(block_diff_2),
-              f'{"simulation" if int(num_sims) < 2 else "simulations"} reached in:',
-              simulations["summary"]["pow"]["2-block-diff-average"], "blocks")
-        print(f'{"Average of " if int(num_sims) > 1 else ""}6-block advantage for', len(block_diff_6),
-              f'{"simulation" if int(num_sims) < 2 else "simulations"} reached in:',
-              simulations["summary"]["pow"]["6-block-diff-average"], "blocks")
-
-        # Attacker success probability won't be calculated for PoW + PoS
-
-    # Losses amount
-    loss_list = list()
-    for i in table:
-        loss_list.append(table[i]["sims_wins_n"])
-    if max(loss_list) != min(loss_list):
-        # We have winners and losers; print about the losers
-        for a in adversaries:
-            if (simulations["summary"]["sum_blocks"][a]["average"] > 0) and \
-                    (int(table[a]["sims_wins_n"]) < max(loss_list)):
-                if args.pos:
-                    print("Assuming that", a, "won\'t fork the blockchain, the attack cost",
-                          simulations["summary"]["sum_blocks"][a]["average"], "PoW block reward, on average,",
-                          "due to PoS invalidation of bad PoW mined blocks.")
+            self.header["batches"].append({"first_row": self.header["rows"], "rows": 0,
+                                           "batch_start": batch_start.isoformat(' '), "scenario": scenario})
+        self.batch = len(self.header["batches"]) - 1
+        self.rows = self.header["rows"]
+        try:
+            for name, typecode, itemsize in self.columns:
+                with open(self.column_file(name), 'ab') as cfh:
+                    cfh.truncate(self.rows * itemsize)
+        except PermissionError:
+            logging.error("Missing write permission on results store " + store_dir)
+            exit(6)
+        self.buffers = [array.array(typecode) for name, typecode, itemsize in self.columns]
+
+    def column_file(self, name):
+        return os.path.join(self.store_dir, name + ".col")
+
+    def add(self, s, outcome):
+        diff_2, diff_6, winner, sum_blocks, validated_blocks, invalidated_blocks, duration, weight = outcome
+        row = (s, self.batch, int(winner[1:]), diff_2, diff_6) + tuple(sum_blocks) + tuple(validated_blocks) + \
+            tuple(invalidated_blocks) + (weight,)
+        for buffer, value in zip(self.buffers, row):
+            buffer.append(value)
+        len(self.buffers[0]) < results_store_block or self.flush()
+
+    def add_recorded(self, first_sim, recorder):
+        # Outcomes of a range of simulations run by a worker process
+        for idx, outcome in enumerate(recorder.items):
+            self.add(first_sim + idx, outcome)
+
+    def add_columns(self, columns):
+        # Whole columns of a chunk of the NumPy engine (NumPy arrays), in the order of the columns
+        for buffer, values in zip(self.buffers, columns):
+            buffer.frombytes(values.astype(buffer.typecode).tobytes())
+        len(self.buffers[0]) < results_store_block or self.flush()
+
+    def flush(self):
+        # Rows interrupted while being buffered are left out
+        rows = min(len(buffer) for buffer in self.buffers)
+        try:
+            for (name, typecode, itemsize), buffer in zip(self.columns, self.buffers):
+                with open(self.column_file(name), 'ab') as cfh:
+                    buffer[:rows].tofile(cfh)
+        except PermissionError:
+            logging.error("Missing write permission on results store " + self.store_dir)
+            exit(6)
+        self.rows += rows
+        self.buffers = [array.array(typecode) for name, typecode, itemsize in self.columns]
+
+    def commit(self):
+        # Writes the buffered rows and counts them in the header; returns the number of rows committed
+        self.flush()
+        self.header["rows"] = self.rows
+        batch = self.header["batches"][self.batch]
+        batch["rows"] = self.rows - batch["first_row"]
+        batch["batch_end"] = datetime.datetime.now().isoformat(' ')
+        header_file = os.path.join(self.store_dir, "header.json")
+        try:
+            with open(header_file + "." + str(os.getpid()), 'w') as hfh:
+                json.dump(self.header, hfh, indent=4)
+            # Readers never see a header partially written
+            os.replace(header_file + "." + str(os.getpid()), header_file)
+        except PermissionError:
+            logging.error("Missing write permission while saving results store header " + header_file)
+            exit(6)
+        logging.info("Results store " + self.store_dir + ": " + str(self.rows) + " simulations")
+        return self.rows
+
+
+def query_results_store(store_dir, conditions, confidence=95.0):
+    # Prints the aggregates of the simulations of a results store matching every condition, read from
+    # the memory-mapped column files
+    import mmap
+    header = read_results_store_header(store_dir)
+    if header is None:
+        raise ScenarioError("No results store in " + store_dir)
+    columns = {name: (typecode, itemsize) for name, typecode, itemsize in header["columns"]}
+    for name, typecode, itemsize in header["columns"]:
+        if array.array(typecode).itemsize != itemsize:
+            raise ScenarioError("The results store in " + store_dir + " was saved on an incompatible platform")
+    for column, op, value, text in conditions:
+        if column not in columns:
+            raise ScenarioError("No column " + column + " in the results store; columns: " + ", ".join(columns))
+
+    rows = header["rows"]
+    maps = {}
+    views = {}
+    try:
+        for name, (typecode, itemsize) in columns.items():
+            with open(os.path.join(store_dir, name + ".col"), 'rb') as cfh:
+                if rows:
+                    maps[name] = mmap.mmap(cfh.fileno(), rows * itemsize, access=mmap.ACCESS_READ)
+                    views[name] = memoryview(maps[name]).cast(typecode)
                 else:
-                    print("Assuming that", a, "won\'t fork the blockchain, the attack cost",
-                          simulations["summary"]["sum_blocks"][a]["average"],
-                          "PoW block reward, on average.")
-            elif simulations["summary"]["sum_blocks"][a]["average"] == 0:
-                print("Assuming that", a, "won\'t try to fork the blockchain,", a, "won't forgo any PoW reward",
-                      "because no block was successfully mined.")
-    else:
-        # We have a draw; print about all of them
-        print("Assuming that no adversary will fork the blockchain:")
-        for a in adversaries:
-            if (simulations["summary"]["sum_blocks"][a]["average"] > 0) and \
-                    (int(table[a]["sims_wins_n"]) <= max(loss_list)):
-                print(a, "lost the equivalent of",
-                      simulations["summary"]["sum_blocks"][a]["average"], "PoW block rewards, on average")
+                    views[name] = []
+    except (OSError, ValueError):
+        raise ScenarioError("The column files of the results store in " + store_dir + " are missing or truncated")
+
+    num_adv = sum(1 for name in columns if name.startswith("sum_blocks."))
+    adv_ids = ["A" + str(idx) for idx in range(num_adv)]
+    with_pos = "validated_blocks.A0" in columns
+    filters = [(views[column], where_operators[op], value) for column, op, value, text in conditions]
+    sum_views = [views["sum_blocks." + a] for a in adv_ids]
+    validated_views = [views["validated_blocks." + a] for a in adv_ids] if with_pos else []
+    invalidated_views = [views["invalidated_blocks." + a] for a in adv_ids] if with_pos else []
+    aggregator = BatchAggregator(adv_ids)
+    batches = set()
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    try:
+        if np is not None and rows:
+            batches = aggregate_store_columns(np, views, conditions, adv_ids, with_pos, aggregator)
+        else:
+            # Without NumPy, the rows are filtered and added to the aggregates one at a time
+            for row in range(rows):
+                if not all(compare(view[row], value) for view, compare, value in filters):
+                    continue
+                batches.add(views["batch"][row])
+                aggregator.add((views["2-block-diff"][row], views["6-block-diff"][row], adv_ids[views["winner"][row]],
+                                [view[row] for view in sum_views], [view[row] for view in validated_views],
+                                [view[row] for view in invalidated_views], 0.0, views["weight"][row]))
+    finally:
+        # Memory views have to be released before their maps are closed
+        for name in maps:
+            views[name].release()
+            maps[name].close()
+
+    z = confidence_z(confidence)
+    total = aggregator.total()
+    summary = {"store_rows": rows, "total": total, "where": [text for column, op, value, text in conditions],
+               "confidence": confidence,
+               "batches": [dict(batch=idx, **header["batches"][idx]) for idx in sorted(batches)], "pow": {}}
+    for key, stats in [("2-block-diff", aggregator.block_diff_2), ("6-block-diff", aggregator.block_diff_6)]:
+        summary["pow"][key + "-average"] = round(stats.mean, 6)
+        summary["pow"][key + "-ci"] = [round(x, 6) for x in stats.confidence_interval(z)]
+    summary["total_wins"] = dict(aggregator.wins)
+    summary["perc_wins"] = {a: str(round(aggregator.wins[a] / total * 100, 4)) + "%" if total else None
+                            for a in adv_ids}
+    summary["perc_wins_ci"] = {a: [str(round(x * 100, 4)) + "%" for x in wilson_interval(aggregator.wins[a], total, z)]
+                               for a in adv_ids}
+    summary["sum_blocks"] = {a: {"average": round(aggregator.sum_blocks[a].mean, 6)} for a in adv_ids}
+    if with_pos:
+        summary["pos"] = {a: {"invalidated_blocks-average": round(aggregator.invalidated_blocks[a].mean, 6),
+                              "validated_blocks-average": round(aggregator.validated_blocks[a].mean, 6)}
+                          for a in adv_ids}
+    if total and any("importance" in header["batches"][idx]["scenario"] for idx in batches):
+        # Importance sampling batches: wins reweighted by their likelihood ratios
+        summary["weighted_win_probability"] = {a: float(f'{aggregator.weighted_win_probability(a)[0]:.6g}')
+                                               for a in adv_ids}
+    print(json.dumps(summary, indent=4))
+    exit(0)
+
+
+def aggregate_store_columns(np, views, conditions, adv_ids, with_pos, aggregator):
+    # Adds the rows of the results store matching every condition to aggregator, working on whole columns:
+    # the memory-mapped columns are NumPy arrays, filtered by one mask. Returns the batches of the matching rows
+    columns = {name: np.frombuffer(view, dtype=view.format) for name, view in views.items()}
+    mask = np.ones(len(columns["sim"]), dtype=bool)
+    for column, op, value, text in conditions:
+        mask &= where_operators[op](columns[column], value)
+    matching = {name: values[mask] for name, values in columns.items()}
+    n = int(mask.sum())
+    if not n:
+        return set()
+    winners = matching["winner"].astype(np.int64)
+    weights = matching["weight"]
+    aggregator.block_diff_2.merge(*array_stats(matching["2-block-diff"]))
+    aggregator.block_diff_6.merge(*array_stats(matching["6-block-diff"]))
+    aggregator.duration.merge(n, 0.0, 0.0)
+    aggregator.weight_sum += float(weights.sum())
+    aggregator.weight_square_sum += float((weights * weights).sum())
+    win_counts = np.bincount(winners, minlength=len(adv_ids))
+    win_weight_sums = np.bincount(winners, weights=weights, minlength=len(adv_ids))
+    win_weight_square_sums = np.bincount(winners, weights=weights * weights, minlength=len(adv_ids))
+    for idx, a in enumerate(adv_ids):
+        aggregator.wins[a] += int(win_counts[idx])
+        aggregator.win_weight_sums[a] += float(win_weight_sums[idx])
+        aggregator.win_weight_square_sums[a] += float(win_weight_square_sums[idx])
+        aggregator.sum_blocks[a].merge(*array_stats(matching["sum_blocks." + a]))
+        if with_pos:
+            aggregator.validated_blocks[a].merge(*array_stats(matching["validated_blocks." + a]))
+            aggregator.invalidated_blocks[a].merge(*array_stats(matching["invalidated_blocks." + a]))
+    return set(np.unique(matching["batch"]).tolist())
 
 
-def save_output(output_file):
-    if output_file and not args.nooutputjson:
+class BatchCheckpoint:
+    # Periodic checkpoints of a batch (--checkpoint): the checkpoint file keeps the scenario, the aggregates,
+    # the random state and the next simulation, and the finished simulations are appended to a companion
+    # file (.sims), so that every checkpoint writes only the simulations finished since the previous one
+
+    def __init__(self, simulator, checkpoint_file, interval):
+        self.simulator = simulator
+        self.checkpoint_file = checkpoint_file
+        self.sims_file = checkpoint_file + ".sims"
+        self.interval = interval
+        self.next_sim = 0
+        self.random_state = None
+        self.saved_sim = 0
+        self.saved_time = datetime.datetime.now()
+        self.store_rows = None      # Rows of the --results-store at the checkpoint resumed
+
+    def finished(self, next_sim):
+        # Simulations up to next_sim - 1 are in the batch aggregates
+        self.next_sim = next_sim
+        if self.simulator.args.seed is None:
+            # Unseeded simulations continue the random stream of the Simulator
+            self.random_state = self.simulator.random.getstate()
+        if (datetime.datetime.now() - self.saved_time).total_seconds() >= self.interval:
+            self.save()
+
+    def start(self):
+        try:
+            open(self.sims_file, 'w').close()
+        except PermissionError:
+            logging.error("Missing write permission while saving checkpoint to " + self.sims_file)
+            exit(6)
+
+    def save(self):
+        simulator = self.simulator
+        batch_aggregator, results_store, output_stream = \
+            simulator.batch_aggregator, simulator.results_store, simulator.output_stream
+        if batch_aggregator.total() != self.next_sim:
+            # Interrupted while adding simulations to the aggregates: the previous checkpoint stands
+            logging.warning("Batch interrupted between checkpoints; keeping the previous checkpoint")
+            return
         try:
-            with open(output_file, args.outputmode) as ofh:
-                pprint.pprint(simulations, ofh)
+            with open(self.sims_file, 'a') as sfh:
+                for s in range(self.saved_sim, self.next_sim):
+                    if str(s) in simulator.simulations["sims"]:
+                        sfh.write(json.dumps(dict(sim=s, **simulation_json(simulator.simulations["sims"][str(s)])),
+                                             separators=(',', ':')) + "\n")
+                sims_offset = sfh.tell()
+            store_rows = None if results_store is None else results_store.commit()
+            checkpoint = {"scenario": simulator.cache_scenario(), "next_sim": self.next_sim,
+                          "aggregate": batch_aggregator.state(), "random_state": self.random_state,
+                          "elapsed": (datetime.datetime.now() - simulator.batch_start_time).total_seconds(),
+                          "sims_offset": sims_offset, "output_offset": output_stream.tell() if output_stream else None,
+                          "store_rows": store_rows}
+            with open(self.checkpoint_file + "." + str(os.getpid()), 'w') as cfh:
+                json.dump(checkpoint, cfh)
+            # A checkpoint is never left partially written
+            os.replace(self.checkpoint_file + "." + str(os.getpid()), self.checkpoint_file)
         except PermissionError:
-            logging.error("Missing write permission while saving output to", output_file)
+            logging.error("Missing write permission while saving checkpoint to " + self.checkpoint_file)
             exit(6)
+        self.saved_sim = self.next_sim
+        self.saved_time = datetime.datetime.now()
+        logging.info("Checkpoint saved at simulation " + str(self.next_sim))
+
+    def resume(self):
+        # Restores the batch as it was at the last checkpoint and returns the next simulation to run
+        simulator = self.simulator
+        args = simulator.args
+        try:
+            with open(self.checkpoint_file) as cfh:
+                checkpoint = json.load(cfh)
+        except (OSError, ValueError):
+            print("Error: No checkpoint to resume in", self.checkpoint_file)
+            exit(1)
+        if args.seed is None:
+            # Seed drawn for the worker processes of the interrupted batch
+            args.seed = checkpoint["scenario"]["seed"]
+        if checkpoint["scenario"] != json.loads(json.dumps(simulator.cache_scenario())):
+            print("Error: The checkpoint in", self.checkpoint_file, "was saved by a different scenario, seed or "
+                  "version of the script")
+            exit(1)
+        simulator.batch_aggregator.merge_state(checkpoint["aggregate"])
+        if checkpoint["random_state"]:
+            version, internal_state, gauss_next = checkpoint["random_state"]
+            simulator.random.setstate((version, tuple(internal_state), gauss_next))
+        simulator.batch_start_time = datetime.datetime.now() - datetime.timedelta(seconds=checkpoint["elapsed"])
+        # Simulations and output lines written after the checkpoint are run and written again
+        os.truncate(self.sims_file, checkpoint["sims_offset"])
+        with open(self.sims_file) as sfh:
+            for line in sfh:
+                sim = json.loads(line)
+                simulator.simulations["sims"][str(sim.pop("sim"))] = sim
+        if checkpoint["output_offset"] is not None:
+            os.truncate(args.outputfile, checkpoint["output_offset"])
+            args.outputmode = 'a'
+        self.next_sim = self.saved_sim = checkpoint["next_sim"]
+        self.random_state = checkpoint["random_state"]
+        self.store_rows = checkpoint.get("store_rows")
+        logging.info("Resuming batch at simulation " + str(self.next_sim))
+        print("Resuming batch from", self.checkpoint_file, "at simulation", self.next_sim)
+        return self.next_sim
+
+    def remove(self):
+        # A finished batch has nothing left to resume
+        for checkpoint_file in [self.checkpoint_file, self.sims_file]:
+            try:
+                os.remove(checkpoint_file)
+            except FileNotFoundError:
+                pass
+
+
+def flatten_summary(summary, prefix=""):
+    # One column per summary metric: nested keys are joined with dots and intervals split in two columns
+    row = {}
+    for key, value in summary.items():
+        if isinstance(value, dict):
+            row.update(flatten_summary(value, prefix + key + "."))
+        elif isinstance(value, list):
+            row[prefix + key + "-low"], row[prefix + key + "-high"] = value
         else:
-            logging.info("Saved simulation JSON object to " + output_file)
+            row[prefix + key] = value
+    return row
 
 
-def config_logging(logfile, logmode, loglevel):
-    numeric_log_level = getattr(logging, loglevel.upper(), None)
-    if not isinstance(numeric_log_level, int):
-        raise ValueError('Invalid log level: %s' % loglevel)
-    try:
-        logging.raiseExceptions = False
-        logging.basicConfig(format='%(levelname)s:%(message)s',
-                            filename=logfile, filemode=logmode, level=numeric_log_level)
-    except PermissionError:
-        print("Missing write permission while saving logs to", logfile)
-        pass
+def paired_variant_name(adv_stake):
+    return "PoW+PoS " + "/".join(map(str, adv_stake)) if adv_stake else "PoW"
 
 
-def attacker_success_probability(q, z):
-    # Ported to Python from Bitcoin whitepaper
-    # (Satoshi Nakamoto, 2009, page 7, available at https://bitcoin.org/bitcoin.pdf)
-    import math
-    p = float(1.0 - q)
-    lambda_var = float(z * (q / p))
-    sum_value = 1.0
-    for k in range(0, z + 1):
-        poisson = float(math.exp(-lambda_var))
-        for i in range(1, k + 1):
-            poisson *= lambda_var / i
-        sum_value -= poisson * (1 - pow(q / p, z - k))
-    return sum_value
+def paired_values(outcome):
+    # Metrics compared simulation by simulation (in paired_metrics() order): whether each adversary won,
+    # the 6-block difference and the blocks lost (blocks of the chains that lost the race, and blocks
+    # invalidated by PoS)
+    diff_2, diff_6, winner, sum_blocks, validated_blocks, invalidated_blocks = outcome[:6]
+    winner_idx = int(winner[1:])
+    blocks_lost = sum(sum_blocks) - sum_blocks[winner_idx] + sum(invalidated_blocks)
+    return [int(winner_idx == idx) for idx in range(len(sum_blocks))] + [diff_6, blocks_lost]
 
 
-def test_attacker_success_probability(q=0.1):
-    # Expect the same results as in Bitcoin whitepaper page 8, available at https://bitcoin.org/bitcoin.pdf
-    print("q =", q)
-    for z in range(0, 11):
-        print("z =", z, "P =", attacker_success_probability(q, z))
+class PairedAggregator:
+    # Aggregates of a paired comparison: the metrics of every variant and their changes from PoW only,
+    # simulation by simulation
+
+    def __init__(self, metrics, num_variants):
+        self.metrics = metrics
+        self.values = [[RunningStats() for _ in metrics] for _ in range(num_variants)]
+        self.changes = [[RunningStats() for _ in metrics] for _ in range(num_variants)]
+        self.winner_changes = [0] * num_variants
+
+    def total(self):
+        return self.values[0][0].n
+
+    def add(self, outcomes):
+        # Outcomes of one simulation index, in paired_variants() order
+        base_values = paired_values(outcomes[0])
+        for v, outcome in enumerate(outcomes):
+            self.winner_changes[v] += outcome[2] != outcomes[0][2]
+            for idx, value in enumerate(paired_values(outcome)):
+                self.values[v][idx].add(value)
+                self.changes[v][idx].add(value - base_values[idx])
+
+    def merge(self, other):
+        for v in range(len(self.values)):
+            self.winner_changes[v] += other.winner_changes[v]
+            for idx in range(len(self.metrics)):
+                self.values[v][idx].merge(**vars(other.values[v][idx]))
+                self.changes[v][idx].merge(**vars(other.changes[v][idx]))
+
+
+def run_benchmark_scenario(scenario_args, config_values, queue):
+    # Runs in a process of its own, so that the peak memory is the scenario's
+    init_worker(scenario_args, config_values)
+    simulator = worker_simulator
+    start_time = datetime.datetime.now()
+    simulator.run_batch_simulations(total_simulations=scenario_args.simulations,
+                                    rewind_blocks=scenario_args.rewind_blocks, rewind_adv=scenario_args.rewind_adv,
+                                    report=False)
+    elapsed = (datetime.datetime.now() - start_time).total_seconds()
+    batch_time = (simulator.batch_end_time - simulator.batch_start_time).total_seconds()
+    batch_aggregator = simulator.batch_aggregator
+    race_time = batch_aggregator.duration.mean * batch_aggregator.total()
+    # The NumPy engine doesn't keep the cycles of each simulation
+    cycles = None
+    if scenario_args.engine == 'scalar':
+        cycles = sum(len(sim.drawn_block_hashes) for sim in simulator.simulations["sims"].values())
+    try:
+        import resource
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        peak_memory = None
+    queue.put({"simulations": batch_aggregator.total(), "elapsed": elapsed,
+               "simulations_per_sec": round(batch_aggregator.total() / elapsed, 3),
+               "cycles": cycles, "cycles_per_sec": None if cycles is None else round(cycles / elapsed, 3),
+               "peak_memory_kb": peak_memory,
+               "phases": {"setup": round(batch_time - race_time, 6), "race": round(race_time, 6),
+                          "averages": round(elapsed - batch_time, 6)}})
+
+
+def compare_benchmark(results, baseline_file, threshold):
+    # Returns the scenarios whose simulations per second fell by more than threshold (--benchmark-threshold)
+    try:
+        with open(baseline_file) as bfh:
+            baseline = json.load(bfh)
+    except (OSError, ValueError):
+        print("Error: Can't read the benchmark baseline", baseline_file)
+        exit(1)
+    if (baseline["engine"], baseline["workers"]) != (results["engine"], results["workers"]):
+        print("Warning: The baseline ran with engine", baseline["engine"], "and", baseline["workers"], "workers")
+    regressions = list()
+    print("\nComparison with", baseline_file, "(threshold: -" + str(threshold) + "%)")
+    print(f'{"Scenario":18} {"Sims/sec":>12} {"Baseline":>12} {"Change":>9}')
+    for name, scenario in results["scenarios"].items():
+        if name not in baseline["scenarios"]:
+            print(f'{name:18} not in baseline')
+            continue
+        baseline_rate = baseline["scenarios"][name]["simulations_per_sec"]
+        change = (scenario["simulations_per_sec"] / baseline_rate - 1) * 100
+        regressed = change < -threshold
+        regressed and regressions.append(name)
+        print(f'{name:18} {scenario["simulations_per_sec"]:>12} {baseline_rate:>12} {change:>+8.1f}%' +
+              (" REGRESSION" if regressed else ""))
+    return regressions
+
+
+class PhaseMetrics:
+    # Counters of --metrics-file: number of calls, total time and histogram of durations of every phase
+    # (metrics_phases), and counts of events (metrics_counters). Worker processes collect their own for every
+    # range of simulations, merged by the main process, which saves them
+
+    def __init__(self, metrics_file=None, every=None, metrics_format='json'):
+        self.metrics_file = metrics_file
+        self.every = every
+        self.metrics_format = metrics_format
+        self.saved = 0
+        # Phase: [calls, seconds, calls per histogram bucket (the last one above metrics_buckets)]
+        self.phases = {phase: [0, 0.0, [0] * (len(metrics_buckets) + 1)] for phase in metrics_phases}
+        self.counters = dict.fromkeys(metrics_counters, 0)
+
+    def add(self, phase, started):
+        elapsed = time.perf_counter() - started
+        stats = self.phases[phase]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2][bisect.bisect_left(metrics_buckets, elapsed)] += 1
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+
+    def end_cycle(self, skipped_draws):
+        # Empty draws skipped by --draw-mode direct count as empty draws
+        self.counters["cycles"] += 1
+        self.counters["empty_draws"] += skipped_draws
+
+    def state(self):
+        return {"phases": self.phases, "counters": self.counters}
+
+    def merge_state(self, state):
+        for phase, (calls, seconds, buckets) in state["phases"].items():
+            stats = self.phases[phase]
+            stats[0] += calls
+            stats[1] += seconds
+            stats[2] = [a + b for a, b in zip(stats[2], buckets)]
+        for counter, n in state["counters"].items():
+            self.counters[counter] += n
+
+    def finished(self):
+        # Saves every --metrics-every simulations (main process only)
+        if self.metrics_file and self.every and self.counters["simulations"] // self.every > self.saved // self.every:
+            self.save()
+
+    def to_json(self):
+        labels = [repr(bound) for bound in metrics_buckets] + ["+Inf"]
+        return {"version": __version__, "counters": dict(self.counters),
+                "phases": {phase: {"calls": calls, "seconds": round(seconds, 6),
+                                   "mean_seconds": float(f'{seconds / calls:.6g}') if calls else 0.0,
+                                   "histogram": dict(zip(labels, buckets))}
+                           for phase, (calls, seconds, buckets) in self.phases.items()}}
+
+    def to_prometheus(self):
+        # Text exposition format: histogram buckets are cumulative
+        lines = ["# HELP invalidationgame_phase_seconds Time spent in each phase of the simulations",
+                 "# TYPE invalidationgame_phase_seconds histogram"]
+        for phase, (calls, seconds, buckets) in self.phases.items():
+            cumulative = 0
+            for bound, n in zip([repr(bound) for bound in metrics_buckets] + ["+Inf"], buckets):
+                cumulative += n
+                lines.append(f'invalidationgame_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+            lines.append(f'invalidationgame_phase_seconds_sum{{phase="{phase}"}} {seconds!r}')
+            lines.append(f'invalidationgame_phase_seconds_count{{phase="{phase}"}} {calls}')
+        lines.append("# HELP invalidationgame_events_total Events of the simulations")
+        lines.append("# TYPE invalidationgame_events_total counter")
+        for counter, n in self.counters.items():
+            lines.append(f'invalidationgame_events_total{{event="{counter}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def save(self):
+        if not self.metrics_file:
+            return
+        self.saved = self.counters["simulations"]
+        temp_file = self.metrics_file + "." + str(os.getpid())
+        try:
+            with open(temp_file, 'w') as mfh:
+                if self.metrics_format == 'prometheus':
+                    mfh.write(self.to_prometheus())
+                else:
+                    json.dump(self.to_json(), mfh, indent=4)
+            # Readers (like the textfile collector of a Prometheus node exporter) never see a partial file
+            os.replace(temp_file, self.metrics_file)
+        except PermissionError:
+            logging.error("Missing write permission while saving metrics to " + self.metrics_file)
+            exit(6)
+        logging.info("Saved metrics to " + self.metrics_file)
+
+
+class RunningStats:
+    # Running count, mean and sum of squared deviations (Welford's algorithm), so that a batch
+    # doesn't need to keep every value to report averages and confidence intervals
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def merge(self, n, mean, m2):
+        # Adds n values with the given mean and sum of squared deviations at once (Chan et al.)
+        if not n:
+            return
+        if not self.n:
+            self.n, self.mean, self.m2 = n, mean, m2
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.n = total
+
+    def stderr(self):
+        if self.n < 2:
+            return 0.0
+        return math.sqrt(self.m2 / (self.n - 1) / self.n)
+
+    def confidence_interval(self, z):
+        half_width = z * self.stderr()
+        return [self.mean - half_width, self.mean + half_width]
+
+
+def wilson_interval(successes, n, z):
+    # Confidence interval of a proportion; unlike the normal approximation, it isn't empty when no
+    # simulation (or every simulation) was won
+    if not n:
+        return [0.0, 1.0]
+    p = successes / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return [max(0.0, center - half_width), min(1.0, center + half_width)]
+
+
+def confidence_z(confidence):
+    return statistics.NormalDist().inv_cdf(0.5 + confidence / 200)
+
+
+class BatchAggregator:
+    # Aggregates of a batch of simulations, updated as each simulation finishes. With a target precision
+    # (--target-precision), the batch stops as soon as the intervals of the confidence level are narrow enough
+
+    def __init__(self, adv_ids, target_precision=None, confidence=95.0):
+        self.adv_ids = adv_ids
+        self.target_precision = target_precision
+        self.confidence = confidence
+        self.block_diff_2 = RunningStats()
+        self.block_diff_6 = RunningStats()
+        self.duration = RunningStats()
+        self.wins = {a: 0 for a in adv_ids}
+        self.sum_blocks = {a: RunningStats() for a in adv_ids}
+        self.validated_blocks = {a: RunningStats() for a in adv_ids}
+        self.invalidated_blocks = {a: RunningStats() for a in adv_ids}
+        # Sums of the likelihood ratios (and of their squares) of importance sampling, overall and per winner
+        self.weight_sum = 0.0
+        self.weight_square_sum = 0.0
+        self.win_weight_sums = {a: 0.0 for a in adv_ids}
+        self.win_weight_square_sums = {a: 0.0 for a in adv_ids}
+
+    def total(self):
+        return self.block_diff_6.n
+
+    def add(self, outcome):
+        diff_2, diff_6, winner, sum_blocks, validated_blocks, invalidated_blocks, duration, weight = outcome
+        self.weight_sum += weight
+        self.weight_square_sum += weight * weight
+        self.win_weight_sums[winner] += weight
+        self.win_weight_square_sums[winner] += weight * weight
+        self.block_diff_2.add(diff_2)
+        self.block_diff_6.add(diff_6)
+        self.duration.add(duration)
+        self.wins[winner] += 1
+        for idx, a in enumerate(self.adv_ids):
+            self.sum_blocks[a].add(sum_blocks[idx])
+            if validated_blocks:
+                self.validated_blocks[a].add(validated_blocks[idx])
+                self.invalidated_blocks[a].add(invalidated_blocks[idx])
+
+    def merge(self, other):
+        self.merge_state(other.state())
+
+    def state(self):
+        # Counts, means and sums of squared deviations, as stored by the ResultCache
+        return {"block_diff_2": dict(vars(self.block_diff_2)), "block_diff_6": dict(vars(self.block_diff_6)),
+                "duration": dict(vars(self.duration)), "wins": dict(self.wins),
+                "sum_blocks": {a: dict(vars(stats)) for a, stats in self.sum_blocks.items()},
+                "validated_blocks": {a: dict(vars(stats)) for a, stats in self.validated_blocks.items()},
+                "invalidated_blocks": {a: dict(vars(stats)) for a, stats in self.invalidated_blocks.items()},
+                "weight_sum": self.weight_sum, "weight_square_sum": self.weight_square_sum,
+                "win_weight_sums": dict(self.win_weight_sums),
+                "win_weight_square_sums": dict(self.win_weight_square_sums)}
+
+    def merge_state(self, state):
+        self.block_diff_2.merge(**state["block_diff_2"])
+        self.block_diff_6.merge(**state["block_diff_6"])
+        self.duration.merge(**state["duration"])
+        self.weight_sum += state["weight_sum"]
+        self.weight_square_sum += state["weight_square_sum"]
+        for a in self.adv_ids:
+            self.wins[a] += state["wins"][a]
+            self.win_weight_sums[a] += state["win_weight_sums"][a]
+            self.win_weight_square_sums[a] += state["win_weight_square_sums"][a]
+            self.sum_blocks[a].merge(**state["sum_blocks"][a])
+            self.validated_blocks[a].merge(**state["validated_blocks"][a])
+            self.invalidated_blocks[a].merge(**state["invalidated_blocks"][a])
+
+    def weighted_win_probability(self, adv_id):
+        # Importance sampling estimate of the probability of adv_id winning and its standard error
+        n = self.total()
+        estimate = self.win_weight_sums[adv_id] / n
+        if n < 2:
+            return estimate, 0.0
+        variance = max(self.win_weight_square_sums[adv_id] / n - estimate * estimate, 0.0) * n / (n - 1)
+        return estimate, math.sqrt(variance / n)
+
+    def effective_simulations(self):
+        # Kish's effective sample size of the weighted simulations
+        return self.weight_sum * self.weight_sum / self.weight_square_sum if self.weight_square_sum else 0.0
+
+    def precision(self, z):
+        # Widest half-width among the intervals of the simulations won (percentage points)
+        # and of the 2 and 6-block difference averages (blocks)
+        half_widths = [z * self.block_diff_2.stderr(), z * self.block_diff_6.stderr()]
+        for a in self.adv_ids:
+            low, high = wilson_interval(self.wins[a], self.total(), z)
+            half_widths.append((high - low) * 100 / 2)
+        return max(half_widths)
+
+    def precision_reached(self):
+        if self.target_precision is None or self.total() < min_simulations_for_precision:
+            return False
+        return self.precision(confidence_z(self.confidence)) <= self.target_precision
+
+
+class OutcomeRecorder:
+    # Stands in for the BatchAggregator in worker processes: keeps the outcomes in order,
+    # so that the main process aggregates them exactly as a single process would
+
+    def __init__(self):
+        self.items = list()
+
+    def add(self, outcome):
+        self.items.append(outcome)
+
+    def merge(self, aggregator):
+        self.items.append(aggregator)
+
+    def precision_reached(self):
+        # Workers don't stop early: the main process does
+        return False
+
+    def replay(self, aggregator):
+        for item in self.items:
+            if isinstance(item, BatchAggregator):
+                aggregator.merge(item)
+            else:
+                aggregator.add(item)
+
+
+def simulation_json(sim):
+    # Scalar simulations are kept as compact records; the NumPy engine already keeps the JSON shape
+    return sim.to_json() if isinstance(sim, SimulationRecord) else sim
+
+
+def config_logging(logfile, logmode, loglevel):
+    numeric_log_level = getattr(logging, loglevel.upper(), None)
+    if not isinstance(numeric_log_level, int):
+        raise ValueError('Invalid log level: %s' % loglevel)
+    try:
+        logging.raiseExceptions = False
+        logging.basicConfig(format='%(levelname)s:%(message)s',
+                            filename=logfile, filemode=logmode, level=numeric_log_level)
+    except PermissionError:
+        print("Missing write permission while saving logs to", logfile)
+        pass
+    global log_info_enabled, log_debug_enabled
+    log_info_enabled = logging.getLogger().isEnabledFor(logging.INFO)
+    log_debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+
+
+def attacker_success_probability(q, z, model='poisson'):
+    # Probability of an attacker with a share q of the hashpower catching up from z blocks behind, by the model
+    # of --probability-model. calc_distance() asks for it on every cycle of pure PoW simulations: results are
+    # memoised per (model, q, z)
+    key = (model, q, z)
+    if key not in probability_cache:
+        if model == 'exact':
+            probability_cache[key] = exact_success_probability(q, z)
+        else:
+            probability_cache[key] = poisson_success_probability(q, z)
+    return probability_cache[key]
+
+
+def attacker_success_probabilities(q_values, z_values, model='poisson'):
+    # Probabilities for every q (rows) and z (columns) at once, to set up the table of a batch or a sweep
+    return [[attacker_success_probability(q, z, model) for z in z_values] for q in q_values]
+
+
+def poisson_success_probability(q, z):
+    # Ported to Python from Bitcoin whitepaper
+    # (Satoshi Nakamoto, 2009, page 7, available at https://bitcoin.org/bitcoin.pdf)
+    # The Poisson terms are a running product instead of being recomputed for each k
+    p = float(1.0 - q)
+    lambda_var = float(z * (q / p))
+    sum_value = 1.0
+    poisson = float(math.exp(-lambda_var))
+    for k in range(0, z + 1):
+        if k > 0:
+            poisson *= lambda_var / k
+        sum_value -= poisson * (1 - pow(q / p, z - k))
+    return sum_value
+
+
+def exact_success_probability(q, z):
+    # Exact catch-up probability (Meni Rosenfeld, 2014, Analysis of hashrate-based double-spending,
+    # available at https://arxiv.org/abs/1402.2009): the number of blocks mined by the attacker while
+    # the others mine z blocks follows a negative binomial distribution, not a Poisson one
+    p = 1.0 - q
+    if q >= p or z == 0:
+        return 1.0
+    return 1.0 - sum(math.comb(m + z - 1, m) * (p ** z * q ** m - q ** z * p ** m) for m in range(z + 1))
+
+
+def test_attacker_success_probability(q=0.1, model='poisson'):
+    # Expect the same results as in Bitcoin whitepaper page 8, available at https://bitcoin.org/bitcoin.pdf
+    print("q =", q)
+    for z in range(0, 11):
+        print("z =", z, "P =", attacker_success_probability(q, z, model))
+
+
+def solve_interval(lo, hi, up, down, left, right, step_values):
+    # Expected quantity x(D) over the height differences D = lo..hi of the race, a birth-death chain:
+    # x(D) = step(D) + up x(D + 1) + down x(D - 1) + (1 - up - down) x(D), with x(lo - 1) = left and
+    # x(hi + 1) = right. The system is tridiagonal: Thomas algorithm
+    n = hi - lo + 1
+    rhs = list(step_values)
+    rhs[0] += down * left
+    rhs[-1] += up * right
+    diag = up + down
+    super_diag, solved_rhs = [0.0] * n, [0.0] * n
+    for i in range(n):
+        pivot = diag - (down * super_diag[i - 1] if i else 0.0)
+        super_diag[i] = up / pivot
+        solved_rhs[i] = (rhs[i] + (down * solved_rhs[i - 1] if i else 0.0)) / pivot
+    x = [0.0] * n
+    for i in reversed(range(n)):
+        x[i] = solved_rhs[i] + (super_diag[i] * x[i + 1] if i < n - 1 else 0.0)
+    return {lo + i: x[i] for i in range(n)}
+
+
+def solve_race(up, down, start):
+    # Exact solution of the race between A0 and A1 from the height difference start (A0 - A1), where each
+    # cycle moves the difference up or down by one block (or leaves it, with probability 1 - up - down).
+    # Returns A0's probability of winning, the expected cycles to the 6-block difference, the probability
+    # of meeting the 2-block difference and the expected cycles to it, counted only when it is met
+    if abs(start) == 6:
+        return float(start > 0), 0.0, 0.0, 0.0
+    win = solve_interval(-5, 5, up, down, 0.0, 1.0, [0.0] * 11)[start]
+    cycles_6 = solve_interval(-5, 5, up, down, 0.0, 0.0, [1.0] * 11)[start]
+    if abs(start) == 2:
+        return win, cycles_6, 1.0, 0.0
+    if abs(start) < 2:
+        # The difference can't reach 6 blocks without going through 2 blocks
+        return win, cycles_6, 1.0, solve_interval(-1, 1, up, down, 0.0, 0.0, [1.0] * 3)[start]
+    # From 3 to 5 blocks of difference, the 2-block difference is met only if the lagging adversary catches up
+    lo, hi, left, right = (3, 5, 1.0, 0.0) if start > 0 else (-5, -3, 0.0, 1.0)
+    reach_2 = solve_interval(lo, hi, up, down, left, right, [0.0] * 3)
+    cycles_2 = solve_interval(lo, hi, up, down, 0.0, 0.0, [reach_2[d] for d in range(lo, hi + 1)])
+    return win, cycles_6, reach_2[start], cycles_2[start]
+
+
+def hypergeometric_pmf(population, successes, draws, k):
+    return math.exp(math.lgamma(successes + 1) - math.lgamma(k + 1) - math.lgamma(successes - k + 1) +
+                    math.lgamma(population - successes + 1) - math.lgamma(draws - k + 1) -
+                    math.lgamma(population - successes - draws + k + 1) -
+                    math.lgamma(population + 1) + math.lgamma(draws + 1) + math.lgamma(population - draws + 1))
+
+
+class Scenario:
+    # Settings of a batch run by a Simulator: the adversaries, the number of simulations and the rewind
+    # blocks, any other option of the command line by its destination (seed, engine, workers, drawmode,
+    # votesampling, targetprecision, ...) and values of the configuration file that differ from the Simulator's
+
+    def __init__(self, hashpower, stake=None, simulations=1, rewind_blocks=0, rewind_adv=0, config=None,
+                 keep_simulations=False, **options):
+        default_args = build_parser().parse_args([])
+        for option in options:
+            if not hasattr(default_args, option):
+                raise ScenarioError("Unknown option: " + option)
+        self.hashpower = list(hashpower or [])
+        self.stake = list(stake or [])
+        self.simulations = simulations
+        self.rewind_blocks = rewind_blocks
+        self.rewind_adv = rewind_adv
+        self.config = dict(config or {})
+        self.keep_simulations = keep_simulations
+        self.options = options
+
+    @classmethod
+    def from_args(cls, scenario_args):
+        # The Scenario of a command line; its chains are kept unless --no-output-json
+        options = {name: value for name, value in vars(scenario_args).items()
+                   if name not in ('pow', 'pos', 'simulations', 'rewind_blocks', 'rewind_adv', 'nooutputjson')}
+        return cls(scenario_args.pow, scenario_args.pos, scenario_args.simulations, scenario_args.rewind_blocks,
+                   scenario_args.rewind_adv, keep_simulations=not scenario_args.nooutputjson, **options)
+
+    def namespace(self):
+        # The options of the batch, as parsed from a command line
+        scenario_args = build_parser().parse_args([])
+        vars(scenario_args).update(self.options)
+        scenario_args.pow = self.hashpower
+        scenario_args.pos = self.stake
+        scenario_args.simulations = self.simulations
+        scenario_args.rewind_blocks = self.rewind_blocks
+        scenario_args.rewind_adv = self.rewind_adv
+        # Without the JSON output, simulations don't keep their chains
+        scenario_args.nooutputjson = not self.keep_simulations
+        return scenario_args
+
+
+class BatchResult:
+    # Outcome of a batch run by a Simulator: the summary of the JSON output and, with keep_simulations,
+    # its simulations
+
+    def __init__(self, scenario, summary, sims):
+        self.scenario = scenario
+        self.summary = summary
+        self.sims = sims
+
+    def win_probability(self, adv_id):
+        return self.summary["total_wins"][adv_id] / self.summary["total"]
+
+    def to_json(self):
+        return {"sims": self.sims, "summary": self.summary}
+
+
+class Simulator:
+    # Runs scenarios and returns their results, for notebooks and services that import this module, and the
+    # batches of the command line. Everything a batch changes (its options, configuration values, random
+    # generator, adversaries, simulations, ...) belongs to its Simulator, so Simulators don't share any state
+    # and batches run in the calling process. Worker processes run their tasks on a Simulator of their own
+
+    def __init__(self, config=None):
+        # Configuration values (block_hash_space, pos_avg_ticket_pool_size, ...); defaults otherwise
+        self.random = random.Random()
+        self.args = None
+        self.simulations = {}
+        self.adversaries = {}
+        self.block_hash_owners = []
+        self.winning_block_hashes = []
+        self.ticket_owners = {}
+        self.drawable_tickets = []
+        self.batch_aggregator = None
+        self.output_stream = None
+        self.trace_buffer = None
+        self.height_tracker = None
+        self.result_cache = None
+        self.batch_checkpoint = None
+        self.importance_sampler = None
+        self.phase_metrics = None
+        self.outcome_records = None
+        self.results_store = None
+        self.batch_start_time = self.batch_end_time = datetime.datetime.now()
+        # Random numbers of the PoW and PoS draws, unless importance sampling tilts them
+        self.pow_random = self.pos_random = self.random
+        self.config = default_config_values()
+        self.configure(config or {})
+
+    def configure(self, config):
+        # Overrides configuration values of the Simulator, e.g. those read from the configuration file
+        check_config_values(config)
+        self.config.update(config)
+        self.set_config_values(self.config)
+
+    def run(self, scenario, report=False):
+        # Runs the batch, sweep or paired comparison of the scenario. With report, its results are also printed
+        # and saved as the command line does
+        check_config_values(scenario.config)
+        self.args = scenario.namespace()
+        self.set_config_values(dict(self.config, **scenario.config))
+        # Sweeps check each of their scenarios
+        self.sweep_requested() or self.sanity_check(self.args.pow, self.args.pos, self.args.rewind_adv)
+        if self.sweep_requested():
+            # The sweep table is the summary: simulations are not kept
+            return BatchResult(scenario, {"points": self.run_sweep(report)}, {})
+        if self.paired_requested():
+            self.run_paired_comparison(self.args.simulations, self.args.rewind_blocks, self.args.rewind_adv, report)
+        elif self.args.replaysim is not None:
+            # The batch from its simulation args.replaysim to the same one
+            self.run_batch_simulations(self.args.replaysim + 1, self.args.rewind_blocks, self.args.rewind_adv, report,
+                                       first_sim=self.args.replaysim)
+        else:
+            self.run_batch_simulations(self.args.simulations, self.args.rewind_blocks, self.args.rewind_adv, report)
+        sims = self.export_simulations()["sims"] if scenario.keep_simulations and not report else {}
+        return BatchResult(scenario, self.simulations["summary"], sims)
+
+    def run_many(self, scenarios):
+        return [self.run(scenario) for scenario in scenarios]
+
+    def start_worker(self, worker_args):
+        # A Simulator of a worker process runs tasks of a batch with the options of the main process
+        self.args = worker_args
+        self.simulations["sims"] = {}
+        self.phase_metrics = PhaseMetrics() if worker_args.metricsfile else None
+
+    def save_interrupted(self):
+        # Events recorded so far help finding out where a long batch was
+        self.trace_buffer is None or self.trace_buffer.save(self.args.tracefile)
+        self.phase_metrics is None or self.phase_metrics.save()
+        # And so do the simulations already run
+        self.result_cache is None or self.result_cache.save()
+        self.results_store is None or self.results_store.commit()
+        self.batch_checkpoint is None or self.batch_checkpoint.save()
+
+    def sanity_check(self, adv_hashpower, adv_stake, rewind_adv):
+        args = self.args
+        if type(adv_hashpower) != list or len(adv_hashpower) < 2:
+            raise ScenarioError("When simulating PoW attacks, a minimum of 2 adversaries are required. "
+                                "Use --help for help.")
+
+        total_pow_hashpower = sum(round(float(x), 2) for x in adv_hashpower)
+        if total_pow_hashpower != 100:
+            raise ScenarioError("Total hashpower must sum 100, but summed " + str(total_pow_hashpower), 2)
+
+        if adv_stake:
+            total_pos_stake = sum(round(float(x), 2) for x in adv_stake)
+            if total_pos_stake != 100:
+                raise ScenarioError("Total staked must sum 100, but summed " + str(total_pos_stake), 3)
+
+            if len(adv_hashpower) != len(adv_stake):
+                raise ScenarioError("The number of PoW and PoS adversaries don't match")
+
+        if rewind_adv + 1 > len(adv_hashpower):     # rewind_adv starts in 0
+            raise ScenarioError("Adversary in advantage and hashpower settings don't match", 4)
+        if int(args.rewind_blocks) > 6:
+            raise ScenarioError("--rewind-blocks can't exceed 6, the block difference that ends a simulation", 4)
+
+        if args.engine == 'numpy' and len(adv_hashpower) > numpy_max_adversaries:
+            raise ScenarioError("--engine numpy runs up to " + str(numpy_max_adversaries) +
+                                " adversaries; use --engine scalar")
+        if args.propagationdelay and args.engine != 'event':
+            raise ScenarioError("--propagation-delay is only available for the event engine")
+        if args.propagationdelay and len(args.propagationdelay) not in (1, len(adv_hashpower)):
+            raise ScenarioError("Use one --propagation-delay for every adversary, or one per adversary")
+        if args.tracefile and (args.workers > 1 or args.engine != 'scalar'):
+            raise ScenarioError("--trace-file is only available for the scalar engine in a single process")
+        if args.tracefile and len(adv_hashpower) > 64:
+            raise ScenarioError("--trace-file records up to 64 adversaries")
+        if not 0 < args.confidence < 100:
+            raise ScenarioError("--confidence must be greater than 0 and less than 100")
+        if args.targetprecision is not None and args.targetprecision <= 0:
+            raise ScenarioError("--target-precision must be greater than 0")
+        if args.resume and not args.checkpoint:
+            raise ScenarioError("--resume requires --checkpoint")
+        if args.replaysim is not None:
+            if args.seed is None:
+                raise ScenarioError("--replay-sim requires --seed: only the simulations of seeded batches can be "
+                                    "replayed")
+            if args.replaysim < 0:
+                raise ScenarioError("--replay-sim must be 0 or greater")
+            if args.engine == 'numpy':
+                raise ScenarioError("--replay-sim is not available for the NumPy engine, which draws the numbers of "
+                                    "whole chunks of simulations")
+            if args.checkpoint or self.sweep_requested() or self.paired_requested():
+                raise ScenarioError("--replay-sim is not available with --checkpoint, sweeps and paired comparisons")
+        if args.cachedir and args.seed is None:
+            raise ScenarioError("--cache-dir requires --seed: only seeded simulations can be reused")
+        if args.summaryonly and args.engine == 'numpy' and (args.workers > 1 or args.cachedir) and \
+                not args.nooutputjson:
+            raise ScenarioError("--summary-only records every simulation: with --engine numpy, it's not available with "
+                                "--workers or --cache-dir, which only return the aggregates of the chunks; use "
+                                "--no-output-json")
+        if args.summaryonly and args.checkpoint and not args.nooutputjson and args.outputformat != 'ndjson':
+            raise ScenarioError("--checkpoint doesn't keep the records of --summary-only: use --output-format ndjson "
+                                "or --no-output-json")
+        if args.resultsstore and args.engine == 'numpy' and (args.workers > 1 or args.cachedir):
+            raise ScenarioError("--results-store keeps every simulation: with --engine numpy, it's not available with "
+                                "--workers or --cache-dir, which only return the aggregates of the chunks")
+        if self.importance_sampling():
+            if args.engine != 'scalar':
+                raise ScenarioError("Importance sampling is only available for the scalar engine")
+            if args.targetprecision is not None:
+                raise ScenarioError("--target-precision is not available with importance sampling")
+            if args.importancevotetilt is not None and args.importancevotetilt <= 0:
+                raise ScenarioError("--importance-vote-tilt must be greater than 0")
+            if args.importanceadv is not None and not 0 <= args.importanceadv < len(adv_hashpower):
+                raise ScenarioError("Adversary favoured by importance sampling and hashpower settings don't match")
+        if self.paired_requested():
+            if args.engine != 'scalar' or self.importance_sampling():
+                raise ScenarioError("Paired comparisons are only available for the scalar engine, "
+                                    "without importance sampling")
+            if args.targetprecision is not None or args.cachedir or args.checkpoint or args.tracefile or \
+                    args.metricsfile or args.resultsstore:
+                raise ScenarioError("--target-precision, --cache-dir, --checkpoint, --trace-file, --metrics-file and "
+                                    "--results-store are not available with paired comparisons")
+            if len(self.paired_variants()) < 2:
+                raise ScenarioError("--paired compares PoW with PoW + PoS: use -s or --paired-pos")
+            for adv_stake in args.pairedpos or []:
+                total_pos_stake = sum(round(float(x), 2) for x in adv_stake)
+                if total_pos_stake != 100:
+                    raise ScenarioError("Total staked of --paired-pos must sum 100, but summed " + str(total_pos_stake),
+                                        3)
+                if len(adv_hashpower) != len(adv_stake):
+                    raise ScenarioError("The number of PoW adversaries and of --paired-pos stake sizes don't match")
+
+    def get_config_values(self):
+        # Configuration values of the batch, to be passed to worker processes
+        return {'block_hash_space': self.block_hash_space, 'pos_avg_ticket_pool_size': self.pos_avg_ticket_pool_size,
+                'pos_blocks_with_5votes': self.pos_blocks_with_5votes,
+                'pos_blocks_with_4votes': self.pos_blocks_with_4votes,
+                'pos_blocks_with_3votes': self.pos_blocks_with_3votes}
+
+    def set_config_values(self, config_values):
+        vars(self).update(config_values)
+        # Recalculate ticket proportions with the new values, whichever of them changed
+        self.pos_blocks_with_votes = self.pos_blocks_with_5votes + self.pos_blocks_with_4votes + \
+            self.pos_blocks_with_3votes
+        self.pos_prop_blocks_5votes = self.pos_blocks_with_5votes / self.pos_blocks_with_votes
+        self.pos_prop_blocks_4votes = self.pos_blocks_with_4votes / self.pos_blocks_with_votes
+        self.pos_prop_blocks_3votes = self.pos_blocks_with_3votes / self.pos_blocks_with_votes
+        self.vote_proportions = (self.pos_prop_blocks_5votes, self.pos_prop_blocks_4votes, self.pos_prop_blocks_3votes)
+        # Bulk buffers of the draws of the PoW and PoS random streams, and of the PoW draws of a cycle after PoS
+        # invalidated its block. Paired comparisons give the redraws their own stream, so that the other PoW draws
+        # line up with those of the PoW only variant, cycle by cycle
+        self.pow_draws = self.pos_draws = self.pow_redraws = RandomBuffer(self.random, self.vote_proportions)
+
+    def calc_hashpower(self, adv_hashpower, adv_stake):
+        self.adversaries = {}
+        block_hash_counts = [round(round(float(a), 2) * 100) for a in adv_hashpower]
+        for idx, a in enumerate(adv_hashpower):
+            adv_id = "A" + str(idx)
+            self.adversaries[adv_id] = {}
+            self.adversaries[adv_id]["hashpower"] = a
+            self.adversaries[adv_id]["drawn_block_hashes"] = list()
+            self.adversaries[adv_id]["sum_blocks"] = 0
+
+            # Won't remove the block hashes already selected; one block hash can be owned by two adversaries
+            # This only means that they can mine a block roughly at the same time t;
+            if not self.reveal_owners(self.args.drawmode == 'scan'):
+                self.adversaries[adv_id]["prob_block_hashes"] = \
+                    self.pow_random.sample(range(self.block_hash_space), k=block_hash_counts[idx])
+
+        self.height_tracker = HeightTracker(list(self.adversaries))
+
+        if self.reveal_owners(self.args.drawmode == 'scan'):
+            # Only the owners of the drawn block hashes are needed
+            self.block_hash_owners = RevealedOwners(block_hash_counts, self.block_hash_space, self.pow_draws,
+                                                    shared=True)
+            self.winning_block_hashes = list()
+        else:
+            # Index every block hash to the adversaries that own it (in adversary order), so that
+            # mine_block() resolves a PoW draw with a single lookup instead of scanning each list
+            owners = [[] for _ in range(self.block_hash_space)]
+            for a in self.adversaries:
+                for block_hash in self.adversaries[a]["prob_block_hashes"]:
+                    owners[block_hash].append(a)
+            self.block_hash_owners = [tuple(o) for o in owners]
+            # Block hashes owned by at least one adversary: drawing uniformly from them follows the distribution
+            # over non-empty winner sets (each set weighted by the number of hashes it covers), used by --draw-mode
+            # direct
+            self.winning_block_hashes = [h for h in range(self.block_hash_space) if self.block_hash_owners[h]]
+
+        ticket_counts = [round(round(float(s), 2) / 100 * self.pos_avg_ticket_pool_size) for s in adv_stake or []]
+        if self.args.pos and self.args.votesampling == 'hypergeometric':
+            # Only the number of tickets owned by each adversary is needed to draw votes
+            self.count_tickets(adv_stake)
+        elif self.args.pos:
+            ticket_pool = range(self.pos_avg_ticket_pool_size)
+            for idx, s in enumerate(adv_stake):
+                adv_id = "A" + str(idx)
+                # Validated and invalidated blocks are set here to avoid KeyError exceptions
+                self.adversaries[adv_id]["validated_blocks"] = 0
+                self.adversaries[adv_id]["invalidated_blocks"] = 0
+                self.adversaries[adv_id]["stakesize"] = s
+                if not self.reveal_owners():
+                    self.adversaries[adv_id]["prob_tickets"] = self.pos_random.sample(ticket_pool, k=ticket_counts[idx])
+                    # Remove the tickets already selected; one ticket cannot be owned by multiple adversaries
+                    ticket_pool = remove_tickets(ticket_pool, self.adversaries[adv_id]["prob_tickets"])
+
+            if self.reveal_owners():
+                # Only the owners of the drawn tickets are needed
+                self.ticket_owners = RevealedOwners(ticket_counts, self.pos_avg_ticket_pool_size, self.pos_draws,
+                                                    shared=False)
+            else:
+                # Index every ticket to the adversary that owns it, so that mine_block() attributes votes
+                # with a single lookup per drawn ticket
+                self.ticket_owners = [None] * self.pos_avg_ticket_pool_size
+                for a in self.adversaries:
+                    for ticket in self.adversaries[a]["prob_tickets"]:
+                        self.ticket_owners[ticket] = a
+
+        self.importance_sampler = None
+        if self.importance_sampling():
+            self.importance_sampler = ImportanceSampler(self, self.importance_attacker())
+
+        # Generate info for calc_averages()
+        for idx, a in enumerate(self.adversaries):
+            self.adversaries[a]["pow_hashpower"] = "{:.2f}".format(block_hash_counts[idx] / 100) + "%"
+            if adv_stake:
+                ticket_count = ticket_counts[idx]
+                self.adversaries[a]["pos_stakesize"] = \
+                    "{:.2f}".format(ticket_count * 100 / self.pos_avg_ticket_pool_size) + "%"
+                log_info_enabled and logging.info(
+                    "%s hashpower: %.2f%% and stake size: %.4f%%", a, block_hash_counts[idx] / 100,
+                    ticket_count * 100 / self.pos_avg_ticket_pool_size)
+            else:
+                log_info_enabled and logging.info("%s hashpower:%.2f%%", a, block_hash_counts[idx] / 100)
+
+    def reveal_owners(self, draw_mode_allows=True):
+        # Owners are revealed as block hashes and tickets are drawn (see RevealedOwners), unless importance sampling
+        # and paired comparisons need every owner up front (and, for block hashes, --draw-mode direct)
+        return draw_mode_allows and not self.importance_sampling() and not self.paired_requested()
+
+    def reveal_all_owners(self):
+        # --no-erase-prob: the block hashes and tickets of the adversaries that weren't drawn are revealed at the end
+        # of the simulation
+        if isinstance(self.block_hash_owners, RevealedOwners):
+            for a, block_hashes in zip(self.adversaries, self.block_hash_owners.owned_items()):
+                self.adversaries[a]["prob_block_hashes"] = block_hashes
+        if self.args.pos and isinstance(self.ticket_owners, RevealedOwners):
+            for a, tickets in zip(self.adversaries, self.ticket_owners.owned_items()):
+                self.adversaries[a]["prob_tickets"] = tickets
+
+    def count_tickets(self, adv_stake):
+        # Number of tickets owned by each adversary, from which draw_owned_votes() draws the votes
+        ticket_counts = [round(round(float(s), 2) / 100 * self.pos_avg_ticket_pool_size) for s in adv_stake]
+        unowned_tickets = max(self.pos_avg_ticket_pool_size - sum(ticket_counts), 0)
+        # Ticket 0 is never drawn by mine_block() (tickets are drawn from 1 to the pool size)
+        ticket_0_owner = self.pos_random.choices(range(len(adv_stake) + 1),
+                                                 weights=ticket_counts + [unowned_tickets])[0]
+        self.drawable_tickets = {}
+        for idx, s in enumerate(adv_stake):
+            adv_id = "A" + str(idx)
+            self.adversaries[adv_id]["validated_blocks"] = 0
+            self.adversaries[adv_id]["invalidated_blocks"] = 0
+            self.adversaries[adv_id]["stakesize"] = s
+            self.adversaries[adv_id]["ticket_count"] = ticket_counts[idx]
+            self.drawable_tickets[adv_id] = ticket_counts[idx] - (ticket_0_owner == idx)
+
+    def importance_sampling(self):
+        return self.args.importancetilt is not None or self.args.importancevotetilt is not None
+
+    def importance_attacker(self):
+        if self.args.importanceadv is not None:
+            return "A" + str(self.args.importanceadv)
+        return "A" + str(min(range(len(self.args.pow)), key=lambda idx: float(self.args.pow[idx])))
+
+    def setup_block_rewind(self, s, rewind_blocks, rewind_adv):
+        # Generates a number of blocks for the selected adversary before simulation starts
+        sim = self.simulations["sims"][str(s)]
+        sim.rewind_blocks = int(rewind_blocks)
+        sim.rewind_adv = int(rewind_adv)
+        a = "A" + str(rewind_adv)
+        for b in range(int(rewind_blocks)):
+            block_hash = "RWB" + str(b)
+            self.adversaries[a]["drawn_block_hashes"].append(block_hash)
+            self.height_tracker.move(int(rewind_adv), 1)
+
+            # Add fake blocks to the "chain" node; the record keeps them as negative block hashes
+            sim.add_chain_block(int(rewind_adv), -1 - b)
+
+            log_info_enabled and logging.info("Block height: %d, set up rewind block hash: %s for %s", b, block_hash, a)
+            self.trace_buffer is None or self.trace_buffer.record(s, b, trace_rewind, -1 - b, 1 << int(rewind_adv))
+        self.adversaries[a]["sum_blocks"] = len(self.adversaries[a]["drawn_block_hashes"])
+        log_info_enabled and logging.info("Adversary %s already mined %d blocks", a, self.adversaries[a]["sum_blocks"])
+
+    def create_simulation(self, s):
+        self.simulations["sims"][str(s)] = SimulationRecord(len(self.args.pow), bool(self.args.pos),
+                                                            self.args.drawmode == 'direct', not self.args.nooutputjson,
+                                                            self.args.votesampling == 'hypergeometric')
+
+    def draw_skipped_block_hashes(self, draws):
+        # Number of empty draws before a block hash owned by any adversary comes up: geometric distribution
+        # with success probability equal to the share of the block hash space covered by the adversaries
+        p = len(self.winning_block_hashes) / self.block_hash_space
+        if p >= 1.0:
+            return 0
+        return int(math.log(1.0 - draws.random()) / math.log(1.0 - p))
+
+    def mine_block(self, s, cycle_height):
+        sim = self.simulations["sims"][str(s)]
+        # Attributes of the Simulator used on every draw
+        args, adversaries, importance_sampler = self.args, self.adversaries, self.importance_sampler
+        phase_metrics, trace_buffer = self.phase_metrics, self.trace_buffer
+        this_cycle_height = str(cycle_height).zfill(3)
+        pow_winner = False
+        skipped_draws = 0
+        # The draws after PoS invalidated a block of the cycle come from pow_redraws
+        draws = self.pow_draws
+        while not pow_winner:
+            draw_started = phase_metrics and time.perf_counter()
+            # PoW mining
+            # Could have random.sampled block hashes in calc_hashpower() as it was done for tickets (second for loop)
+            # That way it would not be possible for multiple adversaries to mine a block roughly at same time t
+            # because they would not be able to draw the same block hash
+            # Instead, calc_hashpower() randomizes block hashes with replacements (first for loop)
+            # This choice affects the way block hashes are drawn here
+            # With --draw-mode direct, the empty draws are skipped: only their number is drawn
+            if args.drawmode == 'direct':
+                skipped_draws += self.draw_skipped_block_hashes(draws)
+            if importance_sampler is not None:
+                draw_block_hash = importance_sampler.draw_block_hash(sim)
+            elif args.drawmode == 'direct':
+                draw_block_hash = self.winning_block_hashes[draws.below(len(self.winning_block_hashes))]
+            else:
+                draw_block_hash = draws.below(self.block_hash_space)
+            # Only the last draw of the cycle is recorded, after the loop
+            pow_winners = self.block_hash_owners[draw_block_hash]
+            phase_metrics is None or phase_metrics.add("pow_draw", draw_started)
+            pos_winners = list()
+            if args.drawmode == 'direct':
+                log_info_enabled and logging.info("Cycle height: %s, skipped %d empty draws", this_cycle_height,
+                                                  skipped_draws)
+            log_info_enabled and logging.info("Cycle height: %s, drawn block hash: %d", this_cycle_height,
+                                              draw_block_hash)
+            trace_buffer is None or trace_buffer.record(s, cycle_height, trace_pow_draw, draw_block_hash,
+                                                        adversary_mask(pow_winners))
+            for a in pow_winners:
+                pow_winner = True
+                adversaries[a]["drawn_block_hashes"].append(str(draw_block_hash))
+                log_info_enabled and logging.info("Cycle height: %s, PoW winner: %s", this_cycle_height, a)
+                if not args.pos:
+                    adversaries[a]["sum_blocks"] = len(adversaries[a]["drawn_block_hashes"])
+                    self.height_tracker.move(int(a[1:]), 1)
+                    # pow_winner: Append block to the "chain"
+                    sim.add_chain_block(int(a[1:]), draw_block_hash, cycle_height)
+
+            if not pow_winner:
+                # This cycles are going to be ignored as if miners took more than average time to mine a block
+                log_info_enabled and logging.info("No PoW winner for height %s; next draw", this_cycle_height)
+                phase_metrics is None or phase_metrics.count("empty_draws")
+
+            else:   # If already selected at least one adversary as PoW miner; if not, will loop again
+                # PoS mining
+                if args.pos:  # If not, this simulation is a pure PoW and this code block can be skipped
+                    vote_started = phase_metrics and time.perf_counter()
+                    # Draws how many tickets will be drawn for this block based on historical proportions
+                    # defined in the beginning of this file
+                    pos_allowed_drawn_tickets = self.pos_draws.online_tickets()
+                    # Only the adversaries that already won PoW can get their block validated
+                    tilt_votes = importance_sampler is not None and importance_sampler.tilts_votes(pow_winners)
+                    if args.votesampling == 'hypergeometric' and tilt_votes:
+                        owned_votes = importance_sampler.draw_owned_votes(sim, pow_winners, pos_allowed_drawn_tickets)
+                    elif args.votesampling == 'hypergeometric':
+                        owned_votes = self.draw_owned_votes(pow_winners, pos_allowed_drawn_tickets)
+                        log_debug_enabled and logging.debug("Online tickets: %d; owned votes: %s",
+                                                            pos_allowed_drawn_tickets, owned_votes)
+                    else:
+                        drawn_tickets = importance_sampler.draw_tickets(sim, pos_allowed_drawn_tickets) if tilt_votes \
+                            else self.pos_draws.sample(1, self.pos_avg_ticket_pool_size, pos_allowed_drawn_tickets)
+                        log_debug_enabled and logging.debug("Online tickets: %d; drawn tickets: %s",
+                                                            pos_allowed_drawn_tickets, drawn_tickets)
+                        # Every adversary keeps its drawn tickets (shown with --no-erase-drawn), not only the PoW
+                        # winners
+                        for a in adversaries:
+                            adversaries[a]["drawn_tickets"] = list()
+                        for t in drawn_tickets:
+                            if self.ticket_owners[t] is not None:
+                                adversaries[self.ticket_owners[t]]["drawn_tickets"].append(t)
+                        owned_votes = [len(adversaries[a]["drawn_tickets"]) for a in pow_winners]
+                    phase_metrics is None or phase_metrics.add("pos_vote", vote_started)
+
+                    pos_winner = False
+                    for idx, a in enumerate(pow_winners):
+                        total_tickets = owned_votes[idx]
+                        # adversary already won PoW
+                        if total_tickets > pos_allowed_drawn_tickets // 2:
+                            pos_winner = True
+                            pos_winners.append(a)
+                            adversaries[a]["validated_blocks"] += 1
+                            # Only validated blocks change the heights
+                            adversaries[a]["sum_blocks"] = len(adversaries[a]["drawn_block_hashes"])
+                            self.height_tracker.move(int(a[1:]), 1)
+                            log_debug_enabled and logging.debug("Tickets for adversary %s: %d; drawn tickets: %s",
+                                                                a, total_tickets, adversaries[a].get("drawn_tickets"))
+                            log_info_enabled and logging.info("Cycle height: %s, PoS winner: %s", this_cycle_height, a)
+
+                            # pow_winner and pos_winner: Append block to the "chain" after PoS validation
+                            # (ticket numbers are not drawn with --vote-sampling hypergeometric, only their count)
+                            sim.add_chain_block(int(a[1:]), draw_block_hash, cycle_height, pos_allowed_drawn_tickets,
+                                                adversaries[a].get("drawn_tickets", ()), total_tickets)
+                        else:
+                            log_debug_enabled and logging.debug(
+                                "Tickets for adversary %s: %d; allowed drawn tickets: %d",
+                                a, total_tickets, pos_allowed_drawn_tickets)
+                            adversaries[a]["invalidated_blocks"] += 1
+                            phase_metrics is None or phase_metrics.count("pos_invalidations")
+                            # Must undo the last block accounted for the adversary
+                            # whose PoW mining has been invalidated
+                            del adversaries[a]["drawn_block_hashes"][-1]
+
+                    if trace_buffer is not None:
+                        trace_buffer.record(s, cycle_height, trace_pos_vote, draw_block_hash,
+                                            adversary_mask(pos_winners), votes=pos_allowed_drawn_tickets,
+                                            owned=sum(owned_votes[pow_winners.index(a)] for a in pos_winners))
+
+                    if not pos_winner:
+                        # If the adversary didn't have the necessary drawn tickets to validate his own blocks,
+                        # we assume the block will be invalidated by the honest adversaries
+                        pow_winner = False
+                        draws = self.pow_redraws
+                        log_info_enabled and logging.info("PoS and PoW winner don't match for block height %s; "
+                                                          "next draw", this_cycle_height)
+
+        sim.add_cycle(draw_block_hash, adversary_mask(pow_winners), adversary_mask(pos_winners), skipped_draws)
+        phase_metrics is None or phase_metrics.end_cycle(skipped_draws)
+
+    def draw_owned_votes(self, pow_winners, online_tickets, remaining_tickets=None):
+        # Draws without replacement how many of the online tickets are owned by each PoW winner
+        # (multivariate hypergeometric), walking the drawable ticket counts one vote at a time
+        counts = [self.drawable_tickets[a] for a in pow_winners]
+        if remaining_tickets is None:
+            remaining_tickets = self.pos_avg_ticket_pool_size - 1
+        owned_votes = [0] * len(pow_winners)
+        for _ in range(online_tickets):
+            r = self.pos_draws.below(remaining_tickets)
+            for idx, c in enumerate(counts):
+                if r < c:
+                    owned_votes[idx] += 1
+                    counts[idx] -= 1
+                    break
+                r -= c
+            remaining_tickets -= 1
+        return owned_votes
+
+    def calc_distance(self, s, cycle_height):
+        if cycle_height < 1:
+            return 0  # distance is 0 if we haven't started
+        # elif cycle_height == 1:
+        #     return 1    # distance is 1 from and to any adversary
+
+        distance_started = self.phase_metrics and time.perf_counter()
+        sim = self.simulations["sims"][str(s)]
+        # Calculate the maximum distance between any two adversaries: the distance between the leading and
+        # the lagging heights, which height_tracker keeps up to date as blocks are appended and undone
+        # The simulator allows for more than two adversaries...
+        calculated_distance = self.height_tracker.leading - self.height_tracker.lagging
+
+        this_cycle_height = str(cycle_height).zfill(3)
+        if calculated_distance == 2 and sim.results["2-block-diff"] == -1:
+            # Adding 1 because the cycle height starts in 0 and I want to know after how many cycles
+            sim.results["2-block-diff"] = cycle_height + 1    # first time reached 2-block distance
+
+            # Who reached 2-block diff first (the first adversary at the leading height) and how many blocks were mined
+            sim.results["2-block-diff_winner"] = self.height_tracker.first_at(self.height_tracker.leading)
+            sim.results["2-block-diff_winner_score"] = str(self.height_tracker.leading)
+
+            log_info_enabled and logging.info("2-block-diff updated with cycle height %s (after %d cycles)",
+                                              this_cycle_height, cycle_height + 1)
+
+        elif calculated_distance == 6:
+            # Adding 1 because the cycle height starts in 0 and I want to know after how many cycles
+            sim.results["6-block-diff"] = cycle_height + 1    # reached 6-block distance
+
+            # Who reached 6-block diff and how many blocks were mined
+            sim.results["6-block-diff_winner"] = self.height_tracker.first_at(self.height_tracker.leading)
+            sim.results["6-block-diff_winner_score"] = str(self.height_tracker.leading)
+
+            log_info_enabled and logging.info("6-block-diff updated with cycle height %s (after %d cycles)",
+                                              this_cycle_height, cycle_height + 1)
+            log_info_enabled and logging.info("End of simulation reached with 6 blocks of difference")
+
+        elif calculated_distance > 6:
+            logging.critical("Error while calculating distance from adversaries (leading height: " +
+                             str(self.height_tracker.leading) + " lagging height: " + str(self.height_tracker.lagging) +
+                             " calculated_distance: " + str(calculated_distance) + ")")
+            exit(5)
+
+        # Calculate probabilities of catching up
+        # Probability of success for the adversary that is lagging behind to catch up with leader
+        str_prob = "X"
+        if not self.args.pos:
+            # The (last) lagging adversary
+            q = self.adversaries[self.height_tracker.last_at(self.height_tracker.lagging)]["hashpower"] / 100
+            # The information written to JSON refers to the distance and probability before
+            # the mining done on this cycle, that is just starting
+            str_prob = str(attacker_success_probability(q, calculated_distance, self.args.probabilitymodel))
+
+        sim.distance_cycle = cycle_height
+        sim.distance = calculated_distance
+        sim.probability = str_prob
+        log_debug_enabled and logging.debug("Cycle height: %s, distance before this cycle: %d",
+                                            this_cycle_height, calculated_distance)
+        if log_info_enabled and calculated_distance == 0:
+            logging.info("Probability of catching up is %s because their heights are the same", str_prob)
+        elif log_info_enabled:
+            logging.info("Probability of %s catching up to %s: %s",
+                         self.height_tracker.last_at(self.height_tracker.lagging),
+                         self.height_tracker.last_at(self.height_tracker.leading), str_prob)
+        self.trace_buffer is None or self.trace_buffer.record(s, cycle_height, trace_distance, -1, 0,
+                                                              distance=calculated_distance)
+        self.phase_metrics is None or self.phase_metrics.add("calc_distance", distance_started)
+
+        return calculated_distance
+
+    def run_simulation(self, s):
+        sim_start_time = datetime.datetime.now()
+        log_info_enabled and logging.info("Running simulation %d", s)
+        sim = self.simulations["sims"][str(s)]
+        sim.results["2-block-diff"] = -1
+        sim.results["6-block-diff"] = -1
+        cycle_height = sim.rewind_blocks
+
+        # Simulation runs until we reach a 6-block distance from other chains
+        while self.calc_distance(s, cycle_height) < 6:
+            # This is the core, the most time-consuming function
+            self.mine_block(s, cycle_height)
+
+            # sum_blocks is updated by mine_block() for the adversaries whose chains changed
+            if log_info_enabled:
+                for a in self.adversaries:
+                    logging.info("Adversary %s already mined %d blocks", a, self.adversaries[a]["sum_blocks"])
+
+            cycle_height += 1
+
+        # At this point, distance == 6, this simulation is over
+        self.args.noeraseprob and self.reveal_all_owners()
+        # Clean up the JSON before saving the simulation to file, if that's the case
+        for a in self.adversaries:
+            if not self.args.noeraseprob:
+                self.adversaries[a].pop('prob_block_hashes', None)
+                self.adversaries[a].pop('prob_tickets', None)
+
+            if not self.args.noerasedrawn:
+                self.adversaries[a].pop('drawn_block_hashes', None)
+                self.adversaries[a].pop('drawn_tickets', None)
+
+        # Save the details before starting another simulation
+        sim.adversaries = self.adversaries
+        self.importance_sampler is None or sim.results.update(likelihood_ratio=math.exp(sim.log_likelihood_ratio))
+
+        sim_end_time = datetime.datetime.now()
+        return sim_end_time - sim_start_time
+
+    def propagation_delays(self):
+        # Propagation delay of the blocks of each adversary (--propagation-delay)
+        delays = self.args.propagationdelay or [0.0]
+        return delays * len(self.args.pow) if len(delays) == 1 else list(delays)
+
+    def setup_event_adversaries(self, adv_hashpower, adv_stake):
+        # Adversaries of the event engine: only their hashpower and ticket counts matter, so nothing is drawn
+        # from the block hash space nor from the ticket pool
+        self.adversaries = {}
+        for idx, a in enumerate(adv_hashpower):
+            self.adversaries["A" + str(idx)] = {"hashpower": a, "sum_blocks": 0, "stale_blocks": 0,
+                                                "pow_hashpower": "{:.2f}".format(round(float(a), 2)) + "%"}
+        self.height_tracker = HeightTracker(list(self.adversaries))
+        if adv_stake:
+            self.count_tickets(adv_stake)
+            for a in self.adversaries:
+                self.adversaries[a]["pos_stakesize"] = \
+                    "{:.2f}".format(self.adversaries[a]["ticket_count"] * 100 / self.pos_avg_ticket_pool_size) + "%"
+
+    def run_event_simulation(self, s, rewind_blocks=0, rewind_adv=0):
+        # Continuous-time engine (--engine event): each adversary finds blocks after exponential inter-arrival
+        # times (on average, its share of the hashpower per average block interval), kept in a priority queue of
+        # events, so the cost follows the blocks found rather than the draws. A block is seen by the other
+        # adversaries after the propagation delay of its adversary, whose own miners keep building on the previous
+        # block until then: blocks they find meanwhile are stale. Every block seen is a cycle, so the 2 and
+        # 6-block differences are reported as by the scalar engine; returns the outcome of the simulation
+        sim_start_time = datetime.datetime.now()
+        log_info_enabled and logging.info("Running simulation %d", s)
+        self.setup_event_adversaries(self.args.pow, self.args.pos)
+        adv_ids = list(self.adversaries)
+        rates = [float(a) / 100 for a in self.args.pow]
+        delays = self.propagation_delays()
+        built_on = [0.0] * len(adv_ids)     # Time from which the miners of each adversary build on its last block
+        results = {"2-block-diff": -1, "6-block-diff": -1}
+        cycle_height = int(rewind_blocks)
+        for _ in range(cycle_height):
+            self.height_tracker.move(int(rewind_adv), 1)
+        self.adversaries["A" + str(rewind_adv)]["sum_blocks"] = cycle_height
+        events = [(-math.log(1.0 - self.pow_draws.random()) / rate, event_found, idx) for idx, rate in enumerate(rates)
+                  if rate > 0]
+        heapq.heapify(events)
+        seen_time = 0.0
+
+        while True:
+            distance = self.height_tracker.leading - self.height_tracker.lagging
+            if cycle_height > 0 and distance == 2 and results["2-block-diff"] == -1:
+                # As calc_distance(): after how many cycles the distance was reached
+                results["2-block-diff"] = cycle_height + 1
+                results["2-block-diff_winner"] = self.height_tracker.first_at(self.height_tracker.leading)
+                results["2-block-diff_winner_score"] = str(self.height_tracker.leading)
+                results["2-block-diff_time"] = round(seen_time, 6)
+            elif distance == 6:
+                results["6-block-diff"] = cycle_height + 1
+                results["6-block-diff_winner"] = self.height_tracker.first_at(self.height_tracker.leading)
+                results["6-block-diff_winner_score"] = str(self.height_tracker.leading)
+                results["6-block-diff_time"] = round(seen_time, 6)
+                break
+
+            # Blocks found up to the next block seen
+            event_time, event, idx = heapq.heappop(events)
+            while event == event_found:
+                a = adv_ids[idx]
+                next_time = event_time - math.log(1.0 - self.pow_draws.random()) / rates[idx]
+                heapq.heappush(events, (next_time, event_found, idx))
+                if event_time < built_on[idx]:
+                    self.adversaries[a]["stale_blocks"] += 1
+                    log_debug_enabled and logging.debug("Time %f: stale block found by %s", event_time, a)
+                elif self.args.pos and not self.event_block_validated(a):
+                    self.adversaries[a]["invalidated_blocks"] += 1
+                    log_debug_enabled and logging.debug("Time %f: block found by %s invalidated", event_time, a)
+                else:
+                    if self.args.pos:
+                        self.adversaries[a]["validated_blocks"] += 1
+                    built_on[idx] = event_time + delays[idx]
+                    heapq.heappush(events, (event_time + delays[idx], event_seen, idx))
+                event_time, event, idx = heapq.heappop(events)
+
+            seen_time = event_time
+            self.height_tracker.move(idx, 1)
+            self.adversaries[adv_ids[idx]]["sum_blocks"] += 1
+            log_info_enabled and logging.info("Cycle height: %s, time %f: block of %s seen", str(cycle_height).zfill(3),
+                                              event_time, adv_ids[idx])
+            cycle_height += 1
+
+        if self.phase_metrics is not None:
+            self.phase_metrics.count("cycles", cycle_height - int(rewind_blocks))
+            self.args.pos and self.phase_metrics.count("pos_invalidations",
+                                                       sum(self.adversaries[a]["invalidated_blocks"] for a in adv_ids))
+        sum_blocks = tuple(self.adversaries[a]["sum_blocks"] for a in adv_ids)
+        validated_blocks = tuple(self.adversaries[a]["validated_blocks"] for a in adv_ids) if self.args.pos else ()
+        invalidated_blocks = tuple(self.adversaries[a]["invalidated_blocks"] for a in adv_ids) if self.args.pos else ()
+        if not self.args.nooutputjson:
+            # Only the outcome is output: no block hashes are drawn
+            self.simulations["sims"][str(s)] = dict(results, adversaries={
+                a: {key: value for key, value in self.adversaries[a].items()
+                    if key in ["sum_blocks", "stale_blocks", "validated_blocks", "invalidated_blocks"]}
+                for a in adv_ids})
+        duration = (datetime.datetime.now() - sim_start_time).total_seconds()
+        return (results["2-block-diff"], results["6-block-diff"], results["6-block-diff_winner"], sum_blocks,
+                validated_blocks, invalidated_blocks, duration, 1.0)
+
+    def event_block_validated(self, a):
+        # PoS votes on a block found by the event engine, drawn as by --vote-sampling hypergeometric
+        online_tickets = self.pos_draws.online_tickets()
+        return self.draw_owned_votes([a], online_tickets)[0] > online_tickets // 2
+
+    def run_numpy_simulations(self, first_sim=0, num_sims=1, rewind_blocks=0, rewind_adv=0, aggregator=None):
+        # Vectorised engine (--engine numpy): runs chunks of simulations in lockstep, holding the height
+        # of every simulation x adversary pair in arrays and retiring simulations at the 6-block difference.
+        # Only the number of block hashes owned by each set of adversaries affects the race, so each simulation
+        # keeps those counts (cells, indexed by the bitmask of owners) instead of the block hashes themselves
+        try:
+            import numpy as np
+        except ImportError:
+            raise ScenarioError("--engine numpy requires NumPy. Install it with: pip install numpy", 8)
+
+        adv_ids = ["A" + str(idx) for idx in range(len(self.args.pow))]
+        num_adv = len(adv_ids)
+        num_cells = 1 << num_adv
+        adv_bits = np.arange(num_adv)
+        hashes_per_adv = [round(round(float(a), 2) * 100) for a in self.args.pow]
+        tickets_per_adv = [round(round(float(s), 2) / 100 * self.pos_avg_ticket_pool_size) for s in self.args.pos or []]
+        vote_options = np.array([5, 4, 3])
+        vote_proportions = [self.pos_prop_blocks_5votes, self.pos_prop_blocks_4votes, self.pos_prop_blocks_3votes]
+
+        last_sim = first_sim + num_sims
+        while first_sim < last_sim:
+            chunk_start_time = datetime.datetime.now()
+            chunk_started = self.phase_metrics and time.perf_counter()
+            size = min(numpy_chunk_size, last_sim - first_sim)
+            # Chunks start at multiples of numpy_chunk_size, so a seeded chunk draws the same numbers
+            # whichever process runs it
+            rng = np.random.default_rng(None if self.args.seed is None else [self.args.seed, first_sim])
+            logging.info("Running simulations " + str(first_sim) + " to " + str(first_sim + size - 1))
+
+            # Block hashes owned by each set of adversaries; one block hash can be owned by multiple adversaries
+            cells = np.zeros((size, num_cells), dtype=np.int64)
+            cells[:, 0] = self.block_hash_space
+            for bit, k in enumerate(hashes_per_adv):
+                # Split every cell between the block hashes this adversary owns and the ones it doesn't,
+                # drawing k block hashes without replacement (sequential multivariate hypergeometric)
+                remaining_space = np.full(size, self.block_hash_space, dtype=np.int64)
+                remaining_k = np.full(size, k, dtype=np.int64)
+                for mask in range(1 << bit):
+                    cell = cells[:, mask].copy()
+                    owned = rng.hypergeometric(cell, remaining_space - cell, remaining_k)
+                    cells[:, mask | (1 << bit)] = owned
+                    cells[:, mask] = cell - owned
+                    remaining_space -= cell
+                    remaining_k -= owned
+            # Drawing among owned block hashes only: empty draws don't change the race
+            cum_cells = np.cumsum(cells[:, 1:], axis=1)
+
+            if self.args.pos:
+                # Ticket 0 is never drawn by mine_block() (tickets are drawn from 1 to the pool size),
+                # so the drawable tickets owned by an adversary depend on who owns ticket 0
+                ticket_colors = np.tile(np.array(tickets_per_adv, dtype=np.int64), (size, 1))
+                unowned = self.pos_avg_ticket_pool_size - sum(tickets_per_adv)
+                ticket_0_owner = rng.choice(num_adv + 1, size=size,
+                                            p=[t / self.pos_avg_ticket_pool_size for t in tickets_per_adv + [unowned]])
+                owned_0 = np.flatnonzero(ticket_0_owner < num_adv)
+                ticket_colors[owned_0, ticket_0_owner[owned_0]] -= 1
+
+            heights = np.zeros((size, num_adv), dtype=np.int64)
+            validated = np.zeros((size, num_adv), dtype=np.int64)
+            invalidated = np.zeros((size, num_adv), dtype=np.int64)
+            cycle_heights = np.zeros(size, dtype=np.int64)
+            diff_2 = np.full(size, -1, dtype=np.int64)
+            diff_2_winner = np.zeros(size, dtype=np.int64)
+            diff_2_score = np.zeros(size, dtype=np.int64)
+            diff_6 = np.full(size, -1, dtype=np.int64)
+            diff_6_winner = np.zeros(size, dtype=np.int64)
+            if int(rewind_blocks) > 0:
+                heights[:, int(rewind_adv)] = int(rewind_blocks)
+                cycle_heights[:] = int(rewind_blocks)
+
+            active = np.arange(size)
+            while active.size:
+                # Same checks as calc_distance(), for all live simulations
+                live_heights = heights[active]
+                distance = live_heights.max(axis=1) - live_heights.min(axis=1)
+                reached_2 = active[(distance == 2) & (diff_2[active] == -1)]
+                diff_2[reached_2] = cycle_heights[reached_2] + 1
+                diff_2_winner[reached_2] = heights[reached_2].argmax(axis=1)
+                diff_2_score[reached_2] = heights[reached_2].max(axis=1)
+                reached_6 = active[distance == 6]
+                diff_6[reached_6] = cycle_heights[reached_6] + 1
+                diff_6_winner[reached_6] = heights[reached_6].argmax(axis=1)
+                active = active[distance < 6]
+                if not active.size:
+                    break
+
+                # Same draws as mine_block(), for all live simulations
+                drawn = rng.integers(0, cum_cells[active, -1])
+                pow_winners = 1 + (cum_cells[active] <= drawn[:, None]).sum(axis=1)
+                pow_bits = (pow_winners[:, None] >> adv_bits) & 1
+                if not self.args.pos:
+                    heights[active] += pow_bits
+                    cycle_heights[active] += 1
+                else:
+                    online_tickets = rng.choice(vote_options, size=active.size, p=vote_proportions)
+                    remaining_pool = np.full(active.size, self.pos_avg_ticket_pool_size - 1, dtype=np.int64)
+                    remaining_votes = online_tickets.copy()
+                    owned_tickets = np.zeros((active.size, num_adv), dtype=np.int64)
+                    for idx in range(num_adv):
+                        colors = ticket_colors[active, idx]
+                        owned_tickets[:, idx] = rng.hypergeometric(colors, remaining_pool - colors, remaining_votes)
+                        remaining_pool -= colors
+                        remaining_votes -= owned_tickets[:, idx]
+                    pos_bits = pow_bits * (owned_tickets > (online_tickets // 2)[:, None])
+                    validated[active] += pos_bits
+                    invalidated[active] += pow_bits - pos_bits
+                    heights[active] += pos_bits
+                    # If no PoW winner got validated, this simulation draws again for the same cycle
+                    cycle_heights[active] += pos_bits.any(axis=1)
+
+            # Aggregates of the whole chunk, merged at once into the batch aggregates
+            chunk_aggregator = BatchAggregator(adv_ids)
+            chunk_aggregator.block_diff_2.merge(*array_stats(diff_2))
+            chunk_aggregator.block_diff_6.merge(*array_stats(diff_6))
+            chunk_duration = (datetime.datetime.now() - chunk_start_time).total_seconds() / size
+            chunk_aggregator.duration.merge(size, chunk_duration, 0.0)
+            win_counts = np.bincount(diff_6_winner, minlength=num_adv)
+            for idx, a in enumerate(adv_ids):
+                chunk_aggregator.wins[a] = int(win_counts[idx])
+                chunk_aggregator.sum_blocks[a].merge(*array_stats(heights[:, idx]))
+                if self.args.pos:
+                    chunk_aggregator.validated_blocks[a].merge(*array_stats(validated[:, idx]))
+                    chunk_aggregator.invalidated_blocks[a].merge(*array_stats(invalidated[:, idx]))
+            aggregator.merge(chunk_aggregator)
+            self.result_cache is None or self.result_cache.add_chunk(first_sim, size, chunk_aggregator)
+            if self.results_store is not None:
+                self.results_store.add_columns([np.arange(first_sim, first_sim + size),
+                                                np.full(size, self.results_store.batch),
+                                                diff_6_winner, diff_2, diff_6] +
+                                               [heights[:, idx] for idx in range(num_adv)] +
+                                               [validated[:, idx] for idx in range(num_adv) if self.args.pos] +
+                                               [invalidated[:, idx] for idx in range(num_adv) if self.args.pos] +
+                                               [np.ones(size)])
+            if self.phase_metrics is not None:
+                self.phase_metrics.add("numpy_chunk", chunk_started)
+                self.phase_metrics.count("simulations", size)
+                self.args.pos and self.phase_metrics.count("pos_invalidations", int(invalidated.sum()))
+                self.phase_metrics.finished()
+
+            if self.args.summaryonly and (self.output_stream or self.outcome_records is not None):
+                # --summary-only records the outcomes of the chunk instead of its simulations
+                validated_rows = validated.tolist() if self.args.pos else [()] * size
+                invalidated_rows = invalidated.tolist() if self.args.pos else [()] * size
+                for idx, (d_2, d_6, winner, adv_heights) in enumerate(zip(diff_2.tolist(), diff_6.tolist(),
+                                                                          diff_6_winner.tolist(), heights.tolist())):
+                    self.summarize_simulation(first_sim + idx,
+                                              (d_2, d_6, adv_ids[winner], tuple(adv_heights),
+                                               tuple(validated_rows[idx]), tuple(invalidated_rows[idx]),
+                                               chunk_duration, 1.0))
+            elif not self.args.nooutputjson and not self.args.summaryonly:
+                for idx in range(size):
+                    sim = {"2-block-diff": int(diff_2[idx]), "6-block-diff": int(diff_6[idx]),
+                           "6-block-diff_winner": adv_ids[diff_6_winner[idx]],
+                           "6-block-diff_winner_score": str(heights[idx].max()), "adversaries": {}}
+                    if diff_2[idx] != -1:
+                        sim["2-block-diff_winner"] = adv_ids[diff_2_winner[idx]]
+                        sim["2-block-diff_winner_score"] = str(diff_2_score[idx])
+                    for a_idx, a in enumerate(adv_ids):
+                        sim["adversaries"][a] = {"sum_blocks": int(heights[idx, a_idx])}
+                        if self.args.pos:
+                            sim["adversaries"][a]["validated_blocks"] = int(validated[idx, a_idx])
+                            sim["adversaries"][a]["invalidated_blocks"] = int(invalidated[idx, a_idx])
+                    self.simulations["sims"][str(first_sim + idx)] = sim
+                self.stream_simulations()
+            self.batch_checkpoint is None or self.batch_checkpoint.finished(first_sim + size)
+
+            first_sim += size
+            if aggregator.precision_reached():
+                break
+
+    def log_debug_info(self):
+        logging.debug("Block Hash Space: " + str(self.block_hash_space))
+        logging.debug("Average ticket pool size: " + str(self.pos_avg_ticket_pool_size))
+        logging.debug("Number of blocks with 5 votes: " + str(self.pos_blocks_with_5votes))
+        logging.debug("Number of blocks with 4 votes: " + str(self.pos_blocks_with_4votes))
+        logging.debug("Number of blocks with 3 votes: " + str(self.pos_blocks_with_3votes))
+        logging.debug("Total number of blocks with votes: " + str(self.pos_blocks_with_votes))
+        logging.debug("Proportion of blocks with 5 votes: " + str(self.pos_prop_blocks_5votes))
+        logging.debug("Proportion of blocks with 4 votes: " + str(self.pos_prop_blocks_4votes))
+        logging.debug("Proportion of blocks with 3 votes: " + str(self.pos_prop_blocks_3votes))
+
+    def run_simulation_range(self, first_sim, num_sims, rewind_blocks=0, rewind_adv=0, aggregator=None):
+        # Runs simulations first_sim to first_sim + num_sims - 1, adding their outcomes to aggregator
+        if self.args.engine == 'numpy':
+            return self.run_numpy_simulations(first_sim, num_sims, rewind_blocks, rewind_adv, aggregator)
+
+        for s in range(first_sim, first_sim + num_sims):
+            self.args.seed is None or self.random.seed(simulation_seed(self.args.seed, s))
+            # Outside paired comparisons, PoW and PoS draws share the same buffer
+            self.pow_draws.reset()
+            if self.args.engine == 'event':
+                sim_started = self.phase_metrics and time.perf_counter()
+                outcome = self.run_event_simulation(s, rewind_blocks, rewind_adv)
+                self.phase_metrics is None or self.phase_metrics.add("simulation", sim_started)
+            else:
+                self.calc_hashpower(self.args.pow, self.args.pos)
+                self.create_simulation(s)
+                int(rewind_blocks) > 0 and self.setup_block_rewind(s, rewind_blocks, rewind_adv)
+                sim_started = self.phase_metrics and time.perf_counter()
+                sim_duration = self.run_simulation(s)
+                self.phase_metrics is None or self.phase_metrics.add("simulation", sim_started)
+                outcome = self.simulation_outcome(self.simulations["sims"][str(s)], sim_duration.total_seconds())
+            aggregator.add(outcome)
+            self.result_cache is None or self.result_cache.add_outcome(s, outcome)
+            self.results_store is None or self.results_store.add(s, outcome)
+            self.args.summaryonly and self.summarize_simulation(s, outcome)
+            self.stream_simulations()
+            if self.phase_metrics is not None:
+                self.phase_metrics.count("simulations")
+                self.phase_metrics.finished()
+            self.batch_checkpoint is None or self.batch_checkpoint.finished(s + 1)
+            if aggregator.precision_reached():
+                break
+
+    def run_simulation_task(self, task):
+        # Runs a range of simulations of a batch in a worker process, whose Simulator is reset for every range
+        first_sim, num_sims, rewind_blocks, rewind_adv = task
+        self.simulations["sims"] = {}
+        recorder = OutcomeRecorder()
+        self.phase_metrics = self.phase_metrics and PhaseMetrics()
+        self.run_simulation_range(first_sim, num_sims, rewind_blocks, rewind_adv, recorder)
+        return self.simulations["sims"], recorder, self.phase_metrics and self.phase_metrics.state()
+
+    def run_parallel_simulations(self, total_simulations, rewind_blocks=0, rewind_adv=0, first_sim=0):
+        # Splits the batch in ranges of simulations run by a pool of worker processes;
+        # results are merged in simulation order, whichever worker finishes first
+        if self.args.seed is None:
+            # Forked workers would share the same random state
+            self.args.seed = self.random.randrange(2 ** 32)
+            logging.info("Seeding simulations with " + str(self.args.seed))
+        if self.args.engine == 'numpy':
+            task_size = numpy_chunk_size
+        else:
+            task_size = max(1, -(-total_simulations // (self.args.workers * 4)))
+        plan = self.simulation_plan(total_simulations, first_sim)
+        tasks = [(task_first, min(task_size, range_first + range_sims - task_first), rewind_blocks, rewind_adv)
+                 for range_first, range_sims, cached in plan if not cached
+                 for task_first in range(range_first, range_first + range_sims, task_size)]
+
+        import multiprocessing
+        with multiprocessing.Pool(self.args.workers, initializer=init_worker,
+                                  initargs=(self.args, self.get_config_values())) as pool:
+            results = zip(tasks, pool.imap(run_worker_simulations, tasks))
+            for range_first, range_sims, cached in plan:
+                if cached:
+                    self.replay_cached_simulations(range_first, range_sims, self.batch_aggregator)
+                else:
+                    for task_idx in range(-(-range_sims // task_size)):
+                        task, (sims, recorder, metrics) = next(results)
+                        self.simulations["sims"].update(sims)
+                        self.stream_simulations()
+                        recorder.replay(self.batch_aggregator)
+                        self.results_store is None or self.results_store.add_recorded(task[0], recorder)
+                        self.args.summaryonly and self.summarize_recorded(task[0], recorder)
+                        if self.phase_metrics is not None:
+                            self.phase_metrics.merge_state(metrics)
+                            self.phase_metrics.finished()
+                        self.result_cache is None or self.result_cache.add_recorded(task[0], recorder)
+                        self.batch_checkpoint is None or self.batch_checkpoint.finished(task[0] + task[1])
+                        if self.batch_aggregator.precision_reached():
+                            break
+                if self.batch_aggregator.precision_reached():
+                    # Leaving the with block terminates the remaining tasks
+                    break
+
+    def cache_scenario(self):
+        # Everything the outcomes of a seeded batch depend on, normalised so that equivalent command lines
+        # share their cached results. The digest of this script invalidates them whenever the code changes
+        with open(os.path.abspath(__file__), 'rb') as sfh:
+            code_digest = hashlib.sha256(sfh.read()).hexdigest()
+        rewind_blocks = int(self.args.rewind_blocks)
+        scenario = {"version": __version__, "code": code_digest, "seed": self.args.seed, "engine": self.args.engine,
+                    "pow": [round(float(a), 2) for a in self.args.pow],
+                    "pos": [round(float(s), 2) for s in self.args.pos or []],
+                    "rewind_blocks": rewind_blocks, "rewind_adv": int(self.args.rewind_adv) if rewind_blocks > 0 else 0,
+                    "config": self.get_config_values()}
+        if self.args.engine == 'numpy':
+            scenario["chunk_size"] = numpy_chunk_size
+        elif self.args.engine == 'event':
+            scenario["propagation_delay"] = self.propagation_delays()
+        else:
+            scenario["draw_mode"] = self.args.drawmode
+            scenario["vote_sampling"] = self.args.votesampling if self.args.pos else None
+            if self.importance_sampling():
+                scenario["importance"] = [self.importance_attacker(), self.args.importancetilt,
+                                          self.args.importancevotetilt]
+        return scenario
+
+    def simulation_plan(self, total_simulations, first_sim=0):
+        # Ranges of the batch from first_sim, in order, as (first simulation, number of simulations, cached):
+        # simulations found in the cache are replayed and only the other ones are run
+        if self.result_cache is None:
+            return [(first_sim, total_simulations - first_sim, False)] if first_sim < total_simulations else []
+        plan = list()
+        if self.args.engine == 'numpy':
+            # Chunks are seeded by their first simulation and drawn as a whole: only whole chunks are reused
+            for chunk_first in range(first_sim, total_simulations, numpy_chunk_size):
+                num_sims = min(numpy_chunk_size, total_simulations - chunk_first)
+                plan.append((chunk_first, num_sims, (chunk_first, num_sims) in self.result_cache.chunks))
+            return plan
+        for s in range(first_sim, total_simulations):
+            cached = s in self.result_cache.outcomes
+            if plan and plan[-1][2] == cached:
+                plan[-1][1] += 1
+            else:
+                plan.append([s, 1, cached])
+        return plan
+
+    def replay_cached_simulations(self, first_sim, num_sims, aggregator):
+        if self.args.engine == 'numpy':
+            aggregator.merge_state(self.result_cache.chunk(first_sim, num_sims))
+            self.batch_checkpoint is None or self.batch_checkpoint.finished(first_sim + num_sims)
+            return
+        for s in range(first_sim, first_sim + num_sims):
+            outcome = self.result_cache.outcome(s)
+            aggregator.add(outcome)
+            self.results_store is None or self.results_store.add(s, outcome)
+            if self.args.summaryonly:
+                self.summarize_simulation(s, outcome)
+            elif not self.args.nooutputjson:
+                self.simulations["sims"][str(s)] = outcome_simulation(outcome, self.importance_sampling())
+            self.stream_simulations()
+            self.batch_checkpoint is None or self.batch_checkpoint.finished(s + 1)
+            if aggregator.precision_reached():
+                break
+
+    def summarize_simulation(self, s, outcome):
+        # --summary-only: the finished simulation is dropped, and its outcome is written to the ndjson output
+        # or recorded for the output file
+        self.simulations["sims"].pop(str(s), None)
+        if self.output_stream:
+            self.output_stream.write(json.dumps(dict(sim=s, **outcome_simulation(outcome, self.importance_sampling())),
+                                                separators=(',', ':')) + "\n")
+        elif self.outcome_records is not None:
+            self.outcome_records.add(outcome)
+
+    def summarize_recorded(self, first_sim, recorder):
+        # Outcomes of a range of simulations run by a worker process (chunks of the NumPy engine aren't recorded)
+        for idx, item in enumerate(recorder.items):
+            isinstance(item, BatchAggregator) or self.summarize_simulation(first_sim + idx, item)
+
+    def run_batch_simulations(self, total_simulations=1, rewind_blocks=0, rewind_adv=0, report=True, first_sim=0):
+        self.log_debug_info()
+        logging.info("Starting simulation batch")
+        self.batch_start_time = datetime.datetime.now()
+        self.simulations["sims"] = {}
+        self.batch_aggregator = BatchAggregator(["A" + str(idx) for idx in range(len(self.args.pow))],
+                                                self.args.targetprecision, self.args.confidence)
+        self.batch_checkpoint = None
+        if self.args.checkpoint:
+            self.batch_checkpoint = BatchCheckpoint(self, self.args.checkpoint, self.args.checkpointevery)
+        if self.args.resume:
+            first_sim = self.batch_checkpoint.resume()
+        elif self.batch_checkpoint:
+            self.batch_checkpoint.start()
+        if self.args.outputformat == 'ndjson':
+            self.open_output_stream(self.args.outputfile)
+        self.trace_buffer = TraceBuffer(self.args.tracesize) if self.args.tracefile else None
+        self.phase_metrics = None
+        if self.args.metricsfile:
+            self.phase_metrics = PhaseMetrics(self.args.metricsfile, self.args.metricsevery, self.args.metricsformat)
+        # With --summary-only, ndjson output streams the outcomes instead of recording them
+        self.outcome_records = None
+        if self.args.summaryonly and not self.args.nooutputjson and self.args.outputformat != 'ndjson':
+            self.outcome_records = OutcomeRecords(len(self.args.pow), bool(self.args.pos),
+                                                  self.args.summarymemory * 1024 * 1024, first_sim,
+                                                  self.importance_sampling())
+        # Catch-up probabilities of the adversaries, for calc_distance() and print_summary() (pure PoW)
+        self.args.pos or attacker_success_probabilities([adv_hashpower / 100 for adv_hashpower in self.args.pow],
+                                                        range(7), self.args.probabilitymodel)
+        self.result_cache = None
+        if self.args.cachedir:
+            self.result_cache = ResultCache(self.args.cachedir, self.args.cachesize, self.cache_scenario())
+        self.results_store = None
+        if self.args.resultsstore:
+            self.results_store = ResultsStore(self.args.resultsstore, self.cache_scenario(), self.batch_start_time,
+                                              self.batch_checkpoint.store_rows if self.args.resume else None)
+        if self.batch_aggregator.precision_reached():
+            # Resumed from the checkpoint of a batch that had just reached the target precision
+            pass
+        elif self.args.workers > 1:
+            self.run_parallel_simulations(int(total_simulations), rewind_blocks, rewind_adv, first_sim)
+        else:
+            for range_first, range_sims, cached in self.simulation_plan(int(total_simulations), first_sim):
+                if cached:
+                    self.replay_cached_simulations(range_first, range_sims, self.batch_aggregator)
+                else:
+                    self.run_simulation_range(range_first, range_sims, rewind_blocks, rewind_adv, self.batch_aggregator)
+                if self.batch_aggregator.precision_reached():
+                    break
+        if self.args.engine == 'event':
+            # Adversaries' hashpower and stake information for print_summary(), without the block hash space
+            self.setup_event_adversaries(self.args.pow, self.args.pos)
+        elif self.args.workers > 1 or self.args.engine == 'numpy' or self.result_cache is not None:
+            # Adversaries' hashpower and stake information for print_summary(), not set up by these paths
+            # (nor when every simulation comes from the cache)
+            self.calc_hashpower(self.args.pow, self.args.pos)
+
+        self.batch_end_time = datetime.datetime.now()
+        logging.info("End of simulation batch")
+        self.trace_buffer is None or self.trace_buffer.save(self.args.tracefile)
+        self.result_cache is None or self.result_cache.save()
+        self.results_store is None or self.results_store.commit()
+        self.batch_checkpoint is None or self.batch_checkpoint.remove()
+        if self.args.verbose:
+            print("Simulations:")
+            pprint.pprint(self.export_simulations(), indent=4)
+        self.calc_averages()
+        if report:
+            self.print_summary()
+            output_started = self.phase_metrics and time.perf_counter()
+            self.save_output(self.args.outputfile)
+            self.phase_metrics is None or self.phase_metrics.add("output", output_started)
+        self.phase_metrics is None or self.phase_metrics.save()
+
+    def sweep_requested(self):
+        return bool(self.args.sweeppow or self.args.sweeppos or self.args.sweeprewind)
+
+    def sweep_adversaries(self, attacker_value):
+        # Two adversaries: the attacker (--rewind-adv) and the rest of the network
+        others = round(100 - attacker_value, 2)
+        return [others, attacker_value] if self.args.rewind_adv == 1 else [attacker_value, others]
+
+    def sweep_points(self):
+        # Every combination of the swept values; the dimensions that aren't swept come from -w, -s and --rewind-blocks
+        points = list()
+        for attacker_pow in self.args.sweeppow or [None]:
+            for attacker_pos in self.args.sweeppos or [None]:
+                for rewind_blocks in self.args.sweeprewind or [self.args.rewind_blocks]:
+                    points.append((self.args.pow if attacker_pow is None else self.sweep_adversaries(attacker_pow),
+                                   self.args.pos if attacker_pos is None else self.sweep_adversaries(attacker_pos),
+                                   rewind_blocks))
+        return points
+
+    def run_sweep_point(self, point):
+        # Runs the batch of simulations of one sweep point and returns its row of the sweep table
+        self.args.pow, self.args.pos, self.args.rewind_blocks = point
+        self.run_batch_simulations(self.args.simulations, self.args.rewind_blocks, self.args.rewind_adv, report=False)
+        row = {"attacker": "A" + str(self.args.rewind_adv),
+               "attacker_pow": self.args.pow[self.args.rewind_adv],
+               "attacker_pos": self.args.pos[self.args.rewind_adv] if self.args.pos else ""}
+        row.update(flatten_summary(self.simulations["summary"]))
+        if not self.args.pos:
+            # Probability of the attacker catching up from z blocks behind
+            probabilities = attacker_success_probabilities([self.args.pow[self.args.rewind_adv] / 100], range(1, 7),
+                                                           self.args.probabilitymodel)
+            for z, probability in enumerate(probabilities[0], start=1):
+                row["catch_up_probability.z" + str(z)] = round(probability, 6)
+        return row
+
+    def run_sweep(self, report=True):
+        # Runs every sweep point in this process or, with --workers, one point per worker process at a time, and
+        # returns the rows of the sweep table. With report, they are written in sweep order as soon as they are
+        # available
+        if (self.args.sweeppow or self.args.sweeppos) and self.args.rewind_adv > 1:
+            raise ScenarioError("Sweeps of hashpower or stake size simulate 2 adversaries; --rewind-adv must be 0 or 1",
+                                4)
+        if self.args.tracefile:
+            raise ScenarioError("--trace-file is not available with sweeps")
+        if self.args.checkpoint:
+            raise ScenarioError("--checkpoint is not available with sweeps")
+        if self.paired_requested():
+            raise ScenarioError("Paired comparisons are not available with sweeps")
+        if self.args.metricsfile:
+            raise ScenarioError("--metrics-file is not available with sweeps")
+        points = self.sweep_points()
+        for adv_pow, adv_pos, rewind_blocks in points:
+            self.sanity_check(adv_pow, adv_pos, self.args.rewind_adv)
+        # The sweep table is the output: simulations are not saved
+        self.args.nooutputjson = True
+        self.args.verbose = False
+        if self.args.seed is None and self.args.workers > 1:
+            # Forked workers would share the same random state
+            self.args.seed = self.random.randrange(2 ** 32)
+            logging.info("Seeding simulations with " + str(self.args.seed))
+
+        sweep_fh = None
+        try:
+            sweep_fh = report and open(self.args.sweepfile, self.args.outputmode, newline='')
+        except PermissionError:
+            logging.error("Missing write permission while saving sweep to " + self.args.sweepfile)
+            raise ScenarioError("Missing write permission while saving sweep to " + self.args.sweepfile, 6)
+        if self.args.workers > 1:
+            import multiprocessing
+            point_args = argparse.Namespace(**vars(self.args))
+            point_args.workers = 1
+            pool = multiprocessing.Pool(self.args.workers, initializer=init_worker,
+                                        initargs=(point_args, self.get_config_values()))
+            rows = pool.imap(run_worker_sweep_point, points)
+        else:
+            pool = None
+            rows = map(self.run_sweep_point, points)
+        sweep_rows = list()
+        try:
+            writer = None
+            for idx, row in enumerate(rows):
+                sweep_rows.append(row)
+                if not report:
+                    continue
+                if writer is None:
+                    writer = csv.DictWriter(sweep_fh, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+                sweep_fh.flush()
+                adv_pow, adv_pos, rewind_blocks = points[idx]
+                print("Sweep point " + str(idx + 1) + "/" + str(len(points)) + ": hashpower " +
+                      "/".join(map(str, adv_pow)) +
+                      (", stake " + "/".join(map(str, adv_pos)) if adv_pos else "") +
+                      ", rewind blocks " + str(rewind_blocks) + ": " +
+                      ", ".join("A" + str(a) + " won " + row["perc_wins.A" + str(a)] for a in range(len(adv_pow))))
+        finally:
+            sweep_fh and sweep_fh.close()
+            pool is None or pool.terminate()
+        if report:
+            logging.info("Saved sweep of " + str(len(points)) + " points to " + self.args.sweepfile)
+            print("Saved sweep of", len(points), "points to", self.args.sweepfile)
+        return sweep_rows
+
+    def paired_requested(self):
+        return bool(self.args.paired or self.args.pairedpos)
+
+    def paired_variants(self):
+        # Stake sizes of the variants of a paired comparison: PoW only, then -s and every --paired-pos split
+        return [[]] + ([self.args.pos] if self.args.pos else []) + (self.args.pairedpos or [])
+
+    def paired_metrics(self):
+        return ["wins." + "A" + str(idx) for idx in range(len(self.args.pow))] + ["6-block-diff", "blocks_lost"]
+
+    def run_paired_simulations(self, task):
+        # Runs simulations first_sim to first_sim + num_sims - 1 under every variant. Each variant of a simulation
+        # starts the PoW and the PoS random streams from the same seed: the block hashes owned by the adversaries
+        # and the block hashes drawn in every cycle until one has an owner are the same with and without PoS, and
+        # so are the PoS draws of the variants with stake. The block hashes drawn again after PoS invalidated
+        # a block come from a third stream, which the PoW only variant never uses
+        first_sim, num_sims, rewind_blocks, rewind_adv = task
+        variants = self.paired_variants()
+        aggregator = PairedAggregator(self.paired_metrics(), len(variants))
+        adv_stake = self.args.pos
+        try:
+            for s in range(first_sim, first_sim + num_sims):
+                outcomes = list()
+                for variant_stake in variants:
+                    self.args.pos = variant_stake
+                    self.pow_random = random.Random(simulation_seed(self.args.seed, s) + ":pow")
+                    self.pos_random = random.Random(simulation_seed(self.args.seed, s) + ":pos")
+                    self.pow_draws = RandomBuffer(self.pow_random, self.vote_proportions)
+                    self.pos_draws = RandomBuffer(self.pos_random, self.vote_proportions)
+                    self.pow_redraws = RandomBuffer(random.Random(simulation_seed(self.args.seed, s) + ":redraw"),
+                                                    self.vote_proportions)
+                    self.calc_hashpower(self.args.pow, self.args.pos)
+                    self.create_simulation(s)
+                    int(rewind_blocks) > 0 and self.setup_block_rewind(s, rewind_blocks, rewind_adv)
+                    sim_duration = self.run_simulation(s)
+                    # Only the outcomes are compared: simulations are not saved
+                    outcomes.append(self.simulation_outcome(self.simulations["sims"].pop(str(s)),
+                                                            sim_duration.total_seconds()))
+                aggregator.add(outcomes)
+        finally:
+            self.args.pos = adv_stake
+            self.pow_random = self.pos_random = self.random
+            self.pow_draws = self.pos_draws = self.pow_redraws = RandomBuffer(self.random, self.vote_proportions)
+        return aggregator
+
+    def run_paired_comparison(self, total_simulations=1, rewind_blocks=0, rewind_adv=0, report=True):
+        # Runs the paired comparison in this process or, with --workers, in ranges of simulations run by
+        # a pool of worker processes. With report, its summary is printed and saved
+        self.log_debug_info()
+        logging.info("Starting paired comparison")
+        self.batch_start_time = datetime.datetime.now()
+        self.simulations["sims"] = {}
+        if self.args.seed is None:
+            # Every variant of a simulation starts its random streams from the seed of the simulation
+            self.args.seed = self.random.randrange(2 ** 32)
+            logging.info("Seeding simulations with " + str(self.args.seed))
+        if self.args.outputformat == 'ndjson':
+            self.open_output_stream(self.args.outputfile)
+        aggregator = PairedAggregator(self.paired_metrics(), len(self.paired_variants()))
+        if self.args.workers > 1:
+            task_size = max(1, -(-total_simulations // (self.args.workers * 4)))
+            tasks = [(first_sim, min(task_size, total_simulations - first_sim), rewind_blocks, rewind_adv)
+                     for first_sim in range(0, total_simulations, task_size)]
+            import multiprocessing
+            with multiprocessing.Pool(self.args.workers, initializer=init_worker,
+                                      initargs=(self.args, self.get_config_values())) as pool:
+                for task_aggregator in pool.imap(run_worker_paired_simulations, tasks):
+                    aggregator.merge(task_aggregator)
+        else:
+            aggregator.merge(self.run_paired_simulations((0, total_simulations, rewind_blocks, rewind_adv)))
+        self.batch_end_time = datetime.datetime.now()
+        logging.info("End of paired comparison")
+        self.calc_paired_summary(aggregator)
+        if report:
+            self.print_paired_summary()
+            self.save_output(self.args.outputfile)
+
+    def calc_paired_summary(self, aggregator):
+        # Means of every variant and, for the variants with PoS, the mean change from PoW only with its standard
+        # error, its confidence interval and the variance reduction over the difference of two independent batches
+        z = confidence_z(self.args.confidence)
+        n = aggregator.total()
+        summary = {"batch_start": self.batch_start_time.isoformat(' '), "batch_end": self.batch_end_time.isoformat(' '),
+                   "total": n, "seed": self.args.seed, "rewind_blocks": int(self.args.rewind_blocks),
+                   "rewind_adv": "A" + str(self.args.rewind_adv), "confidence": self.args.confidence, "variants": {}}
+        for v, adv_stake in enumerate(self.paired_variants()):
+            variant = {"stake": adv_stake}
+            if v:
+                variant["winner_changed"] = aggregator.winner_changes[v]
+                variant["perc_winner_changed"] = round(aggregator.winner_changes[v] / n * 100, 4)
+            for idx, metric in enumerate(aggregator.metrics):
+                values = aggregator.values[v][idx]
+                variant[metric] = {"mean": round(values.mean, 6)}
+                if v:
+                    changes = aggregator.changes[v][idx]
+                    independent_variance = values.stderr() ** 2 + aggregator.values[0][idx].stderr() ** 2
+                    variant[metric].update({
+                        "change": round(changes.mean, 6), "change_stderr": round(changes.stderr(), 6),
+                        "change_ci": [round(x, 6) for x in changes.confidence_interval(z)],
+                        "variance_reduction":
+                            round(independent_variance / changes.stderr() ** 2, 3) if changes.stderr() else None})
+            if v:
+                # Metrics that PoS changes so much that the common random numbers don't reduce the variance of
+                # their changes: independent batches would be as precise
+                variant["weak_coupling"] = [metric for metric in aggregator.metrics
+                                            if variant[metric]["variance_reduction"] is not None and
+                                            variant[metric]["variance_reduction"] <= 1.0]
+            summary["variants"][paired_variant_name(adv_stake)] = variant
+        self.simulations["summary"] = summary
+
+    def print_paired_summary(self):
+        summary = self.simulations["summary"]
+        metrics = self.paired_metrics()
+        print("\nPaired comparison of PoW and PoW + PoS (common random numbers):")
+        print("--------------------------------------------------------------")
+        print("Number of simulations:", summary["total"], "per variant (seed " + str(summary["seed"]) + ")")
+        if summary["rewind_blocks"] > 0:
+            print("Simulating that adversary", summary["rewind_adv"], "is", summary["rewind_blocks"], "blocks ahead")
+        print(f'{"Variant":24}' + "".join(f'{metric:>16}' for metric in metrics))
+        for name, variant in summary["variants"].items():
+            print(f'{name:24}' + "".join(f'{variant[metric]["mean"]:>16}' for metric in metrics))
+        print("Changes from PoW,", f'{summary["confidence"]:g}%',
+              "confidence interval and variance reduction over independent batches:")
+        for name, variant in list(summary["variants"].items())[1:]:
+            print(name + ": winner changed in", variant["winner_changed"], "simulations",
+                  "(" + str(variant["perc_winner_changed"]) + "%)")
+            for metric in metrics:
+                print(f'  {metric:22} {variant[metric]["change"]:>+12} +/- {variant[metric]["change_stderr"]:<10}',
+                      "[" + " - ".join(map(str, variant[metric]["change_ci"])) + "]",
+                      "variance reduction:", variant[metric]["variance_reduction"])
+            if variant["weak_coupling"]:
+                print("  Weak coupling of", ", ".join(variant["weak_coupling"]) + ": PoS changes these races too much "
+                      "for common random numbers to help; independent batches would be as precise")
+        batch_duration = self.batch_end_time - self.batch_start_time
+        print("Total time for the paired comparison:", batch_duration.total_seconds(), "seconds")
+
+    def benchmark_args(self, scenario):
+        # Each scenario runs seeded, in the selected engine and workers, without output, cache nor checkpoints
+        scenario_args = argparse.Namespace(**vars(self.args))
+        scenario_args.pow = scenario["pow"]
+        scenario_args.pos = scenario["pos"]
+        scenario_args.rewind_blocks = scenario.get("rewind_blocks", 0)
+        scenario_args.rewind_adv = scenario.get("rewind_adv", 0)
+        scenario_args.simulations = scenario["simulations"] * \
+            (numpy_benchmark_factor if self.args.engine == 'numpy' else 1)
+        scenario_args.seed = 1 if self.args.seed is None else self.args.seed
+        scenario_args.nooutputjson = True
+        scenario_args.verbose = False
+        scenario_args.outputformat = 'pprint'
+        scenario_args.targetprecision = None
+        scenario_args.tracefile = None
+        scenario_args.cachedir = None
+        scenario_args.checkpoint = None
+        scenario_args.resume = False
+        scenario_args.metricsfile = None
+        scenario_args.summaryonly = False
+        return scenario_args
+
+    def run_benchmark(self):
+        import multiprocessing
+        results = {"version": __version__, "engine": self.args.engine, "workers": self.args.workers,
+                   "seed": 1 if self.args.seed is None else self.args.seed, "python": platform.python_version(),
+                   "date": str(datetime.datetime.now()), "scenarios": {}}
+        print(f'{"Scenario":18} {"Simulations":>11} {"Sims/sec":>12} {"Cycles/sec":>12} {"Peak KB":>10} '
+              f'{"Setup (s)":>10} {"Race (s)":>10} {"Averages (s)":>12}')
+        for scenario in benchmark_scenarios:
+            scenario_args = self.benchmark_args(scenario)
+            self.sanity_check(scenario_args.pow, scenario_args.pos, scenario_args.rewind_adv)
+            config_values = dict(self.get_config_values(), **scenario.get("config", {}))
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=run_benchmark_scenario, args=(scenario_args, config_values, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            results["scenarios"][scenario["name"]] = result
+            print(f'{scenario["name"]:18} {result["simulations"]:>11} {result["simulations_per_sec"]:>12} '
+                  f'{str(result["cycles_per_sec"]):>12} {str(result["peak_memory_kb"]):>10} '
+                  f'{result["phases"]["setup"]:>10.3f} {result["phases"]["race"]:>10.3f} '
+                  f'{result["phases"]["averages"]:>12.3f}')
+
+        try:
+            with open(self.args.benchmarkfile, 'w') as bfh:
+                json.dump(results, bfh, indent=4)
+        except PermissionError:
+            logging.error("Missing write permission while saving benchmark to " + self.args.benchmarkfile)
+            exit(6)
+        print("Saved benchmark to", self.args.benchmarkfile)
+        if self.args.benchmarkbaseline:
+            regressions = compare_benchmark(results, self.args.benchmarkbaseline, self.args.benchmarkthreshold)
+            if regressions:
+                print("Error: Performance regression in", ", ".join(regressions))
+                logging.error("Performance regression in " + ", ".join(regressions))
+                exit(9)
+
+    def simulation_outcome(self, sim, duration):
+        # Outcome of a finished simulation: all calc_averages() needs from it
+        sim_adversaries = sim.adversaries
+        return (sim.results["2-block-diff"], sim.results["6-block-diff"], sim.results["6-block-diff_winner"],
+                tuple(int(sim_adversaries[a]["sum_blocks"]) for a in sim_adversaries),
+                tuple(sim_adversaries[a]["validated_blocks"] for a in sim_adversaries) if self.args.pos else (),
+                tuple(sim_adversaries[a]["invalidated_blocks"] for a in sim_adversaries) if self.args.pos else (),
+                duration, math.exp(sim.log_likelihood_ratio))
+
+    def calc_averages(self):
+        z = confidence_z(self.args.confidence)
+        summary = self.simulations["summary"] = {}
+
+        summary["batch_start"] = self.batch_start_time.isoformat(' ')
+        summary["batch_end"] = self.batch_end_time.isoformat(' ')
+        summary["sim_mean_time"] = round(self.batch_aggregator.duration.mean, 6)
+
+        summary["total"] = self.batch_aggregator.total()          # Total number of simulations
+        summary["seed"] = self.args.seed                          # Seed of the batch, if any
+        summary["rewind_blocks"] = self.args.rewind_blocks        # Number of blocks to rewind
+        summary["rewind_adv"] = "A" + str(self.args.rewind_adv)   # Adversary trying to back in history
+        summary["confidence"] = self.args.confidence              # Confidence level of the intervals
+        if self.outcome_records is not None:
+            # Simulations whose records were dropped by --summary-memory
+            summary["records_dropped"] = self.outcome_records.dropped
+        summary["pow"] = {}
+        for key, stats in [("2-block-diff", self.batch_aggregator.block_diff_2),
+                           ("6-block-diff", self.batch_aggregator.block_diff_6)]:
+            summary["pow"][key + "-average"] = round(stats.mean, 6)
+            summary["pow"][key + "-stderr"] = round(stats.stderr(), 6)
+            summary["pow"][key + "-ci"] = [round(x, 6) for x in stats.confidence_interval(z)]
+
+        summary["total_wins"] = {}
+        summary["perc_wins"] = {}
+        summary["perc_wins_ci"] = {}
+        summary["sum_blocks"] = {}
+        for a in self.adversaries:
+            summary["sum_blocks"][a] = {}
+            win_counts = self.batch_aggregator.wins[a]
+            summary["total_wins"][a] = win_counts
+            summary["perc_wins"][a] = str(round(win_counts / self.batch_aggregator.total() * 100, 4)) + "%"
+            summary["perc_wins_ci"][a] = \
+                [str(round(x * 100, 4)) + "%" for x in wilson_interval(win_counts, self.batch_aggregator.total(), z)]
+            summary["sum_blocks"][a]["average"] = round(self.batch_aggregator.sum_blocks[a].mean, 6)
+
+        if self.args.pos:
+            summary["pos"] = {}
+            for a in self.adversaries:
+                summary["pos"][a] = {}
+                summary["pos"][a]["invalidated_blocks-average"] = \
+                    round(self.batch_aggregator.invalidated_blocks[a].mean, 6)
+                summary["pos"][a]["validated_blocks-average"] = \
+                    round(self.batch_aggregator.validated_blocks[a].mean, 6)
+
+        if self.importance_sampling():
+            self.calc_importance_summary(z)
+
+        if self.args.targetprecision is not None:
+            summary["precision"] = round(self.batch_aggregator.precision(z), 6)
+            summary["target_precision_reached"] = self.batch_aggregator.precision_reached()
+
+    def calc_importance_summary(self, z):
+        # Win probability of the attacker reweighted by the likelihood ratios, with the variance plain sampling
+        # would have had for the same estimate and number of simulations. The tilt only favours the attacker's
+        # wins, so the estimates of the other adversaries aren't reported
+        n = self.batch_aggregator.total()
+        attacker = self.importance_attacker()
+        estimate, stderr = self.batch_aggregator.weighted_win_probability(attacker)
+        plain_variance = min(estimate, 1.0) * (1 - min(estimate, 1.0)) / n
+        # Rare events need significant digits rather than decimal places
+        self.simulations["summary"]["importance_sampling"] = {
+            "attacker": attacker, "tilt": self.args.importancetilt or 1.0,
+            "vote_tilt": self.args.importancevotetilt or 1.0,
+            "effective_simulations": round(self.batch_aggregator.effective_simulations(), 3),
+            "win_probability": float(f'{estimate:.6g}'), "win_probability_stderr": float(f'{stderr:.6g}'),
+            "win_probability_ci": [float(f'{max(0.0, estimate - z * stderr):.6g}'),
+                                   float(f'{min(1.0, estimate + z * stderr):.6g}')],
+            "variance_reduction": round(plain_variance / (stderr * stderr), 3) if stderr else None}
+
+    def print_importance_summary(self):
+        summary = self.simulations["summary"]["importance_sampling"]
+        print("Importance sampling toward", summary["attacker"], "(tilt:", str(summary["tilt"]) + ", vote tilt:",
+              str(summary["vote_tilt"]) + "); simulations won above count the tilted draws")
+        print("Effective number of simulations:", summary["effective_simulations"])
+        print(summary["attacker"], "win probability:", summary["win_probability"], "- standard error:",
+              summary["win_probability_stderr"], "-", f'{self.simulations["summary"]["confidence"]:g}%',
+              "confidence interval:", " - ".join(map(str, summary["win_probability_ci"])),
+              "- variance reduction:", summary["variance_reduction"])
+
+    def print_summary(self):
+        num_sims = self.simulations["summary"]["total"]
+        if not self.args.pos:
+            print("\nPure PoW simulation:")
+            print("--------------------")
+            print("Number of simulations:", self.simulations["summary"]["total"])
+            if self.simulations["summary"]["rewind_blocks"] > 0:
+                print("Simulating that adversary", self.simulations["summary"]["rewind_adv"], "is",
+                      self.simulations["summary"]["rewind_blocks"], "blocks ahead")
+
+            # Table section
+            table = {}
+            for a in self.adversaries:
+                table.update({a: {'hpow': self.adversaries[a]["pow_hashpower"],
+                                  'sims_wins_n': self.simulations["summary"]["total_wins"][a],
+                                  'sims_wins_p': self.simulations["summary"]["perc_wins"][a]
+                                  }})
+
+            print(f'{"Adversary":9} {"Hashpower":>10} {"Simulations won":>16} {"Simulations won":>16}')
+            for adv in table.items():
+                print(f'{adv[0]:9} {adv[1]["hpow"]:>10} {adv[1]["sims_wins_n"]:>16} {adv[1]["sims_wins_p"]:>16}')
+
+            # After table
+            batch_duration = self.batch_end_time - self.batch_start_time
+            print("Total time for the batch of simulations:", batch_duration. total_seconds(), "seconds")
+            print("Average duration of simulations:", self.simulations["summary"]["sim_mean_time"], "seconds")
+            print(f'{"Average of " if int(num_sims) > 1 else ""}2-block advantage for', num_sims,
+                  f'{"simulation" if int(num_sims) < 2 else "simulations"} reached in:',
+                  self.simulations["summary"]["pow"]["2-block-diff-average"])
+            print(f'{"Average of " if int(num_sims) > 1 else ""}6-block advantage for', num_sims,
+                  f'{"simulation" if int(num_sims) < 2 else "simulations"} reached in:',
+                  self.simulations["summary"]["pow"]["6-block-diff-average"])
+
+            # Attacker success probability:
+            for a in self.adversaries:
+                q = float(self.adversaries[a]["hashpower"]) / 100
+                if q < 0.50:
+                    print("Attacker probability of catching up for " + a + ": (z=number of blocks behind)")
+                    str_zp = ""
+                    probabilities = attacker_success_probabilities([q], range(1, 7), self.args.probabilitymodel)
+                    for z, probability in enumerate(probabilities[0], start=1):
+                        str_zp += "z=" + str(z) + ", p=" + str(round(probability, 6)) + "; "
+                    print(str_zp)
+        else:
+            print("\nPoW + PoS simulation:")
+            print("_____________________")
+            print("Number of simulations:", self.simulations["summary"]["total"])
+            if self.simulations["summary"]["rewind_blocks"] > 0:
+                print("Simulating that adversary", self.simulations["summary"]["rewind_adv"], "is",
+                      self.simulations["summary"]["rewind_blocks"],
+                      f'{"block" if int(self.simulations["summary"]["rewind_blocks"]) < 2 else "blocks"} ahead')
+
+            # Table section
+            table = {}
+            for a in self.adversaries:
+                table.update({a: {'hpow': self.adversaries[a]["pow_hashpower"],
+                                  'ssize': self.adversaries[a]["pos_stakesize"],
+                                  'sims_wins_n': self.simulations["summary"]["total_wins"][a],
+                                  'sims_wins_p': self.simulations["summary"]["perc_wins"][a],
+                                  'inv_blocks': self.simulations["summary"]["pos"][a]["invalidated_blocks-average"],
+                                  'val_blocks': self.simulations["summary"]["pos"][a]["validated_blocks-average"]}})
+
+            print(f'{"Adversary":9} {"Hashpower":>10} {"Stake":>10} '
+                  f'{"Simulations won":>16} {"Simulations won":>16} {"Avg Invalidated Blocks":>23} '
+                  f'{"Avg Validated Blocks":>21}')
+            for adv in table.items():
+                print(f'{adv[0]:9} {adv[1]["hpow"]:>10} {adv[1]["ssize"]:>10} {adv[1]["sims_wins_n"]:>16} '
+                      f'{adv[1]["sims_wins_p"]:>16} {adv[1]["inv_blocks"]:>23} {adv[1]["val_blocks"]:>21}')
+
+            # After table
+            print("Total time for the batch of simulations:", self.batch_end_time - self.batch_start_time)
+            print("Average duration of simulations:", self.simulations["summary"]["sim_mean_time"], "seconds")
+            print(f'{"Average of " if int(num_sims) > 1 else ""}2-block advantage for', num_sims,
+                  f'{"simulation" if int(num_sims) < 2 else "simulations"} reached in:',
+                  self.simulations["summary"]["pow"]["2-block-diff-average"], "blocks")
+            print(f'{"Average of " if int(num_sims) > 1 else ""}6-block advantage for', num_sims,
+                  f'{"simulation" if int(num_sims) < 2 else "simulations"} reached in:',
+                  self.simulations["summary"]["pow"]["6-block-diff-average"], "blocks")
+
+            # Attacker success probability won't be calculated for PoW + PoS
+
+        # Confidence intervals
+        print(f'{self.simulations["summary"]["confidence"]:g}% confidence interval of the 2-block advantage average:',
+              self.simulations["summary"]["pow"]["2-block-diff-ci"], "and of the 6-block advantage average:",
+              self.simulations["summary"]["pow"]["6-block-diff-ci"])
+        print(f'{self.simulations["summary"]["confidence"]:g}% confidence interval of simulations won:',
+              "; ".join(a + " " + " - ".join(self.simulations["summary"]["perc_wins_ci"][a]) for a in self.adversaries))
+        if self.args.targetprecision is not None:
+            if self.simulations["summary"]["target_precision_reached"]:
+                print("Target precision of +/-", self.args.targetprecision, "reached after", num_sims, "simulations")
+            else:
+                print("Target precision of +/-", self.args.targetprecision, "not reached after", num_sims,
+                      "simulations (precision: +/-", str(self.simulations["summary"]["precision"]) + ")")
+
+        # Losses amount
+        loss_list = list()
+        for i in table:
+            loss_list.append(table[i]["sims_wins_n"])
+        if max(loss_list) != min(loss_list):
+            # We have winners and losers; print about the losers
+            for a in self.adversaries:
+                if (self.simulations["summary"]["sum_blocks"][a]["average"] > 0) and \
+                        (int(table[a]["sims_wins_n"]) < max(loss_list)):
+                    if self.args.pos:
+                        print("Assuming that", a, "won\'t fork the blockchain, the attack cost",
+                              self.simulations["summary"]["sum_blocks"][a]["average"], "PoW block reward, on average,",
+                              "due to PoS invalidation of bad PoW mined blocks.")
+                    else:
+                        print("Assuming that", a, "won\'t fork the blockchain, the attack cost",
+                              self.simulations["summary"]["sum_blocks"][a]["average"],
+                              "PoW block reward, on average.")
+                elif self.simulations["summary"]["sum_blocks"][a]["average"] == 0:
+                    print("Assuming that", a, "won\'t try to fork the blockchain,", a, "won't forgo any PoW reward",
+                          "because no block was successfully mined.")
+        else:
+            # We have a draw; print about all of them
+            print("Assuming that no adversary will fork the blockchain:")
+            for a in self.adversaries:
+                if (self.simulations["summary"]["sum_blocks"][a]["average"] > 0) and \
+                        (int(table[a]["sims_wins_n"]) <= max(loss_list)):
+                    print(a, "lost the equivalent of",
+                          self.simulations["summary"]["sum_blocks"][a]["average"], "PoW block rewards, on average")
+        self.importance_sampling() and self.print_importance_summary()
+
+    def open_output_stream(self, output_file):
+        # With --output-format ndjson, simulations are written to the output file as soon as they finish
+        if output_file and not self.args.nooutputjson:
+            try:
+                self.output_stream = open(output_file, self.args.outputmode)
+            except PermissionError:
+                logging.error("Missing write permission while saving output to " + output_file)
+                exit(6)
+
+    def export_simulations(self):
+        # Simulations in the shape of the JSON output
+        exported = dict(self.simulations)
+        if self.outcome_records is not None:
+            exported["sims"] = self.outcome_records.export()
+        else:
+            exported["sims"] = {s: simulation_json(sim) for s, sim in self.simulations["sims"].items()}
+        return exported
+
+    def stream_simulations(self):
+        # Writes the finished simulations as JSON lines and drops them from memory
+        if self.output_stream:
+            output_started = self.phase_metrics and time.perf_counter()
+            for s in list(self.simulations["sims"]):
+                sim_json = simulation_json(self.simulations["sims"].pop(s))
+                self.output_stream.write(json.dumps(dict(sim=int(s), **sim_json), separators=(',', ':')))
+                self.output_stream.write("\n")
+            self.output_stream.flush()
+            self.phase_metrics is None or self.phase_metrics.add("output", output_started)
+
+    def save_output(self, output_file):
+        if self.output_stream:
+            # Trailing summary record of a streamed batch
+            self.output_stream.write(json.dumps({"summary": self.simulations["summary"]}, separators=(',', ':')) + "\n")
+            self.output_stream.close()
+            self.output_stream = None
+            logging.info("Saved simulation JSON lines to " + output_file)
+        elif output_file and not self.args.nooutputjson:
+            try:
+                with open(output_file, self.args.outputmode) as ofh:
+                    if self.args.outputformat == 'json':
+                        json.dump(self.export_simulations(), ofh, indent=4)
+                    else:
+                        pprint.pprint(self.export_simulations(), ofh)
+            except PermissionError:
+                logging.error("Missing write permission while saving output to", output_file)
+                exit(6)
+            else:
+                logging.info("Saved simulation JSON object to " + output_file)
+
+    def validation_probability(self, tickets):
+        # Probability that an adversary owning this number of the drawable tickets (1 to the pool size; ticket 0
+        # is never drawn) owns most of the online tickets, over the historical proportions of 5, 4 and 3 votes
+        probability = 0.0
+        for votes, proportion in zip((5, 4, 3), self.vote_proportions):
+            probability += proportion * sum(hypergeometric_pmf(self.pos_avg_ticket_pool_size - 1, tickets, votes, k)
+                                            for k in range(votes // 2 + 1, min(votes, tickets) + 1))
+        return probability
+
+    def analytic_race_mixture(self, adv_hashpower, adv_stake):
+        # The race only depends on a few counts fixed by calc_hashpower() at the start of each simulation:
+        # PoW: the number of block hashes owned by both adversaries (hypergeometric overlap of their samples)
+        # PoS: the owner of ticket 0, that is never drawn. Returns (weight, up, down) for each case
+        hashes = [round(round(float(a), 2) * 100) for a in adv_hashpower]
+        cases = list()
+        if not adv_stake:
+            lowest = max(0, hashes[0] + hashes[1] - self.block_hash_space)
+            for both in range(lowest, min(hashes) + 1):
+                weight = hypergeometric_pmf(self.block_hash_space, hashes[0], hashes[1], both)
+                if weight < 1e-15 or hashes[0] + hashes[1] == both:
+                    continue
+                # Draws owned by both adversaries add one block to each chain: the difference stays
+                cases.append((weight, (hashes[0] - both) / (hashes[0] + hashes[1] - both),
+                              (hashes[1] - both) / (hashes[0] + hashes[1] - both)))
+            return cases
+
+        tickets = [round(round(float(s), 2) / 100 * self.pos_avg_ticket_pool_size) for s in adv_stake]
+        unowned_tickets = max(self.pos_avg_ticket_pool_size - sum(tickets), 0)
+        for ticket_0_owner, weight in enumerate(tickets + [unowned_tickets]):
+            if not weight:
+                continue
+            # Whatever the overlap, a cycle ends with exactly one validated block: adversary a's PoW blocks come up
+            # with probability proportional to its block hashes and are validated with its validation probability
+            validated = [hashes[idx] * self.validation_probability(tickets[idx] - (ticket_0_owner == idx))
+                         for idx in range(2)]
+            cases.append((weight / sum(tickets + [unowned_tickets]), validated[0] / sum(validated),
+                          validated[1] / sum(validated)))
+        return cases
+
+    def calc_analytic(self, adv_hashpower, adv_stake, rewind_blocks=0, rewind_adv=0):
+        # Exact win probabilities and 2/6-block difference averages, in the units of the summary of a batch:
+        # differences are reached after rewind_blocks + cycles + 1 blocks, and 2-block differences
+        # that are never met count as -1
+        start = int(rewind_blocks) * (1 if int(rewind_adv) == 0 else -1)
+        win_0, cycles_6, reach_2, cycles_2 = 0.0, 0.0, 0.0, 0.0
+        total_weight = 0.0
+        for weight, up, down in self.analytic_race_mixture(adv_hashpower, adv_stake):
+            case = solve_race(up, down, start)
+            win_0 += weight * case[0]
+            cycles_6 += weight * case[1]
+            reach_2 += weight * case[2]
+            cycles_2 += weight * case[3]
+            total_weight += weight
+        win_0, cycles_6, reach_2, cycles_2 = [x / total_weight for x in (win_0, cycles_6, reach_2, cycles_2)]
+        return {"win_probability": {"A0": win_0, "A1": 1.0 - win_0},
+                "2-block-diff-reached": reach_2,
+                "2-block-diff-average": (int(rewind_blocks) + 1) * reach_2 + cycles_2 - (1.0 - reach_2),
+                "6-block-diff-average": int(rewind_blocks) + 1 + cycles_6}
+
+    def print_analytic(self):
+        start_time = datetime.datetime.now()
+        solution = self.calc_analytic(self.args.pow, self.args.pos, self.args.rewind_blocks, self.args.rewind_adv)
+        duration = datetime.datetime.now() - start_time
+        print("Analytic solution (Markov chain)" if not self.args.pos else
+              "Analytic solution (Markov chain), PoW + PoS")
+        print("_" * 32 if not self.args.pos else "_" * 44)
+        if int(self.args.rewind_blocks) > 0:
+            print("Simulating that adversary", "A" + str(self.args.rewind_adv), "is", self.args.rewind_blocks,
+                  f'{"block" if int(self.args.rewind_blocks) < 2 else "blocks"} ahead')
+        for idx, a in enumerate(["A0", "A1"]):
+            print(a, "hashpower:", str(self.args.pow[idx]) + "%" +
+                  (", stake: " + str(self.args.pos[idx]) + "%" if self.args.pos else ""),
+                  "- win probability:", str(round(solution["win_probability"][a] * 100, 4)) + "%")
+        print("Probability of reaching the 2-block advantage:",
+              str(round(solution["2-block-diff-reached"] * 100, 4)) + "%")
+        print("Expected average of 2-block advantage reached in:", round(solution["2-block-diff-average"], 6), "blocks")
+        print("Expected average of 6-block advantage reached in:", round(solution["6-block-diff-average"], 6), "blocks")
+        print("Solved in:", duration)
+
+    def job_summary(self, aggregator, start_time):
+        # Summary of a finished job of --serve, as calc_averages() reports it for a batch
+        self.batch_aggregator, self.batch_start_time = aggregator, start_time
+        self.batch_end_time = datetime.datetime.now()
+        self.calc_hashpower(self.args.pow, self.args.pos)
+        self.calc_averages()
+        return self.simulations["summary"]
+
+    def submit_job(self):
+        # Sends the batch of the command line to the job server and prints its progress and summary
+        import asyncio
+        address = server_address(self.args.serveaddress)
+        request = {"hashpower": self.args.pow, "stake": self.args.pos or [], "simulations": self.args.simulations,
+                   "rewind_blocks": self.args.rewind_blocks, "rewind_adv": self.args.rewind_adv,
+                   "options": {option: getattr(self.args, option) for option in server_job_options}}
+
+        async def submit():
+            try:
+                if isinstance(address, str):
+                    reader, writer = await asyncio.open_unix_connection(address)
+                else:
+                    reader, writer = await asyncio.open_connection(*address)
+            except OSError as error:
+                raise ScenarioError("Can't connect to the job server at " + self.args.serveaddress + ": " + str(error))
+            writer.write(json.dumps(request).encode() + b"\n")
+            await writer.drain()
+            try:
+                while line := await reader.readline():
+                    event = json.loads(line)
+                    if event["event"] == "accepted":
+                        print("Job", event["job"], "accepted" + (" (already running)" if event["deduplicated"] else ""))
+                    elif event["event"] == "progress":
+                        print("Job", str(event["job"]) + ":", str(event["done"]) + "/" + str(event["total"]),
+                              "simulations,", ", ".join(a + " won " + str(w) for a, w in event["wins"].items()))
+                    elif event["event"] == "result":
+                        return event["summary"]
+                    else:
+                        raise ScenarioError(event["message"])
+            finally:
+                writer.close()
+            raise ScenarioError("The job server closed the connection")
+
+        self.batch_start_time = datetime.datetime.now()
+        self.simulations["summary"] = asyncio.run(submit())
+        self.batch_end_time = datetime.datetime.now()
+        # Adversaries' hashpower and stake information for print_summary()
+        self.calc_hashpower(self.args.pow, self.args.pos)
+        self.simulations["sims"] = {}
+        self.print_summary()
+        self.save_output(self.args.outputfile)
+
+    def run_server(self):
+        import asyncio
+        import signal
+        address = server_address(self.args.serveaddress)
+        server = JobServer(self.args.workers, self.get_config_values())
+
+        async def serve():
+            stop = asyncio.Event()
+            try:
+                # A service manager stops the server with SIGTERM
+                asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+            except NotImplementedError:
+                pass
+            if isinstance(address, str):
+                job_server = await asyncio.start_unix_server(server.handle_client, path=address)
+            else:
+                job_server = await asyncio.start_server(server.handle_client, *address)
+            print("Serving simulation jobs on", self.args.serveaddress, "with", self.args.workers,
+                  "worker" if self.args.workers == 1 else "workers")
+            logging.info("Serving simulation jobs on " + self.args.serveaddress)
+            async with job_server:
+                await stop.wait()
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.executor.shutdown(cancel_futures=True)
+            isinstance(address, str) and os.path.exists(address) and os.remove(address)
+        print("Job server stopped.")
+        logging.info("Job server stopped")
+
+
+def server_job_args(request, config_values):
+    # Options of the batch requested by a client: {"hashpower": [...], "stake": [...], "simulations": N,
+    # "rewind_blocks": N, "rewind_adv": N, "config": {...}, "options": {...}}, as for a Scenario
+    options = request.get("options", {})
+    for option in options:
+        if option not in server_job_options:
+            raise ScenarioError("Option not available for server jobs: " + option)
+    scenario = Scenario(request["hashpower"], request.get("stake"), request.get("simulations", 1),
+                        request.get("rewind_blocks", 0), request.get("rewind_adv", 0), **options)
+    job_args = scenario.namespace()
+    check_config_values(request.get("config", {}))
+    config_values = dict(config_values, **request.get("config", {}))
+    job_simulator = Simulator(config_values)
+    job_simulator.args = job_args
+    job_simulator.sanity_check(job_args.pow, job_args.pos, job_args.rewind_adv)
+    return job_args, config_values
+
+
+def run_server_task(task):
+    # Runs in a worker process of the server: a range of simulations of a job, with the job's options
+    job_args, config_values, first_sim, num_sims = task
+    init_worker(job_args, config_values)
+    sims, recorder, metrics = worker_simulator.run_simulation_task((first_sim, num_sims, job_args.rewind_blocks,
+                                                                    job_args.rewind_adv))
+    # Jobs only return their summary
+    worker_simulator.simulations["sims"] = {}
+    return recorder
+
+
+class ServerJob:
+    # A batch requested by one or more clients of the job server; clients submitting the same batch while
+    # it runs are added to its event queues
+
+    def __init__(self, job_id, job_args, config_values):
+        import asyncio
+        self.job_id = job_id
+        self.args = job_args
+        self.config_values = config_values
+        # Sums up the job when it finishes
+        self.simulator = Simulator(config_values)
+        self.simulator.args = job_args
+        self.clients = list()
+        self.finished = asyncio.Event()
+
+    def publish(self, event):
+        event = dict(job=self.job_id, **event)
+        for events in self.clients:
+            events.put_nowait(event)
+
+
+class JobServer:
+    # Accepts jobs as JSON lines and answers with JSON lines of events: accepted, progress (after each range
+    # of simulations, with the partial aggregates), result (the summary of the batch) and error. The ranges
+    # of simulations of every job are queued to one pool of worker processes
+
+    def __init__(self, workers, config_values):
+        import concurrent.futures
+        self.workers = workers
+        self.executor = concurrent.futures.ProcessPoolExecutor(workers)
+        self.config_values = config_values
+        self.jobs = {}
+        self.next_job_id = 1
+
+    async def handle_client(self, reader, writer):
+        import asyncio
+        events = asyncio.Queue()
+        sender = asyncio.create_task(self.send_events(events, writer))
+        jobs = list()
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    events.put_nowait({"event": "error", "message": "Requests are JSON lines"})
+                    continue
+                jobs.append(asyncio.create_task(self.submit(request, events)))
+            # The client stopped sending requests: its jobs still report to it
+            await asyncio.gather(*jobs)
+            await events.join()
+        finally:
+            sender.cancel()
+            for job in self.jobs.values():
+                events in job.clients and job.clients.remove(events)
+            writer.close()
+
+    @staticmethod
+    async def send_events(events, writer):
+        # Events of a client that went away are dropped
+        while True:
+            event = await events.get()
+            try:
+                writer.write(json.dumps(event, separators=(',', ':')).encode() + b"\n")
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                events.task_done()
+
+    async def submit(self, request, events):
+        try:
+            job_args, config_values = server_job_args(request, self.config_values)
+        except (ScenarioError, KeyError, TypeError, ValueError) as error:
+            events.put_nowait({"event": "error", "message": str(error)})
+            return
+        # Identical requests share the job that runs them; unseeded jobs too, before the seed is drawn
+        key = json.dumps([vars(job_args), config_values], sort_keys=True)
+        job = self.jobs.get(key)
+        if job is not None:
+            job.clients.append(events)
+            events.put_nowait({"job": job.job_id, "event": "accepted", "deduplicated": True})
+            await job.finished.wait()
+            return
+        job = ServerJob(self.next_job_id, job_args, config_values)
+        self.next_job_id += 1
+        self.jobs[key] = job
+        job.clients.append(events)
+        job.publish({"event": "accepted", "deduplicated": False})
+        logging.info("Running job " + str(job.job_id) + ": " + json.dumps(request))
+        try:
+            await self.run_job(job)
+        except Exception as error:
+            logging.error("Job " + str(job.job_id) + " failed: " + repr(error))
+            job.publish({"event": "error", "message": repr(error)})
+        finally:
+            del self.jobs[key]
+            job.finished.set()
+
+    async def run_job(self, job):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        job_args = job.args
+        if job_args.seed is None:
+            # Worker processes would share the same random state
+            job_args.seed = random.randrange(2 ** 32)
+        total_simulations = job_args.simulations
+        if job_args.engine == 'numpy':
+            task_size = numpy_chunk_size
+        else:
+            task_size = max(1, min(-(-total_simulations // (self.workers * 4)), server_progress_simulations))
+        start_time = datetime.datetime.now()
+        futures = [loop.run_in_executor(self.executor, run_server_task,
+                                        (job_args, job.config_values, first_sim,
+                                         min(task_size, total_simulations - first_sim)))
+                   for first_sim in range(0, total_simulations, task_size)]
+        aggregator = BatchAggregator(["A" + str(idx) for idx in range(len(job_args.pow))], job_args.targetprecision,
+                                     job_args.confidence)
+        try:
+            # Outcomes are aggregated in simulation order, as in a batch run with --workers
+            for future in futures:
+                (await future).replay(aggregator)
+                job.publish({"event": "progress", "done": aggregator.total(), "total": total_simulations,
+                             "wins": dict(aggregator.wins),
+                             "6-block-diff-average": round(aggregator.block_diff_6.mean, 6)})
+                if aggregator.precision_reached():
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+        summary = job.simulator.job_summary(aggregator, start_time)
+        job.publish({"event": "result", "summary": summary})
+        logging.info("Finished job " + str(job.job_id))
+
+
+def server_address(address):
+    # (host, port), or the path of a Unix socket
+    if address.startswith("unix:"):
+        return address[len("unix:"):]
+    host, separator, port = address.rpartition(":")
+    if not separator or not port.isdigit():
+        raise ScenarioError("--serve-address must be HOST:PORT or unix:PATH")
+    return host, int(port)
 
 
-def main():
+def main(args):
+    simulator = Simulator()
+    simulator.args = args
     try:
-        if args.runtest:
-            test_attacker_success_probability()
+        # Sweeps and benchmarks check each of their scenarios, and the job server those of its jobs
+        args.runtest or args.benchmark or args.serve or args.querystore or simulator.sweep_requested() or \
+            simulator.sanity_check(args.pow, args.pos, args.rewind_adv)
+        simulator.configure(read_config(args.configfile, not args.nocreateconfig))
+        if args.querystore:
+            query_results_store(args.querystore, args.where or [], args.confidence)
+        elif args.runtest:
+            test_attacker_success_probability(model=args.probabilitymodel)
             args.verbose = True
             args.pow = [90, 10]     # Pure PoW: A0 represents the honest nodes (90%)
             args.pos = []           # and A1 a dishonest adversary (10%)
-            run_batch_simulations(total_simulations=1, rewind_blocks=0, rewind_adv=0)
+            simulator.run_batch_simulations(total_simulations=1, rewind_blocks=0, rewind_adv=0)
+        elif args.benchmark:
+            simulator.run_benchmark()
+        elif args.serve:
+            simulator.run_server()
+        elif args.submit:
+            simulator.submit_job()
+        elif args.analytic:
+            if len(args.pow) != 2:
+                print("Error: --analytic solves the race between 2 adversaries")
+                exit(1)
+            simulator.print_analytic()
         else:
-            run_batch_simulations(total_simulations=args.simulations, rewind_blocks=args.rewind_blocks,
-                                  rewind_adv=args.rewind_adv)
+            if args.replaysim is not None and args.replaysim >= args.simulations and not simulator.sweep_requested():
+                print("Warning: --replay-sim", args.replaysim, "is beyond the", args.simulations,
+                      "simulations of the batch (-i); it replays the simulation of a longer batch")
+                logging.warning("--replay-sim " + str(args.replaysim) + " is beyond the simulations of the batch")
+            # Batches, sweeps, paired comparisons and replays, printed and saved
+            simulator.run(Scenario.from_args(args), report=True)
+    except ScenarioError as error:
+        print("Error:", error)
+        exit(error.exit_code)
     except KeyboardInterrupt:
+        simulator.save_interrupted()
         print("Keyboard interruption. Simulation terminated.")
         logging.critical("Keyboard interruption. Simulation terminated.")
         exit(7)
@@ -791,9 +4126,9 @@ def main():
 
 
 if __name__ == "__main__":
+    args = build_parser().parse_args()
     args.version and print_version()
+    args.decodetrace and decode_trace(args.decodetrace)
     config_logging(args.logfile, args.logmode, args.loglevel)
-    args.runtest or sanity_check(args.pow, args.pos, args.rewind_adv)
-    read_config(args.configfile)
 
-    main()
+    main(args)
@@ -0,0 +1,16 @@
+import sys
+
+import pytest
+
+from helpers import ROOT, run_script
+
+# Tests import the script as a module
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def run(tmp_path):
+    # Runs the command line in a directory of its own
+    def run(*arguments, check=True):
+        return run_script(tmp_path, *arguments, check=check)
+    return run
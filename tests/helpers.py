@@ -0,0 +1,35 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "invalidationgame.py")
+
+# Keys of the summary that depend on when and how fast the batch ran
+TIMING_KEYS = ["batch_start", "batch_end", "sim_mean_time"]
+
+
+def script_command(*arguments):
+    # Command line of the script, without creating the configuration file
+    return [sys.executable, SCRIPT, "--no-create-config"] + [str(a) for a in arguments]
+
+
+def run_script(cwd, *arguments, check=True):
+    result = subprocess.run(script_command(*arguments), cwd=cwd, capture_output=True, text=True)
+    if check:
+        assert result.returncode == 0, result.stdout + result.stderr
+    return result
+
+
+def read_ndjson(output_file):
+    # Simulations (by number) and summary of an ndjson output file, without the timings of the summary
+    sims, summary = {}, None
+    with open(output_file) as ofh:
+        for line in ofh:
+            record = json.loads(line)
+            if "summary" in record:
+                summary = {key: value for key, value in record["summary"].items() if key not in TIMING_KEYS}
+            else:
+                sims[record.pop("sim")] = record
+    return sims, summary
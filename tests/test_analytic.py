@@ -0,0 +1,35 @@
+import json
+import math
+import re
+
+import pytest
+
+# Standard errors allowed between the Monte Carlo estimates and the exact solution
+TOLERANCE = 4
+
+
+def analytic_solution(run, options):
+    # Win probabilities and 2 and 6-block difference averages printed by --analytic
+    output = run(*options, "--analytic").stdout
+    wins = {a: float(p) / 100 for a, p in re.findall(r"^(A\d) .* win probability: ([\d.]+)%$", output, re.M)}
+    diff_2 = float(re.search(r"2-block advantage reached in: ([-\d.]+) blocks", output).group(1))
+    diff_6 = float(re.search(r"6-block advantage reached in: ([-\d.]+) blocks", output).group(1))
+    return wins, diff_2, diff_6
+
+
+@pytest.mark.parametrize("options", [["-w", 60, "-w", 40],
+                                     ["-w", 55, "-w", 45, "--rewind-blocks", 2, "--rewind-adv", 1],
+                                     ["-w", 60, "-w", 40, "-s", 30, "-s", 70, "--vote-sampling", "hypergeometric"]])
+def test_monte_carlo_agrees_with_analytic(run, tmp_path, options):
+    wins, diff_2, diff_6 = analytic_solution(run, options)
+    assert set(wins) == {"A0", "A1"}
+    run(*options, "-i", 2000, "--seed", 1, "--summary-only", "--output-format", "json", "-o", "batch.json")
+    with open(tmp_path / "batch.json") as ofh:
+        summary = json.load(ofh)["summary"]
+    n = summary["total"]
+    for a, probability in wins.items():
+        stderr = math.sqrt(max(probability * (1 - probability), 1 / n) / n)
+        assert abs(summary["total_wins"][a] / n - probability) <= TOLERANCE * stderr
+    assert abs(summary["pow"]["2-block-diff-average"] - diff_2) <= \
+        TOLERANCE * summary["pow"]["2-block-diff-stderr"] + 1e-6
+    assert abs(summary["pow"]["6-block-diff-average"] - diff_6) <= TOLERANCE * summary["pow"]["6-block-diff-stderr"]
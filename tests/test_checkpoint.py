@@ -0,0 +1,43 @@
+import os
+import signal
+import subprocess
+import time
+
+import pytest
+
+from helpers import read_ndjson, script_command
+
+BATCH = ["-w", 80, "-w", 20, "-i", 5000, "--seed", 5, "--output-format", "ndjson"]
+
+
+def interrupt_after_checkpoint(cwd, *arguments):
+    # Runs the batch until its first periodic checkpoint is saved, then interrupts it as Ctrl+C does
+    process = subprocess.Popen(script_command(*arguments), cwd=cwd, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while not os.path.exists(os.path.join(cwd, "batch.ckpt")):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            pytest.skip("The batch finished before its first checkpoint")
+        time.sleep(0.05)
+    process.send_signal(signal.SIGINT)
+    return process.wait(60)
+
+
+def test_resume_gives_the_uninterrupted_batch(run, tmp_path):
+    run(*BATCH, "-o", "uninterrupted.ndjson")
+    checkpoint = ["--checkpoint", "batch.ckpt", "--checkpoint-every", 1, "-o", "resumed.ndjson"]
+    assert interrupt_after_checkpoint(tmp_path, *BATCH, *checkpoint) == 7
+    result = run(*BATCH, *checkpoint, "--resume")
+    assert "Resuming batch from batch.ckpt at simulation" in result.stdout
+    assert read_ndjson(tmp_path / "resumed.ndjson") == read_ndjson(tmp_path / "uninterrupted.ndjson")
+    # A finished batch leaves nothing to resume
+    assert not os.path.exists(tmp_path / "batch.ckpt")
+    assert not os.path.exists(tmp_path / "batch.ckpt.sims")
+
+
+def test_resume_refuses_another_scenario(run, tmp_path):
+    checkpoint = ["--checkpoint", "batch.ckpt", "--checkpoint-every", 1, "-o", "resumed.ndjson"]
+    assert interrupt_after_checkpoint(tmp_path, *BATCH, *checkpoint) == 7
+    result = run(*BATCH, *checkpoint, "--resume", "--seed", 6, check=False)
+    assert result.returncode == 1
+    assert "was saved by a different scenario" in result.stdout
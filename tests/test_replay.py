@@ -0,0 +1,33 @@
+import pytest
+
+from helpers import read_ndjson
+
+
+@pytest.mark.parametrize("options", [[], ["-s", 40, "-s", 60],
+                                     ["-s", 40, "-s", 60, "--vote-sampling", "hypergeometric"],
+                                     ["--draw-mode", "direct"], ["--rewind-blocks", 2, "--rewind-adv", 1],
+                                     ["--engine", "event"]])
+def test_replay_sim_matches_batch(run, tmp_path, options):
+    run("-w", 40, "-w", 60, *options, "-i", 20, "--seed", 7, "--output-format", "ndjson", "-o", "batch.ndjson")
+    batch, summary = read_ndjson(tmp_path / "batch.ndjson")
+    for s in [0, 13, 19]:
+        run("-w", 40, "-w", 60, *options, "-i", 20, "--seed", 7, "--replay-sim", s, "--output-format", "ndjson",
+            "-o", "replay.ndjson")
+        replay, replay_summary = read_ndjson(tmp_path / "replay.ndjson")
+        assert replay == {s: batch[s]}
+        assert replay_summary["total"] == 1
+
+
+def test_replay_sim_beyond_batch_warns(run, tmp_path):
+    run("-w", 40, "-w", 60, "-i", 30, "--seed", 7, "--output-format", "ndjson", "-o", "batch.ndjson")
+    batch, summary = read_ndjson(tmp_path / "batch.ndjson")
+    result = run("-w", 40, "-w", 60, "-i", 10, "--seed", 7, "--replay-sim", 25, "--output-format", "ndjson",
+                 "-o", "replay.ndjson")
+    assert "Warning: --replay-sim 25" in result.stdout
+    assert read_ndjson(tmp_path / "replay.ndjson")[0] == {25: batch[25]}
+
+
+def test_replay_sim_requires_seed(run):
+    result = run("-w", 40, "-w", 60, "--replay-sim", 3, check=False)
+    assert result.returncode == 1
+    assert "--replay-sim requires --seed" in result.stdout
@@ -0,0 +1,86 @@
+import json
+import operator
+import statistics
+
+import pytest
+
+from helpers import read_ndjson
+
+BATCHES = [["-w", 40, "-w", 60, "-s", 50, "-s", 50, "--seed", 1],
+           ["-w", 30, "-w", 70, "-s", 60, "-s", 40, "--seed", 2]]
+OPERATORS = {"<=": operator.le, ">=": operator.ge, "!=": operator.ne, "<": operator.lt, ">": operator.gt,
+             "=": operator.eq}
+
+
+def stored_rows(sims, batch):
+    # Rows of the results store of the simulations of an ndjson output file
+    rows = []
+    for sim, record in sorted(sims.items()):
+        adversaries = record["adversaries"]
+        rows.append({"sim": sim, "batch": batch, "winner": record["6-block-diff_winner"],
+                     "2-block-diff": record.get("2-block-diff", -1), "6-block-diff": record["6-block-diff"],
+                     **{key + "." + a: adversaries[a][key] for a in adversaries
+                        for key in ["sum_blocks", "validated_blocks", "invalidated_blocks"]}})
+    return rows
+
+
+def parse_condition(condition):
+    # Column, comparison and value of a --where condition on the rows of stored_rows()
+    for op, compare in OPERATORS.items():
+        if op in condition:
+            column, value = condition.split(op, 1)
+            return column, compare, value if column == "winner" else int(value)
+
+
+@pytest.fixture
+def store(run, tmp_path):
+    # Results store of two batches, and the rows expected in it
+    rows = []
+    for batch, options in enumerate(BATCHES):
+        run(*options, "-i", 60, "--output-format", "ndjson", "-o", "batch.ndjson", "--results-store", "results")
+        sims, summary = read_ndjson(tmp_path / "batch.ndjson")
+        assert summary["total"] == len(sims) == 60
+        rows += stored_rows(sims, batch)
+    return rows
+
+
+def query(run, *conditions):
+    arguments = []
+    for condition in conditions:
+        arguments += ["--where", condition]
+    return json.loads(run("--query-store", "results", *arguments).stdout)
+
+
+def test_store_header(store, tmp_path):
+    with open(tmp_path / "results" / "header.json") as hfh:
+        header = json.load(hfh)
+    assert header["rows"] == len(store)
+    assert [(batch["first_row"], batch["rows"]) for batch in header["batches"]] == [(0, 60), (60, 60)]
+    assert [batch["scenario"]["seed"] for batch in header["batches"]] == [1, 2]
+    assert [column[0] for column in header["columns"]] == \
+        ["sim", "batch", "winner", "2-block-diff", "6-block-diff", "sum_blocks.A0", "sum_blocks.A1",
+         "validated_blocks.A0", "validated_blocks.A1", "invalidated_blocks.A0", "invalidated_blocks.A1", "weight"]
+
+
+@pytest.mark.parametrize("conditions", [[], ["winner=A1"], ["batch=1", "2-block-diff>=0"],
+                                        ["sum_blocks.A0>=3", "6-block-diff<40"], ["sim>1000"]])
+def test_query_matches_simulations(run, store, conditions):
+    result = query(run, *conditions)
+    matching = [row for row in store
+                if all(compare(row[column], value) for column, compare, value in map(parse_condition, conditions))]
+    assert result["store_rows"] == len(store)
+    assert result["total"] == len(matching)
+    assert result["where"] == conditions
+    assert [batch["batch"] for batch in result["batches"]] == sorted({row["batch"] for row in matching})
+    assert result["total_wins"] == {a: sum(row["winner"] == a for row in matching) for a in ["A0", "A1"]}
+    if not matching:
+        return
+    for key in ["2-block-diff", "6-block-diff"]:
+        assert result["pow"][key + "-average"] == pytest.approx(statistics.mean(row[key] for row in matching),
+                                                                abs=1e-6)
+    for a in ["A0", "A1"]:
+        assert result["sum_blocks"][a]["average"] == \
+            pytest.approx(statistics.mean(row["sum_blocks." + a] for row in matching), abs=1e-6)
+        for key in ["validated_blocks", "invalidated_blocks"]:
+            assert result["pos"][a][key + "-average"] == \
+                pytest.approx(statistics.mean(row[key + "." + a] for row in matching), abs=1e-6)
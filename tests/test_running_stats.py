@@ -0,0 +1,54 @@
+import random
+import statistics
+
+import pytest
+
+from invalidationgame import RunningStats
+
+
+def running_stats(values):
+    stats = RunningStats()
+    for x in values:
+        stats.add(x)
+    return stats
+
+
+def test_add_matches_statistics():
+    values = [random.Random(1).gauss(10, 3) for _ in range(500)]
+    stats = running_stats(values)
+    assert stats.n == len(values)
+    assert stats.mean == pytest.approx(statistics.mean(values))
+    assert stats.m2 / (stats.n - 1) == pytest.approx(statistics.variance(values))
+
+
+@pytest.mark.parametrize("sizes", [[250, 250], [1, 499], [499, 1], [100, 0, 150, 250], [7] * 71 + [3]])
+def test_merge_matches_adding_every_value(sizes):
+    generator = random.Random(2)
+    values = [generator.randint(-5, 40) for _ in range(sum(sizes))]
+    merged = RunningStats()
+    start = 0
+    for size in sizes:
+        part = running_stats(values[start:start + size])
+        merged.merge(part.n, part.mean, part.m2)
+        start += size
+    expected = running_stats(values)
+    assert merged.n == expected.n
+    assert merged.mean == pytest.approx(expected.mean)
+    assert merged.m2 == pytest.approx(expected.m2)
+    assert merged.stderr() == pytest.approx(expected.stderr())
+    assert merged.confidence_interval(1.96) == pytest.approx(expected.confidence_interval(1.96))
+
+
+def test_merge_into_empty_and_of_empty():
+    stats = RunningStats()
+    stats.merge(0, 0.0, 0.0)
+    assert (stats.n, stats.mean, stats.m2) == (0, 0.0, 0.0)
+    stats.merge(4, 2.5, 5.0)
+    assert (stats.n, stats.mean, stats.m2) == (4, 2.5, 5.0)
+    stats.merge(0, 0.0, 0.0)
+    assert (stats.n, stats.mean, stats.m2) == (4, 2.5, 5.0)
+
+
+def test_stderr_of_fewer_than_two_values():
+    assert running_stats([]).stderr() == 0.0
+    assert running_stats([3.0]).stderr() == 0.0
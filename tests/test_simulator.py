@@ -0,0 +1,62 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from helpers import ROOT, TIMING_KEYS, read_ndjson
+from invalidationgame import Scenario, Simulator
+
+
+def summary_of(result):
+    return {key: value for key, value in result.summary.items() if key not in TIMING_KEYS}
+
+
+def sims_of(result):
+    # Simulations by number, as read back from the JSON output
+    return {int(s): json.loads(json.dumps(sim)) for s, sim in result.sims.items()}
+
+
+@pytest.mark.parametrize("command_options, stake, options",
+                         [([], [], {}), (["-s", 50, "-s", 50], [50, 50], {}),
+                          (["-s", 50, "-s", 50, "--vote-sampling", "hypergeometric", "--rewind-blocks", 2,
+                            "--rewind-adv", 1], [50, 50], {"votesampling": "hypergeometric", "rewind_blocks": 2,
+                                                           "rewind_adv": 1}),
+                          (["--engine", "event"], [], {"engine": "event"})])
+def test_run_matches_command_line(run, tmp_path, command_options, stake, options):
+    run("-w", 60, "-w", 40, *command_options, "-i", 15, "--seed", 3, "--output-format", "ndjson", "-o", "out.ndjson")
+    sims, summary = read_ndjson(tmp_path / "out.ndjson")
+    result = Simulator().run(Scenario([60, 40], stake, 15, seed=3, keep_simulations=True, **options))
+    assert summary_of(result) == summary
+    assert sims_of(result) == sims
+
+
+def test_runs_are_independent():
+    # Simulators share no state: interleaved and repeated runs give the results of a fresh Simulator
+    pow_scenario = Scenario([70, 30], simulations=20, seed=5, keep_simulations=True)
+    pos_scenario = Scenario([70, 30], [40, 60], simulations=20, seed=5, config={"block_hash_space": 1000})
+    expected_pow = Simulator().run(pow_scenario)
+    expected_pos = Simulator({"pos_avg_ticket_pool_size": 4096}).run(pos_scenario)
+    first, second = Simulator(), Simulator({"pos_avg_ticket_pool_size": 4096})
+    for _ in range(2):
+        pow_result = first.run(pow_scenario)
+        assert summary_of(second.run(pos_scenario)) == summary_of(expected_pos)
+        assert summary_of(pow_result) == summary_of(expected_pow)
+        assert sims_of(pow_result) == sims_of(expected_pow)
+    assert second.config["block_hash_space"] == 10000
+
+
+def test_sweep_returns_its_rows():
+    result = Simulator().run(Scenario([60, 40], simulations=10, seed=9, rewind_adv=1, sweeppow=[30, 40]))
+    assert [row["attacker_pow"] for row in result.summary["points"]] == [30, 40]
+    assert result.sims == {}
+
+
+def test_import_has_no_side_effects():
+    # Importing the module parses no command line and loads neither the job server nor the worker pools
+    code = ("import sys, invalidationgame; "
+            "modules = ('asyncio', 'multiprocessing', 'concurrent.futures', 'mmap'); "
+            "print(sorted(m for m in modules if m in sys.modules), "
+            "hasattr(invalidationgame, 'args'), hasattr(invalidationgame, 'parser'))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ["[]", "False", "False"]